@@ -5,15 +5,6 @@ import os
 from dotenv import load_dotenv
 import sys
 from pathlib import Path
-import json
-from bson import ObjectId
-
-# Tạo lớp JSONEncoder tùy chỉnh để xử lý ObjectId
-class CustomJSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, ObjectId):
-            return str(obj)
-        return super().default(obj)
 
 # Load environment variables
 load_dotenv()
@@ -21,27 +12,112 @@ load_dotenv()
 # Thêm thư mục hiện tại vào sys.path để Python tìm thấy các module
 sys.path.append(str(Path(__file__).parent))
 
+from services.price_store import PriceStore
+from services.beta_moments import MomentUpdater
+from services.portfolio_risk import PortfolioRiskEngine
+from services.indicators import IndicatorEngine
+from services.model_registry import ModelRegistry
+from services.feature_store import FeatureStore
+from services.db_indexes import ensure_indexes
+from services.metrics import init_metrics
+from services.json_provider import AppJSONProvider
+
+def create_mongo_client():
+    """
+    Create the MongoClient with an explicit pool size and timeouts
+
+    No connection is opened until the first operation (connect=False), so
+    the client can be created in a pre-fork server and replaced per worker.
+    """
+    return MongoClient(
+        os.getenv("MONGO_URI", "mongodb://localhost:27017/"),
+        maxPoolSize=int(os.getenv("MONGO_MAX_POOL_SIZE", "50")),
+        minPoolSize=int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+        connectTimeoutMS=int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+        serverSelectionTimeoutMS=int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+        socketTimeoutMS=int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "300000")),
+        waitQueueTimeoutMS=int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "30000")),
+        connect=False,
+    )
+
+
+def bind_database(app, client):
+    """
+    Point the app and its caches at a MongoClient
+
+    Used by pre-fork servers: each worker binds its own client after the
+    fork while keeping the caches loaded by the master process.
+    """
+    app.mongo_client = client
+    app.db = client.intelligent_system_db  # Tên database
+    if app.price_store is not None:
+        app.price_store.db = app.db
+
+
+def release_database(app):
+    """Close the app's MongoClient, e.g. in the master process before workers are forked"""
+    client = getattr(app, 'mongo_client', None)
+    if client is not None:
+        client.close()
+
+
 # Tạo và cấu hình ứng dụng
 def create_app():
     app = Flask(__name__)
-    CORS(app)
+    # Cho phép frontend đọc header phân trang và thời gian xử lý từng giai đoạn
+    CORS(app, expose_headers=['X-Next-Cursor', 'Server-Timing'])
+    # Đo thời gian, số request và kích thước payload của mọi endpoint
+    init_metrics(app)
     
-    # Cấu hình JSONEncoder tùy chỉnh
-    app.json_encoder = CustomJSONEncoder
+    # JSON provider xử lý ObjectId, ngày tháng và mảng NumPy (dùng orjson nếu có, FAST_JSON=0 để tắt)
+    app.json = AppJSONProvider(app)
     
     # Kết nối đến MongoDB
     try:
-        mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
-        client = MongoClient(mongo_uri)
-        app.db = client.intelligent_system_db  # Tên database
+        app.mongo_client = create_mongo_client()
+        app.db = app.mongo_client.intelligent_system_db  # Tên database
         # Add a flag to indicate successful connection
         app.db_connected = True
+        # Bộ nhớ đệm giá dùng chung cho các endpoint tính toán
+        app.price_store = PriceStore(app.db)
+        # Ma trận hiệp phương sai của danh mục được cache theo (danh sách mã, cửa sổ)
+        app.portfolio_risk = PortfolioRiskEngine(app.price_store,
+                                                 max_entries=int(os.getenv("PORTFOLIO_CACHE_SIZE", "64")))
+        # Trạng thái chỉ báo kỹ thuật theo từng mã, cập nhật theo từng phiên mới
+        app.indicator_engine = IndicatorEngine(app.price_store)
         print("MongoDB connection successful")
+        # Tạo các index phục vụ truy vấn (bỏ qua nếu MONGO_ENSURE_INDEXES=0)
+        if os.getenv("MONGO_ENSURE_INDEXES", "1") == "1":
+            ensure_indexes(app.db)
+        # Nạp sẵn danh sách MarketCode/Ticker cho các dropdown (WARM_LISTINGS=1)
+        if os.getenv("WARM_LISTINGS", "0") == "1":
+            app.price_store.warm_listings()
     except Exception as e:
         print(f"MongoDB connection error: {e}")
+        app.mongo_client = None
         app.db = None
         app.db_connected = False
+        app.price_store = None
+        app.portfolio_risk = None
+        app.indicator_engine = None
     
+    # Cập nhật beta tăng dần sau mỗi lần import (INCREMENTAL_BETA=0 để tắt)
+    app.incremental_beta = os.getenv("INCREMENTAL_BETA", "1") == "1"
+    # Cập nhật đó chạy trên một thread nền, không làm chậm request import (BETA_UPDATE_BACKGROUND=0 để chạy ngay)
+    app.moment_updater = MomentUpdater(background=os.getenv("BETA_UPDATE_BACKGROUND", "0") == "1")
+
+    # Kho lưu các mô hình SVM đã huấn luyện, dùng lại khi dữ liệu chưa thay đổi
+    app.model_registry = ModelRegistry(
+        os.getenv("MODEL_REGISTRY_DIR", str(Path(__file__).parent / "model_registry")),
+        max_entries=int(os.getenv("MODEL_REGISTRY_SIZE", "32"))
+    )
+
+    # Ma trận chỉ báo kỹ thuật theo từng mã, tính một lần cho mỗi phiên bản dữ liệu
+    app.feature_store = FeatureStore(
+        os.getenv("FEATURE_STORE_DIR", str(Path(__file__).parent / "feature_store")),
+        max_entries=int(os.getenv("FEATURE_STORE_SIZE", "4096"))
+    )
+
     # Import các routes
     from routes.api import api
     
@@ -75,7 +151,6 @@ def create_app():
     
     return app
 
-app = create_app()
-
+# Máy chủ phát triển; chạy production qua wsgi.py (gunicorn -c gunicorn.conf.py wsgi:application)
 if __name__ == '__main__':
-    app.run(debug=True,host="0.0.0.0", port=5001)
\ No newline at end of file
+    create_app().run(debug=os.getenv("FLASK_DEBUG", "1") == "1", host="0.0.0.0", port=5001, threaded=True)
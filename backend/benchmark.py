@@ -0,0 +1,319 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Thêm thư mục hiện tại vào sys.path để Python tìm thấy các module
+sys.path.append(str(Path(__file__).parent))
+
+from services.beta_calculation import calculate_all_stock_betas, get_beta_for_stock
+from services.svm_analysis import (analyze_stocks_with_svm, calculate_technical_indicators, get_svm_n_jobs,
+                                   prepare_features, train_svm_model)
+
+# Kích thước dữ liệu của từng mức: số mã x số phiên; SVM chỉ huấn luyện trên svm_tickers mã đầu tiên
+TIERS = {
+    'small': {'tickers': 10, 'days': 250, 'svm_tickers': 10},
+    'medium': {'tickers': 100, 'days': 500, 'svm_tickers': 20},
+    'large': {'tickers': 500, 'days': 1250, 'svm_tickers': 40},
+}
+
+CASES = ['get_beta_for_stock', 'calculate_all_stock_betas', 'calculate_technical_indicators', 'prepare_features',
+         'train_svm_model', 'analyze_stocks_with_svm']
+
+# Các phép đo có tìm tham số song song (joblib/loky): tracemalloc không thấy bộ nhớ của tiến trình con,
+# nên lần đo bộ nhớ của chúng chạy với SVM_N_JOBS=1
+PARALLEL_CASES = {'train_svm_model', 'analyze_stocks_with_svm'}
+
+# Số mã dùng cho phép đo get_beta_for_stock (mỗi lần gọi tính cho một mã)
+SINGLE_BETA_TICKERS = 20
+
+
+def generate_market_data(tickers, days, seed=0, market_code='HOSE', index_market_code='HSX', index_code='VNINDEX',
+                         start='2020-01-01', missing_rate=0.01):
+    """
+    Generate synthetic stock_data and market_index_data frames
+
+    Index returns are Gaussian and each stock follows a one-factor model
+    with its own Beta, so Beta estimates and SVM labels behave like real
+    data. A small share of stock rows is dropped to mimic suspended
+    trading days.
+
+    Parameters:
+    tickers (int): Number of stocks
+    days (int): Number of trading days (business days from start)
+    seed (int): Random seed, the same seed gives the same frames
+    missing_rate (float): Share of stock rows removed at random
+
+    Returns:
+    tuple: (stock_data, market_index_data) DataFrames with the collections' column layout
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(start, periods=days)
+
+    # Chỉ số thị trường
+    market_returns = rng.normal(0.0003, 0.012, days)
+    market_returns[0] = 0.0
+    close_index = 1000 * np.exp(np.cumsum(market_returns))
+    open_index = close_index * np.exp(rng.normal(0, 0.003, days))
+    market_index_data = pd.DataFrame({
+        'MarketCode': index_market_code,
+        'IndexCode': index_code,
+        'TradeDate': dates,
+        'CurrentIndex': close_index,
+        'OpenIndex': open_index,
+        'HighestIndex': np.maximum(open_index, close_index) * (1 + np.abs(rng.normal(0, 0.004, days))),
+        'LowestIndex': np.minimum(open_index, close_index) * (1 - np.abs(rng.normal(0, 0.004, days))),
+        'CloseIndex': close_index,
+        'TotalVolume': rng.integers(10 ** 7, 10 ** 8, days).astype(float),
+        'TotalValue': rng.integers(10 ** 11, 10 ** 12, days).astype(float),
+    })
+
+    # Cổ phiếu theo mô hình một nhân tố: r = beta * r_market + nhiễu riêng
+    betas = rng.uniform(0.3, 1.8, tickers)
+    returns = betas[:, None] * market_returns[None, :] + rng.normal(0, 0.015, (tickers, days))
+    returns[:, 0] = 0.0
+    close = rng.uniform(10, 100, tickers)[:, None] * np.exp(np.cumsum(returns, axis=1))
+    open_price = close * np.exp(rng.normal(0, 0.005, (tickers, days)))
+    high = np.maximum(open_price, close) * (1 + np.abs(rng.normal(0, 0.008, (tickers, days))))
+    low = np.minimum(open_price, close) * (1 - np.abs(rng.normal(0, 0.008, (tickers, days))))
+    stock_data = pd.DataFrame({
+        'MarketCode': market_code,
+        'Ticker': np.repeat([f"S{index:04d}" for index in range(tickers)], days),
+        'TradeDate': np.tile(dates.values, tickers),
+        'OpenPrice': open_price.ravel(),
+        'HighestPrice': high.ravel(),
+        'LowestPrice': low.ravel(),
+        'ClosePrice': close.ravel(),
+        'TotalVolume': np.round(rng.lognormal(11, 1, tickers * days)),
+    })
+    if missing_rate > 0:
+        stock_data = stock_data[rng.random(len(stock_data)) >= missing_rate].reset_index(drop=True)
+
+    return stock_data, market_index_data
+
+
+@contextlib.contextmanager
+def single_process():
+    """Run the SVM grid search in this process (SVM_N_JOBS=1) inside the block"""
+    previous = os.environ.get('SVM_N_JOBS')
+    os.environ['SVM_N_JOBS'] = '1'
+    try:
+        yield
+    finally:
+        if previous is None:
+            os.environ.pop('SVM_N_JOBS', None)
+        else:
+            os.environ['SVM_N_JOBS'] = previous
+
+
+def measure(fn, repeat, parallel=False):
+    """
+    Time fn over several runs, then run it once more under tracemalloc for its peak memory
+
+    tracemalloc only traces this process, so for a parallel case the memory
+    run uses a single process (SVM_N_JOBS=1) and counts every allocation of
+    the grid search; its wall times keep the configured SVM_N_JOBS.
+
+    Returns:
+    dict: Wall times in seconds (min, median, max, runs), peak_memory_mb and the n_jobs of the memory run
+    """
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - started)
+
+    # Đo bộ nhớ ở lần chạy riêng để tracemalloc không làm sai lệch thời gian
+    with single_process() if parallel else contextlib.nullcontext():
+        tracemalloc.start()
+        try:
+            fn()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        memory_n_jobs = get_svm_n_jobs() if parallel else None
+
+    return {
+        'wall_time': {'min': min(runs), 'median': statistics.median(runs), 'max': max(runs), 'runs': runs},
+        'peak_memory_mb': peak / 2 ** 20,
+        'peak_memory_n_jobs': memory_n_jobs,
+    }
+
+
+def build_cases(stock_data, market_data, svm_tickers):
+    """
+    Benchmark cases of one tier
+
+    Returns:
+    list: (name, callable, items processed per call, unit)
+    """
+    tickers = sorted(stock_data['Ticker'].unique())
+    by_ticker = {ticker: group for ticker, group in stock_data.groupby('Ticker')}
+    single = tickers[:SINGLE_BETA_TICKERS]
+    market_code = stock_data['MarketCode'].iloc[0]
+
+    svm_data = stock_data[stock_data['Ticker'].isin(tickers[:svm_tickers])]
+    with contextlib.redirect_stdout(io.StringIO()):
+        beta_values = calculate_all_stock_betas(stock_data, market_data)
+        svm_codes = [f"{market_code}:{ticker}" for ticker in tickers[:svm_tickers]]
+        svm_betas = beta_values[beta_values['stock_code'].isin(svm_codes)]
+        X, y, _, _ = prepare_features(svm_data, svm_betas, 5)
+
+    def single_betas():
+        for ticker in single:
+            get_beta_for_stock(by_ticker[ticker], market_data, f"{market_code}:{ticker}")
+
+    def indicators():
+        for group in by_ticker.values():
+            calculate_technical_indicators(group)
+
+    return [
+        ('get_beta_for_stock', single_betas, len(single), 'tickers'),
+        ('calculate_all_stock_betas', lambda: calculate_all_stock_betas(stock_data, market_data),
+         len(tickers), 'tickers'),
+        ('calculate_technical_indicators', indicators, len(stock_data), 'rows'),
+        ('prepare_features', lambda: prepare_features(stock_data, beta_values, 5), len(stock_data), 'rows'),
+        ('train_svm_model', lambda: train_svm_model(X, y, 5), len(X), 'samples'),
+        ('analyze_stocks_with_svm', lambda: analyze_stocks_with_svm(svm_data, svm_betas, 5), len(svm_data), 'rows'),
+    ]
+
+
+def run_benchmarks(tiers, cases=None, repeat=3, seed=0, verbose=False):
+    """
+    Run the selected cases on every tier
+
+    Parameters:
+    tiers (dict): Tier name -> {'tickers', 'days', 'svm_tickers'}
+    cases (list, optional): Case names to run, defaults to all of CASES
+    repeat (int): Timed runs per case
+    seed (int): Seed of the synthetic data
+
+    Returns:
+    list: One result dict per tier and case
+    """
+    cases = cases or CASES
+    results = []
+    for tier_name, tier in tiers.items():
+        stock_data, market_data = generate_market_data(tier['tickers'], tier['days'], seed=seed)
+        print(f"[{tier_name}] {tier['tickers']} tickers x {tier['days']} days ({len(stock_data)} rows)",
+              file=sys.stderr)
+
+        for name, fn, items, unit in build_cases(stock_data, market_data, tier['svm_tickers']):
+            if name not in cases:
+                continue
+            output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+            with output:
+                measured = measure(fn, repeat, parallel=name in PARALLEL_CASES)
+            best = measured['wall_time']['min']
+            result = {
+                'tier': tier_name,
+                'tickers': tier['tickers'],
+                'days': tier['days'],
+                'case': name,
+                'items': items,
+                'unit': unit,
+                'throughput': items / best if best > 0 else None,
+            }
+            result.update(measured)
+            results.append(result)
+            print(f"  {name:32s} {measured['wall_time']['median'] * 1000:10.1f} ms  "
+                  f"{result['throughput']:12.1f} {unit}/s  {measured['peak_memory_mb']:8.1f} MB", file=sys.stderr)
+    return results
+
+
+def environment_info():
+    import sklearn
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'scikit-learn': sklearn.__version__,
+        'svm_n_jobs': get_svm_n_jobs(),
+    }
+
+
+def compare(results, baseline):
+    """Print the median time of each case relative to a previous report"""
+    previous = {(row['tier'], row['case']): row for row in baseline['results']}
+    print(f"{'tier':8s} {'case':32s} {'baseline ms':>12s} {'current ms':>12s} {'ratio':>8s}", file=sys.stderr)
+    for row in results:
+        before = previous.get((row['tier'], row['case']))
+        if before is None:
+            continue
+        old, new = before['wall_time']['median'], row['wall_time']['median']
+        print(f"{row['tier']:8s} {row['case']:32s} {old * 1000:12.1f} {new * 1000:12.1f} {new / old:8.2f}x",
+              file=sys.stderr)
+
+
+def parse_tier(value):
+    """Parse a custom tier written as NAME=TICKERSxDAYS (SVM on up to 20 tickers)"""
+    try:
+        name, size = value.split('=', 1)
+        tickers, days = (int(part) for part in size.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid tier '{value}', expected NAME=TICKERSxDAYS")
+    return name, {'tickers': tickers, 'days': days, 'svm_tickers': min(tickers, 20)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Beta and SVM services on synthetic data")
+    parser.add_argument('--tiers', default='small,medium',
+                        help=f"Comma-separated tiers among {', '.join(TIERS)} (default small,medium)")
+    parser.add_argument('--tier', action='append', type=parse_tier, default=[],
+                        help="Extra tier as NAME=TICKERSxDAYS, may be repeated")
+    parser.add_argument('--cases', default=','.join(CASES), help="Comma-separated cases to run (default all)")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per case (default 3)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic data (default 0)")
+    parser.add_argument('--output', help="Write the JSON report to this file instead of stdout")
+    parser.add_argument('--compare', help="Previous JSON report to compare median times against")
+    parser.add_argument('--verbose', action='store_true', help="Keep the services' own log output")
+    args = parser.parse_args()
+
+    tiers = {}
+    for name in filter(None, args.tiers.split(',')):
+        if name not in TIERS:
+            parser.error(f"Unknown tier '{name}'")
+        tiers[name] = TIERS[name]
+    tiers.update(args.tier)
+
+    cases = [case for case in args.cases.split(',') if case]
+    unknown = set(cases) - set(CASES)
+    if unknown:
+        parser.error(f"Unknown cases: {', '.join(sorted(unknown))}")
+
+    results = run_benchmarks(tiers, cases, max(args.repeat, 1), args.seed, args.verbose)
+    report = {
+        'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'environment': environment_info(),
+        'config': {'seed': args.seed, 'repeat': args.repeat, 'tiers': tiers},
+        'results': results,
+    }
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            compare(results, json.load(baseline_file))
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
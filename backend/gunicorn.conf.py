@@ -0,0 +1,57 @@
+import multiprocessing
+import os
+
+# Cấu hình gunicorn cho chế độ production: gunicorn -c gunicorn.conf.py wsgi:application
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5001")
+
+# Mỗi worker là một tiến trình riêng, nhiều phân tích chạy song song thay vì chờ nhau;
+# các thread trong worker phục vụ các request đọc dữ liệu nhẹ
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+
+# Chia số nhân CPU cho các worker: mỗi worker tự mở SVM_N_JOBS tiến trình tìm tham số,
+# không giới hạn thì tổng số tiến trình lên tới workers x số nhân
+os.environ.setdefault("SVM_N_JOBS", str(max(1, multiprocessing.cpu_count() // workers)))
+
+# Huấn luyện SVM trên nhiều mã có thể mất vài phút
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "300"))
+graceful_timeout = 30
+keepalive = 5
+
+# Tạo app và nạp sẵn dữ liệu một lần trong master, các worker dùng chung bộ nhớ sau khi fork
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+accesslog = "-"
+errorlog = "-"
+
+# Mỗi worker ghi số liệu vào thư mục này, /api/metrics trả tổng của mọi worker
+os.environ.setdefault("METRICS_DIR", "/tmp/intelligent_system_metrics")
+
+
+def on_starting(server):
+    """Remove the metrics snapshots left by a previous run of the server"""
+    from services.metrics import clear_metrics_dir
+
+    clear_metrics_dir(os.environ["METRICS_DIR"])
+
+
+def when_ready(server):
+    """Close the master's MongoClient used for warmup before any worker is forked"""
+    if not server.cfg.preload_app:
+        return
+    from app import release_database
+    from wsgi import application
+
+    release_database(application)
+
+
+def post_fork(server, worker):
+    """Give each worker its own MongoClient; connections must not be shared across a fork"""
+    if not server.cfg.preload_app:
+        return
+    from app import bind_database, create_mongo_client
+    from wsgi import application
+
+    if application.db_connected:
+        bind_database(application, create_mongo_client())
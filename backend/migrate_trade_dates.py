@@ -0,0 +1,39 @@
+import argparse
+import sys
+from pathlib import Path
+
+# Thêm thư mục hiện tại vào sys.path để Python tìm thấy các module
+sys.path.append(str(Path(__file__).parent))
+
+from services.data_import import TRADE_DATE_COLLECTIONS, migrate_trade_dates
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="One-off migration converting string TradeDate values to BSON dates"
+    )
+    parser.add_argument('--collections', default=','.join(TRADE_DATE_COLLECTIONS),
+                        help=f"Comma-separated collections to migrate (default {','.join(TRADE_DATE_COLLECTIONS)})")
+    parser.add_argument('--batch-size', type=int, default=None,
+                        help="Documents per batch (default IMPORT_CHUNK_SIZE)")
+    args = parser.parse_args()
+
+    collections = [name for name in args.collections.split(',') if name]
+    unknown = set(collections) - set(TRADE_DATE_COLLECTIONS)
+    if unknown:
+        parser.error(f"Unknown collections: {', '.join(sorted(unknown))}")
+
+    from app import create_mongo_client
+
+    client = create_mongo_client()
+    db = client.intelligent_system_db
+    try:
+        for collection in collections:
+            result = migrate_trade_dates(db, collection, args.batch_size)
+            print(f"{collection}: {result['converted']} converted, {result['unparsed']} unparsed strings kept")
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
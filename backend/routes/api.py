@@ -1,12 +1,25 @@
-import base64
-
 import numpy as np
-from flask import Blueprint, jsonify, request, current_app
+from bson import ObjectId
+from flask import Blueprint, Response, json, jsonify, request, current_app, stream_with_context
 from models.item import create_item_model, validate_item
 import pandas as pd
 from datetime import datetime
-from services.beta_calculation import calculate_all_stock_betas, get_beta_for_stock, get_beta_portfolio
+from services.beta_calculation import (calculate_all_stock_betas, calculate_betas_batch, calculate_rolling_betas,
+                                      get_beta_for_stock)
+from services.beta_store import beta_record, save_beta, save_betas
+from services.beta_moments import earliest_trade_dates, on_index_import, on_stock_import, rebuild_market_moments
 from services.svm_analysis import analyze_stocks_with_svm, plot_confusion_matrix, plot_confidence_distribution
+from services.model_registry import make_model_key
+from services.price_store import benchmark_key
+from services.data_import import (INDEX_NUMERIC_FIELDS, STOCK_NUMERIC_FIELDS, iter_file_chunks,
+                                  normalize_trade_dates, stream_import)
+from services.data_query import build_query, find_page, iter_ndjson, parse_date, parse_fields, parse_limit
+from services.db_indexes import ensure_indexes, index_report
+from services.market_snapshot import (SNAPSHOT_COLUMNS, join_stock_beta, read_snapshot, rebuild_snapshot,
+                                      refresh_market_nav, snapshot_built, update_latest_snapshot)
+from services.json_provider import records_to_columns
+from services.metrics import PROMETHEUS_CONTENT_TYPE, render_metrics, stage
+from services.jobs import JOB_TYPES, create_job, job_status, load_job_result, parse_job_id, report_progress
 
 api = Blueprint('api', __name__)
 
@@ -95,27 +108,25 @@ def import_data():
         import_id = current_app.db.imports.insert_one(import_info).inserted_id
         import_id_str = str(import_id)
         
+        # Chuyển đổi toàn bộ cột ngày sang kiểu ngày (BSON date) trong một lượt
+        trade_dates = normalize_trade_dates([record.get('TradeDate') for record in data])
+
         # Thêm import_id vào mỗi record
-        for record in data:
+        for record, trade_date in zip(data, trade_dates):
             record['import_id'] = import_id_str
-
-            # Chuyển đổi ngày từ chuỗi sang định dạng ngày nếu cần
-            if 'TradeDate' in record and isinstance(record['TradeDate'], str):
-                try:
-                    # Thử các định dạng ngày tháng phổ biến
-                    for date_format in ['%Y-%m-%d', '%Y/%m/%d', '%m/%d/%Y', '%d/%m/%Y']:
-                        try:
-                            date_obj = datetime.strptime(record['TradeDate'], date_format)
-                            record['TradeDate'] = date_obj.strftime('%Y-%m-%d')
-                            break
-                        except ValueError:
-                            continue
-                except Exception:
-                    # Nếu không thể chuyển đổi, giữ nguyên giá trị
-                    pass
+            if 'TradeDate' in record:
+                record['TradeDate'] = trade_date
         
         # Lưu dữ liệu vào collection "stock_data"
         current_app.db.stock_data.insert_many(data)
+
+        # Cập nhật bản ghi mới nhất của từng mã và NAV của thị trường
+        market_codes = update_latest_snapshot(current_app.db, pd.DataFrame(data))
+        refresh_market_nav(current_app.db, market_codes)
+
+        # Làm mới bộ nhớ đệm giá và trạng thái beta của các mã vừa được import
+        refresh_after_stock_import({record.get('MarketCode') for record in data},
+                                   earliest_trade_dates(pd.DataFrame(data)), import_id)
         
         return jsonify({
             "status": "success", 
@@ -149,9 +160,14 @@ def import_market_index():
         import_id = current_app.db.market_index_imports.insert_one(import_info).inserted_id
         import_id_str = str(import_id)
         
+        # Chuyển đổi toàn bộ cột ngày sang kiểu ngày (BSON date) trong một lượt
+        trade_dates = normalize_trade_dates([record.get('TradeDate') for record in data])
+
         # Thêm import_id vào mỗi record và xử lý dữ liệu
-        for record in data:
+        for record, trade_date in zip(data, trade_dates):
             record['import_id'] = import_id_str
+            if 'TradeDate' in record:
+                record['TradeDate'] = trade_date
             
             # Chuyển đổi các trường dữ liệu từ chuỗi thành số nếu cần
             for field in ['OpenIndex', 'HighestIndex', 'LowestIndex', 'CloseIndex', 'TotalVolume', 'TotalValue']:
@@ -163,24 +179,13 @@ def import_market_index():
                     except (ValueError, TypeError):
                         # Nếu không thể chuyển đổi, giữ nguyên giá trị
                         pass
-
-            # Chuyển đổi ngày từ chuỗi sang định dạng ngày nếu cần
-            if 'TradeDate' in record and isinstance(record['TradeDate'], str):
-                try:
-                    # Thử các định dạng ngày tháng phổ biến
-                    for date_format in ['%Y-%m-%d', '%Y/%m/%d', '%m/%d/%Y', '%d/%m/%Y']:
-                        try:
-                            date_obj = datetime.strptime(record['TradeDate'], date_format)
-                            record['TradeDate'] = date_obj.strftime('%Y-%m-%d')
-                            break
-                        except ValueError:
-                            continue
-                except Exception:
-                    # Nếu không thể chuyển đổi, giữ nguyên giá trị
-                    pass
         
         # Lưu dữ liệu vào collection "market_index_data"
         current_app.db.market_index_data.insert_many(data)
+
+        # Làm mới bộ nhớ đệm chỉ số và trạng thái beta của các sàn dùng chỉ số này
+        refresh_after_index_import({record.get('MarketCode') for record in data},
+                                   earliest_trade_dates(pd.DataFrame(data), 'IndexCode'), import_id)
         
         return jsonify({
             "status": "success", 
@@ -190,6 +195,147 @@ def import_market_index():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def refresh_after_stock_import(market_codes, earliest_dates, import_id=None):
+    """Invalidate the cached prices of imported markets and update the Beta moments of the imported tickers"""
+    current_app.price_store.invalidate_stocks(market_codes, import_id)
+    if not current_app.incremental_beta:
+        return
+    # Lỗi được ghi log và không làm hỏng lần import
+    current_app.moment_updater.submit(on_stock_import, current_app.db, earliest_dates)
+
+
+def refresh_after_index_import(market_codes, earliest_dates, import_id=None):
+    """Invalidate the cached index series of imported markets and update the Beta moments using them"""
+    current_app.price_store.invalidate_indexes(market_codes, import_id)
+    if not current_app.incremental_beta:
+        return
+    current_app.moment_updater.submit(on_index_import, current_app.db, earliest_dates)
+
+
+def upload_import(data_collection, imports_collection, numeric_fields, import_info, refresh):
+    """Stream an uploaded CSV/XLSX/XLS file into data_collection and return the JSON response"""
+    uploaded = request.files.get('file')
+    if uploaded is None or not uploaded.filename:
+        return jsonify({"error": "No file uploaded, send it as multipart field 'file'"}), 400
+
+    try:
+        chunks = iter_file_chunks(uploaded.filename, uploaded.stream)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Tạo bản ghi import trước để có thể theo dõi tiến trình
+    import_info.update({
+        "import_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "records_count": 0,
+        "file_name": uploaded.filename,
+        "status": "processing"
+    })
+    import_id = current_app.db[imports_collection].insert_one(import_info).inserted_id
+
+    market_codes, earliest_dates = set(), {}
+    try:
+        records_count, _, preview, _ = stream_import(
+            current_app.db, data_collection, imports_collection, import_id, chunks, numeric_fields,
+            market_codes, earliest_dates
+        )
+    finally:
+        # Làm mới bộ nhớ đệm và trạng thái beta của các thị trường vừa được import,
+        # kể cả khi import dừng giữa chừng vì các phần trước đã được ghi
+        if market_codes:
+            refresh(market_codes, earliest_dates, import_id)
+
+    return jsonify({
+        "status": "success",
+        "message": f"Imported {records_count} records successfully",
+        "import_id": str(import_id),
+        "records_count": records_count,
+        "preview": preview
+    }), 201
+
+# Endpoint nhận file CSV/XLSX/XLS dữ liệu cổ phiếu, xử lý theo từng phần phía server
+@api.route('/import-data/upload', methods=['POST'])
+def upload_import_data():
+    if not current_app.db:
+        return jsonify({"error": "Database connection not available"}), 500
+
+    try:
+        return upload_import('stock_data', 'imports', STOCK_NUMERIC_FIELDS, {}, refresh_after_stock_import)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# Endpoint nhận file CSV/XLSX/XLS chỉ số thị trường, xử lý theo từng phần phía server
+@api.route('/import-market-index/upload', methods=['POST'])
+def upload_import_market_index():
+    if not current_app.db:
+        return jsonify({"error": "Database connection not available"}), 500
+
+    try:
+        return upload_import('market_index_data', 'market_index_imports', INDEX_NUMERIC_FIELDS,
+                             {"type": "market_index"}, refresh_after_index_import)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# Lấy trạng thái / tiến trình của một lần import
+@api.route('/import-status/<string:import_id>', methods=['GET'])
+def get_import_status(import_id):
+    if not current_app.db:
+        return jsonify({"error": "Database connection not available"}), 500
+
+    try:
+        if not ObjectId.is_valid(import_id):
+            return jsonify({"error": "Import not found"}), 404
+
+        for collection in ('imports', 'market_index_imports'):
+            import_info = current_app.db[collection].find_one({'_id': ObjectId(import_id)})
+            if import_info:
+                import_info['_id'] = str(import_info['_id'])
+                return jsonify(import_info)
+
+        return jsonify({"error": "Import not found"}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def wants_ndjson():
+    """True when the client asked for a streamed NDJSON response"""
+    return (request.args.get('format') == 'ndjson'
+            or request.accept_mimetypes.best == 'application/x-ndjson')
+
+
+def read_documents(collection, code_column=None, base=None, not_found=None):
+    """
+    Serve a filtered read of a price collection
+
+    Query arguments: market_code, ticker / index_code (comma separated),
+    from / to (dates), fields (comma separated projection), limit and
+    after (cursor from the X-Next-Cursor header of the previous page).
+    With format=ndjson the rows are streamed straight from the Mongo cursor
+    instead of returning one JSON page.
+    """
+    args = request.args
+    try:
+        fields = parse_fields(args.get('fields'))
+        query = build_query(args, code_column, base)
+        if wants_ndjson():
+            limit = parse_limit(args.get('limit'), default=None)
+        else:
+            limit = parse_limit(args.get('limit'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if wants_ndjson():
+        rows = iter_ndjson(collection, query, fields, limit, dumps=json.dumps)
+        return Response(stream_with_context(rows), mimetype='application/x-ndjson')
+
+    data, next_cursor = find_page(collection, query, fields, limit)
+    if not data and not_found and not args.get('after'):
+        return jsonify({"error": not_found}), 404
+
+    # Body vẫn là mảng như trước, con trỏ trang sau nằm trong header
+    response = jsonify(data)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
 # Lấy danh sách dữ liệu chỉ số thị trường
 @api.route('/market-index-data', methods=['GET'])
 def get_market_index_data():
@@ -197,11 +343,7 @@ def get_market_index_data():
         return jsonify({"error": "Database connection not available"}), 500
     
     try:
-        # Có thể thêm tham số để lọc và phân trang
-        limit = int(request.args.get('limit', 100))
-        data = list(current_app.db.market_index_data.find({}, {'_id': 0}).limit(limit))
-        
-        return jsonify(data)
+        return read_documents(current_app.db.market_index_data, 'IndexCode')
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -212,7 +354,7 @@ def get_imports():
         return jsonify({"error": "Database connection not available"}), 500
     
     try:
-        imports = list(current_app.db.imports.find({}, {'_id': 1, 'import_date': 1, 'records_count': 1}))
+        imports = list(current_app.db.imports.find({}, {'_id': 1, 'import_date': 1, 'records_count': 1, 'status': 1}))
         # Chuyển đổi ObjectId thành string
         for imp in imports:
             imp['_id'] = str(imp['_id'])
@@ -228,11 +370,8 @@ def get_import_data(import_id):
         return jsonify({"error": "Database connection not available"}), 500
     
     try:
-        data = list(current_app.db.stock_data.find({'import_id': import_id}, {'_id': 0}))
-        if not data:
-            return jsonify({"error": "No data found for this import ID"}), 404
-        
-        return jsonify(data)
+        return read_documents(current_app.db.stock_data, 'Ticker', base={'import_id': import_id},
+                              not_found="No data found for this import ID")
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -242,15 +381,8 @@ def get_all_market_code():
         return jsonify({"error": "Database connection not available"}), 500
 
     try:
-        # Có thể thêm giới hạn và phân trang nếu dữ liệu lớn
-        # limit = int(request.args.get('limit', 100))
-
-        data = list(current_app.db.stock_data.find({}, {'_id': 0}))
-
-        result = list(set(d.get('MarketCode') for d in data))
-        result.sort()
-
-        return jsonify(result)
+        # Danh sách lấy bằng distinct trên index và được cache, làm mới khi có import
+        return jsonify(current_app.price_store.market_codes())
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -266,15 +398,8 @@ def get_all_ticker():
         return jsonify({"error": "Market code is required"}), 400
 
     try:
-        # Có thể thêm giới hạn và phân trang nếu dữ liệu lớn
-        # limit = int(request.args.get('limit', 100))
-
-        data = list(current_app.db.stock_data.find({'MarketCode': market_code}, {'_id': 0}))
-
-        result = list(set(d.get('Ticker') for d in data))
-        result.sort()
-
-        return jsonify(result)
+        # Danh sách lấy bằng distinct trên index và được cache, làm mới khi có import
+        return jsonify(current_app.price_store.ticker_list(market_code))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -285,12 +410,7 @@ def get_all_stock_data():
         return jsonify({"error": "Database connection not available"}), 500
     
     try:
-        # Có thể thêm giới hạn và phân trang nếu dữ liệu lớn
-        limit = int(request.args.get('limit', 100))
-
-        data = list(current_app.db.stock_data.find({}, {'_id': 0}))
-        
-        return jsonify(data)
+        return read_documents(current_app.db.stock_data, 'Ticker')
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -347,35 +467,13 @@ def calculate_beta_and_train_svm():
 
 def get_beta(market_code, ticker, days_to_predict = 5):
     try:
-        # Retrieve stock data from MongoDB
-        stock_data = list(current_app.db.stock_data.find({'MarketCode': market_code, 'Ticker': ticker}, {'_id': 0}))
-        if not stock_data:
+        # Retrieve stock data from the shared price store
+        stock_df = current_app.price_store.stock_frame(market_code, [ticker])
+        if stock_df.empty:
             return jsonify({"error": "No stock data available"}), 404
 
-        # Convert to DataFrame
-        stock_df = pd.DataFrame(stock_data)
-
-        # Normalize index codes - handle different naming conventions
-        # Map HSX or HOSE to VNIndex, HNX to HNXIndex
-        code_mapping = {
-            'HSX': 'VNINDEX',
-            'HOSE': 'VNINDEX',
-            'HNX': 'HNXIndex',
-            'UPCOM': 'UpcomIndex',
-            'Upcom': 'UpcomIndex',
-        }
-
-        # Get market index data from market_index_data collection
-        mc = "HSX" if market_code == "HOSE" else market_code
-        market_data = list(current_app.db.market_index_data.find({'MarketCode': mc, 'IndexCode': code_mapping[mc]}, {'_id': 0}))
-
-        # Convert to DataFrame
-        market_df = pd.DataFrame(market_data)
-
-        if 'IndexCode' in market_df.columns:
-            market_df['IndexCode'] = market_df['IndexCode'].apply(
-                lambda x: code_mapping.get(x, x) if isinstance(x, str) else x
-            )
+        # Lợi nhuận của chỉ số tham chiếu được cache và dùng chung cho mọi mã trên cùng sàn
+        market_series = current_app.price_store.benchmark_returns(market_code)
 
         # Determine what we're calculating beta for
         calculate_for = None
@@ -383,26 +481,14 @@ def get_beta(market_code, ticker, days_to_predict = 5):
             calculate_for = f"{market_code}:{ticker}"
 
         # Calculate beta for a specific stock with days_to_predict parameter
-        result = get_beta_for_stock(stock_df, market_df, calculate_for, days_to_predict)
+        result = get_beta_for_stock(stock_df, None, calculate_for, days_to_predict, market_series=market_series)
 
         # Store the result in MongoDB
         if result['beta'] is not None:
-            beta_record = {
-                'stock_code': result['stock_code'],
-                'market_code': market_code,
-                'ticker': ticker,
-                'date': result['date'],
-                'beta': result['beta'],
-                'calculation_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                'interpretation': result['interpretation'],
-                'prediction_horizon': days_to_predict
-            }
-            # Remove existing beta record if it exists
-            current_app.db.beta_values.delete_one({'stock_code': calculate_for, 'market_code': market_code, 'ticker': ticker})
-
-            # Insert new beta record
-            insert_result = current_app.db.beta_values.insert_one(beta_record)
-            result['_id'] = str(insert_result.inserted_id)
+            # Ghi đè bản ghi cũ của mã với cùng tầm dự báo bằng một lệnh upsert
+            record = beta_record(result, market_code, ticker, days_to_predict)
+            with stage('mongo_write'):
+                result['_id'] = str(save_beta(current_app.db, record))
 
         return jsonify(result)
 
@@ -428,6 +514,135 @@ def calculate_beta():
     # Retrieve stock data from MongoDB
     return get_beta(market_code, ticker, days_to_predict)
 
+# Endpoint to calculate Beta for many stocks of a market at once
+@api.route('/calculate-beta-batch', methods=['POST'])
+def calculate_beta_batch():
+    if not current_app.db:
+        return jsonify({"error": "Database connection not available"}), 500
+
+    try:
+        # Get parameters from the request
+        request_data = request.json or {}
+        market_code = request_data.get('market_code')  # Market code (HNX, HOSE)
+        tickers = request_data.get('tickers', 'all')  # List of tickers or "all" for the whole market
+        days_to_predict = request_data.get('days_to_predict', 5)  # Default to 5 days
+
+        if not market_code:
+            return jsonify({"error": "Market code is required"}), 400
+
+        if tickers == 'all':
+            tickers = None
+        elif not isinstance(tickers, list) or not tickers:
+            return jsonify({"error": "Tickers must be a non-empty list or \"all\""}), 400
+        else:
+            tickers = list(dict.fromkeys(tickers))
+
+        report_progress(0.1, 'loading data')
+        store = current_app.price_store
+        stock_df = store.stock_frame(market_code, tickers)
+        if stock_df.empty:
+            return jsonify({"error": "No stock data available"}), 404
+
+        market_series = store.benchmark_returns(market_code)
+        if len(market_series[0]) == 0:
+            return jsonify({"error": "No market index data available"}), 404
+
+        report_progress(0.3, 'calculating beta')
+        results = calculate_betas_batch(stock_df, None, days_to_predict, market_series=market_series)
+
+        calculation_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        records, errors = [], []
+        for result in results:
+            if result['beta'] is None:
+                errors.append({'ticker': result['ticker'], 'error': result['error']})
+            else:
+                records.append(beta_record(result, market_code, result['ticker'], days_to_predict,
+                                           calculation_date))
+
+        # Các mã được yêu cầu nhưng không có dữ liệu giá
+        if tickers is not None:
+            found = {result['ticker'] for result in results}
+            errors.extend({'ticker': ticker, 'error': 'No stock data available'}
+                          for ticker in tickers if ticker not in found)
+
+        report_progress(0.8, 'saving results')
+        with stage('mongo_write'):
+            written = save_betas(current_app.db, records)
+
+        return jsonify({
+            'market_code': market_code,
+            'prediction_horizon': days_to_predict,
+            'calculation_date': calculation_date,
+            'requested': len(tickers) if tickers is not None else len(results),
+            'calculated': len(records),
+            'failed': len(errors),
+            'upserted': written['upserted'],
+            'modified': written['modified'],
+            'errors': errors
+        })
+
+    except Exception as e:
+        print(f"Error calculating beta batch: {str(e)}")
+        return jsonify({"error": f"Error calculating beta batch: {str(e)}"}), 500
+
+# Endpoint to recompute the incremental Beta state of a market from its full history
+@api.route('/beta-moments/rebuild', methods=['POST'])
+def rebuild_beta_moments():
+    if not current_app.db:
+        return jsonify({"error": "Database connection not available"}), 500
+
+    try:
+        request_data = request.json or {}
+        market_code = request_data.get('market_code')  # Market code (HNX, HOSE)
+
+        if not market_code:
+            return jsonify({"error": "Market code is required"}), 400
+
+        summary = rebuild_market_moments(current_app.db, market_code)
+        summary['market_code'] = market_code
+        return jsonify(summary)
+
+    except Exception as e:
+        print(f"Error rebuilding beta moments: {str(e)}")
+        return jsonify({"error": f"Error rebuilding beta moments: {str(e)}"}), 500
+
+# Endpoint to get the rolling Beta series of a stock for several windows
+@api.route('/rolling-beta', methods=['POST'])
+def rolling_beta():
+    if not current_app.db:
+        return jsonify({"error": "Database connection not available"}), 500
+
+    try:
+        # Get parameters from the request
+        request_data = request.json or {}
+        market_code = request_data.get('market_code')  # Market code (HNX, HOSE)
+        ticker = request_data.get('ticker')  # Stock ticker (VLA, MCF, etc.)
+        windows = request_data.get('windows', [30, 90, 180, 365])  # Window lengths in trading days
+        min_periods = request_data.get('min_periods')
+
+        if not market_code or not ticker:
+            return jsonify({"error": "Market code and ticker are required"}), 400
+
+        if not isinstance(windows, list) or not windows:
+            return jsonify({"error": "Windows must be a non-empty list of trading day counts"}), 400
+
+        stock_df = current_app.price_store.stock_frame(market_code, [ticker])
+        if stock_df.empty:
+            return jsonify({"error": "No stock data available"}), 404
+
+        market_series = current_app.price_store.benchmark_returns(market_code)
+        if len(market_series[0]) == 0:
+            return jsonify({"error": "No market index data available"}), 404
+
+        result = calculate_rolling_betas(stock_df, None, f"{market_code}:{ticker}", windows, min_periods,
+                                         market_series=market_series)
+
+        return jsonify(result)
+
+    except Exception as e:
+        print(f"Error calculating rolling beta: {str(e)}")
+        return jsonify({"error": f"Error calculating rolling beta: {str(e)}"}), 500
+
 # Endpoint to get Beta for a portfolio
 @api.route('/calculate-portfolio-beta', methods=['POST'])
 def calculate_portfolio_beta():
@@ -442,90 +657,20 @@ def calculate_portfolio_beta():
         market_code = request_data.get('market_code')  # Optional market code parameter
         ticker = request_data.get('ticker')  # Optional ticker parameter
         days_to_predict = request_data.get('days_to_predict', 5)  # Default to 5 days
+        days_window = request_data.get('days_window', 365)  # Calculation window in calendar days
         
-        if not portfolio:
+        if not portfolio or not isinstance(portfolio, dict):
             return jsonify({"error": "Portfolio data is required"}), 400
-        
-        # Retrieve stock data from MongoDB
-        stock_data = list(current_app.db.stock_data.find({}, {'_id': 0}))
-        if not stock_data:
-            return jsonify({"error": "No stock data available"}), 404
-        
-        # Convert to DataFrame
-        stock_df = pd.DataFrame(stock_data)
-        
-        # Thêm phần để tính tickerticker
-        # Filter stock data if market_code and/or ticker provided
-        if market_code and ticker:
-            filtered_stock_df = stock_df[(stock_df['MarketCode'] == market_code) & (stock_df['Ticker'] == ticker)]
-            if not filtered_stock_df.empty:
-                stock_df = filtered_stock_df
-        elif market_code:
-            filtered_stock_df = stock_df[stock_df['MarketCode'] == market_code]
-            if not filtered_stock_df.empty:
-                stock_df = filtered_stock_df
-        elif ticker:
-            filtered_stock_df = stock_df[stock_df['Ticker'] == ticker]
-            if not filtered_stock_df.empty:
-                stock_df = filtered_stock_df
-        
-        # Get market index data from market_index_data collection
-        market_data = list(current_app.db.market_index_data.find({}, {'_id': 0}))
-        
-        if market_data:
-            # Convert to DataFrame
-            market_df = pd.DataFrame(market_data)
-            
-            # Normalize index codes - handle different naming conventions
-            # Map HSX or HOSE to VNIndex, HNX to HNXIndex
-            code_mapping = {
-                'HSX': 'VNIndex',
-                'HOSE': 'VNIndex',
-                'HNX': 'HNXIndex'
-            }
-            
-            if 'IndexCode' in market_df.columns:
-                market_df['IndexCode'] = market_df['IndexCode'].apply(
-                    lambda x: code_mapping.get(x, x) if isinstance(x, str) else x
-                )
-            
-            # Make sure we use the right column names
-            # If the market data has different column names, map them to expected names
-            if 'TradeDate' in market_df.columns and 'Date' not in market_df.columns:
-                market_df['Date'] = market_df['TradeDate']
-            
-            if 'CloseIndex' in market_df.columns and 'Close' not in market_df.columns:
-                market_df['Close'] = market_df['CloseIndex']
-                
-        else:
-            # No market_index_data, try to use VNIndex from stock_data as fallback
-            market_df = stock_df[stock_df['IndexCode'] == 'VNIndex'].copy()
-            
-            if market_df.empty:
-                # Also try with alternate names
-                for alt_code in ['HOSE', 'HSX']:
-                    market_df = stock_df[stock_df['IndexCode'] == alt_code].copy()
-                    if not market_df.empty:
-                        # Rename the IndexCode to VNIndex for consistency
-                        market_df['IndexCode'] = 'VNIndex'
-                        break
-                        
-            if market_df.empty:
-                return jsonify({"error": "No market index data available. Please import VNIndex data first."}), 404
-        
-        # If market_code and ticker are provided, update portfolio keys to use combined format
-        if market_code and ticker and len(portfolio) > 0:
-            updated_portfolio = {}
-            for code, weight in portfolio.items():
-                # If the code doesn't already have market_code included, add it
-                if ':' not in code:
-                    updated_portfolio[f"{market_code}:{code}"] = weight
-                else:
-                    updated_portfolio[code] = weight
-            portfolio = updated_portfolio
-        
-        # Calculate portfolio beta with days_to_predict parameter
-        result = get_beta_portfolio(stock_df, market_df, portfolio, date, days_to_predict)
+
+        try:
+            end_date = parse_date(date) if date else None
+            # Ma trận lợi nhuận của các mã trong danh mục chỉ dựng một lần và được cache,
+            # chỉ đổi tỷ trọng thì không phải đọc lại dữ liệu
+            report_progress(0.1, 'calculating beta')
+            result = current_app.portfolio_risk.analyze(portfolio, market_code, end_date, days_to_predict,
+                                                        int(days_window))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
         # Store the result in MongoDB
         if result['portfolio_beta'] is not None:
@@ -533,13 +678,15 @@ def calculate_portfolio_beta():
                 'portfolio': portfolio,
                 'date': result['date'],
                 'portfolio_beta': result['portfolio_beta'],
+                'portfolio_volatility': result['volatility']['annualized'],
                 'market_code': market_code,
                 'ticker': ticker,
                 'calculation_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 'interpretation': result['interpretation'],
                 'prediction_horizon': days_to_predict
             }
-            insert_result = current_app.db.portfolio_betas.insert_one(portfolio_record)
+            with stage('mongo_write'):
+                insert_result = current_app.db.portfolio_betas.insert_one(portfolio_record)
             result['_id'] = str(insert_result.inserted_id)
         
         return jsonify(result)
@@ -548,6 +695,63 @@ def calculate_portfolio_beta():
         print(f"Error calculating portfolio beta: {str(e)}")
         return jsonify({"error": f"Error calculating portfolio beta: {str(e)}"}), 500
 
+# Endpoint nhận các phiên giao dịch mới và trả về chỉ báo kỹ thuật cập nhật tăng dần.
+# Body là {"bars": [...]} hoặc NDJSON (application/x-ndjson, mỗi dòng một phiên)
+# để phát lại một file dữ liệu theo thứ tự
+@api.route('/bars', methods=['POST'])
+def ingest_bars():
+    if not current_app.db:
+        return jsonify({"error": "Database connection not available"}), 500
+
+    try:
+        if request.mimetype == 'application/x-ndjson':
+            try:
+                bars = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+            except ValueError as e:
+                return jsonify({"error": f"Invalid NDJSON line: {str(e)}"}), 400
+        else:
+            bars = (request.json or {}).get('bars')
+
+        if not isinstance(bars, list) or not all(isinstance(bar, dict) for bar in bars):
+            return jsonify({"error": "Bars must be a list of objects"}), 400
+
+        trade_dates = normalize_trade_dates([bar.get('TradeDate') for bar in bars])
+        bars = [dict(bar, TradeDate=trade_date) for bar, trade_date in zip(bars, trade_dates)]
+
+        results = current_app.indicator_engine.push(bars)
+        return jsonify({
+            'received': len(bars),
+            'applied': sum(1 for result in results if 'error' not in result),
+            'results': results
+        })
+
+    except Exception as e:
+        print(f"Error ingesting bars: {str(e)}")
+        return jsonify({"error": f"Error ingesting bars: {str(e)}"}), 500
+
+# Endpoint to get the latest technical indicators of a stock
+@api.route('/indicators', methods=['GET'])
+def get_indicators():
+    if not current_app.db:
+        return jsonify({"error": "Database connection not available"}), 500
+
+    try:
+        market_code = request.args.get('market_code')
+        ticker = request.args.get('ticker')
+
+        if not market_code or not ticker:
+            return jsonify({"error": "Market code and ticker are required"}), 400
+
+        result = current_app.indicator_engine.latest(market_code, ticker)
+        if result is None:
+            return jsonify({"error": "No data available for this ticker"}), 404
+
+        return jsonify(result)
+
+    except Exception as e:
+        print(f"Error getting indicators: {str(e)}")
+        return jsonify({"error": f"Error getting indicators: {str(e)}"}), 500
+
 # Endpoint for SVM analysis
 @api.route('/svm-analysis', methods=['POST'])
 def svm_analysis():
@@ -560,43 +764,51 @@ def svm_analysis():
         days_to_predict = request_data.get('days_to_predict', 5)  # Default to 5 days
         market_code = request_data.get('market_code')
         ticker = request_data.get('ticker')
+        layout = request_data.get('layout', 'records')  # 'columns' trả predictions dạng cột
 
         if not market_code or not ticker:
             return jsonify({"error": "Market code and ticker are required"}), 400
+
+        if layout not in ('records', 'columns'):
+            return jsonify({"error": "Layout must be 'records' or 'columns'"}), 400
         
-        # Get stock data from MongoDB
-        stock_data = list(current_app.db.stock_data.find({'MarketCode': market_code, 'Ticker': ticker}, {'_id': 0}))
-        if not stock_data:
+        # Get stock data from the shared price store
+        report_progress(0.1, 'loading data')
+        # Đọc phiên bản trước dữ liệu: nếu có import xen giữa, mô hình mới hơn phiên bản chứ không cũ hơn
+        data_version = current_app.price_store.data_version(market_code)
+        stock_df = current_app.price_store.stock_frame(market_code, [ticker])
+        if stock_df.empty:
             return jsonify({"error": "No stock data available for analysis"}), 404
-        
-        # Convert to DataFrame
-        stock_df = pd.DataFrame(stock_data)
 
         # Get beta values if requested
         beta_values = None
 
-        # Lấy giá trị beta phù hợp với khoảng thời gian dự đoán
-        beta_data = list(current_app.db.beta_values.find({'market_code': market_code, 'ticker': ticker},{'_id': 0}))
+        # Lấy giá trị beta phù hợp với khoảng thời gian dự đoán (một bản ghi cho mỗi tầm dự báo)
+        beta_query = {'market_code': market_code, 'ticker': ticker, 'prediction_horizon': days_to_predict}
+        with stage('beta_lookup'):
+            beta_data = list(current_app.db.beta_values.find(beta_query, {'_id': 0}))
 
         # Nếu không có beta values phù hợp với khoảng thời gian, tính toán mới
         if not beta_data:
             get_beta(market_code, ticker, days_to_predict)
-            beta_data = list(current_app.db.beta_values.find(
-                {'prediction_horizon': days_to_predict},
-                {'_id': 0}
-            ))
+            beta_data = list(current_app.db.beta_values.find(beta_query, {'_id': 0}))
 
         # Chuyển đổi thành DataFrame
         if beta_data:
             beta_values = pd.DataFrame(beta_data)
 
         # Perform SVM analysis with market_code and ticker
-        analysis_result = analyze_stocks_with_svm(stock_df, beta_values, days_to_predict)
+        report_progress(0.3, 'training model')
+        model_key = make_model_key(market_code, [ticker], days_to_predict, data_version)
+        analysis_result = analyze_stocks_with_svm(stock_df, beta_values, days_to_predict,
+                                                  registry=current_app.model_registry, model_key=model_key,
+                                                  feature_store=current_app.feature_store, data_version=data_version)
         
         if not analysis_result["success"]:
             return jsonify({"error": analysis_result["error"]}), 400
         
         # Save analysis results to MongoDB
+        report_progress(0.9, 'saving results')
         analysis_record = {
             "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             "days_to_predict": days_to_predict,
@@ -608,18 +820,22 @@ def svm_analysis():
             "ticker": ticker
         }
 
-        # Remove existing analysis record if it exists
-        current_app.db.svm_analyses.delete_one({'market_code': market_code, 'ticker': ticker})
+        with stage('mongo_write'):
+            # Remove existing analysis record if it exists
+            current_app.db.svm_analyses.delete_one({'market_code': market_code, 'ticker': ticker})
 
-        # Insert new analysis record
-        current_app.db.svm_analyses.insert_one(analysis_record)
-        
-        return jsonify(analysis_result)
+            # Insert new analysis record
+            current_app.db.svm_analyses.insert_one(analysis_record)
+
+        # Dạng cột ("struct of arrays") không lặp lại tên trường cho mỗi dự đoán
+        if layout == 'columns':
+            analysis_result['predictions'] = records_to_columns(analysis_result['predictions'])
+
+        with stage('jsonify'):
+            return jsonify(analysis_result)
     
     except Exception as e:
-        print(f"Error performing SVM analysis: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        current_app.logger.exception("Error performing SVM analysis")
         return jsonify({"error": f"Error performing SVM analysis: {str(e)}"}), 500
 
 # Endpoint to get the latest SVM analysis
@@ -663,6 +879,21 @@ def get_latest_svm_analysis():
         print(f"Error retrieving latest SVM analysis: {str(e)}")
         return jsonify({"error": f"Error retrieving latest SVM analysis: {str(e)}"}), 500
 
+def load_snapshot(market_code):
+    """
+    Read a market's latest_snapshot rows and NAV
+
+    Imports only upsert the tickers they contain, so a market is rebuilt
+    from its full price history the first time it is requested, even when
+    an import created its market_nav before (data imported before
+    latest_snapshot existed).
+    """
+    nav, bars = read_snapshot(current_app.db, market_code)
+    if not snapshot_built(nav):
+        rebuild_snapshot(current_app.db, current_app.price_store, market_code)
+        nav, bars = read_snapshot(current_app.db, market_code)
+    return nav, bars
+
 # Endpoint to get stock data with calculations and beta values
 @api.route('/stock-data-with-beta', methods=['GET'])
 def get_stock_data_with_beta():
@@ -678,73 +909,30 @@ def get_stock_data_with_beta():
         if not market_code:
             return jsonify({"error": "Market code are required"}), 400
 
-        # Get stock data
-        stock_data = list(current_app.db.stock_data.find({'MarketCode': market_code}, {'_id': 0}))
-        if not stock_data:
+        # Ngày tùy chọn: lấy giá và beta của từng mã tại ngày đó
+        as_of = None
+        if args.get('as_of'):
+            try:
+                as_of = parse_date(args.get('as_of'))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+
+        # Get the last bar of every ticker from latest_snapshot (or the last one on/before as_of from the price store)
+        if as_of is None:
+            _, latest_df = load_snapshot(market_code)
+        else:
+            latest_df = current_app.price_store.bars_as_of(market_code, as_of)
+        if latest_df.empty:
             return jsonify({"error": "No stock data available"}), 404
-        
+
         # Get beta values
-        beta_values = list(current_app.db.beta_values.find({'market_code': market_code}, {'_id': 0}))
-
-        stock_df = pd.DataFrame(stock_data)
-        date = max(stock_df['TradeDate'].values, key=lambda d: datetime.strptime(d, '%Y-%m-%d'))
-        # stock_period = stock_data[stock_data['TradeDate'] == date]
-
-        # Process stock data
-        result = []
-        for stock in stock_data:
-            if 'MarketCode' not in stock or 'Ticker' not in stock:
-                continue
-
-            market_code = stock.get('MarketCode')
-            ticker = stock.get('Ticker')
-            stock_date = stock.get('TradeDate')
-            if any(market_code in beta.values() and ticker in beta.values() for beta in beta_values) and stock_date == date:
-                # Extract basic fields
-                close_price = float(stock.get('ClosePrice', 0))
-                total_volume = float(stock.get('TotalVolume', 0))
-                open_price = float(stock.get('OpenPrice', 0))
-
-                # Calculate derived fields
-                current_price = close_price
-                profit_loss = current_price - open_price
-                profit_loss_percent = 0
-                if open_price > 0:
-                    profit_loss_percent = (profit_loss / open_price) * 100
-
-                # Prepare stock entry
-                stock_entry = {
-                    'MarketCode': market_code,
-                    'Ticker': ticker,
-                    'ClosePrice': close_price,
-                    'TotalVolume': total_volume,
-                    'OpenPrice': open_price,
-                    'CurrentPrice': current_price,
-                    'ProfitLoss': profit_loss,
-                    'ProfitLossPercent': profit_loss_percent
-                }
-
-                # Add beta and risk information if available
-                key = f"{market_code}:{ticker}"
-                if any(key in beta.values() for beta in beta_values):
-                    for beta in beta_values:
-                        if key in beta.values():
-                            beta_value = beta.get('beta')
-                            stock_entry['beta'] = beta_value
-
-                            # Determine risk based on beta value
-                            if beta_value is not None:
-                                if beta_value == 1:
-                                    stock_entry['risk'] = 'medium'
-                                else:  # beta > 1 or beta < 1
-                                    stock_entry['risk'] = 'high'
-                            else:
-                                stock_entry['risk'] = 'unknown'
-                else:
-                    stock_entry['beta'] = None
-                    stock_entry['risk'] = 'unknown'
-
-                result.append(stock_entry)
+        beta_values = list(current_app.db.beta_values.find(
+            {'market_code': market_code},
+            {'_id': 0, 'market_code': 1, 'ticker': 1, 'beta': 1, 'date': 1}
+        ))
+
+        # Join giá và beta theo khóa (MarketCode, Ticker)
+        result = join_stock_beta(latest_df, beta_values, as_of)
         
         return jsonify(result)
     
@@ -767,87 +955,15 @@ def get_stock_data_asset():
         if not market_code:
             return jsonify({"error": "Market code are required"}), 400
 
-        # Get stock data
-        stock_data = list(current_app.db.stock_data.find({'MarketCode': market_code}, {'_id': 0}))
-        if not stock_data:
+        # Get the last bar of every ticker and the NAV maintained at import time
+        nav, latest_df = load_snapshot(market_code)
+        if latest_df.empty:
             return jsonify({"error": "No stock data available"}), 404
 
-
-        stock_df = pd.DataFrame(stock_data)
-        date = max(stock_df['TradeDate'].values, key=lambda d: datetime.strptime(d, '%Y-%m-%d'))
-        # stock_period = stock_data[stock_data['TradeDate'] == date]
-
-        # Process stock data
-        nav_close_price = 0
-        nav_total_volume = 0
-        nav_open_price = 0
-        nav_current_price = 0
-        nav_profit_loss = 0
-        nav_profit_loss_percent = 0
-        nav_weight = 0
-        result = []
-        for stock in stock_data:
-            if 'MarketCode' not in stock or 'Ticker' not in stock:
-                continue
-
-            market_code = stock.get('MarketCode')
-            ticker = stock.get('Ticker')
-            stock_date = stock.get('TradeDate')
-
-            if stock_date != date:
-                continue
-
-            # Extract basic fields
-            close_price = float(stock.get('ClosePrice', 0))
-            nav_close_price += close_price
-            total_volume = float(stock.get('TotalVolume', 0))
-            nav_total_volume += total_volume
-            open_price = float(stock.get('OpenPrice', 0))
-            nav_open_price += open_price
-
-            # Calculate derived fields
-            current_price = close_price
-            nav_current_price += current_price
-            profit_loss = current_price - open_price
-            nav_profit_loss += profit_loss
-            profit_loss_percent = 0
-            if open_price > 0:
-                profit_loss_percent = (profit_loss / open_price) * 100
-            nav_profit_loss_percent += profit_loss_percent
-
-
-            # Prepare stock entry
-            stock_entry = {
-                'MarketCode': market_code,
-                'Ticker': ticker,
-                'ClosePrice': close_price,
-                'TotalVolume': total_volume,
-                'OpenPrice': open_price,
-                'CurrentPrice': current_price,
-                'ProfitLoss': profit_loss,
-                'ProfitLossPercent': profit_loss_percent
-            }
-
-            result.append(stock_entry)
-
-        nav_entry = {
-            'MarketCode': market_code,
-            'Ticker': 'NAV',
-            'ClosePrice': nav_close_price,
-            'TotalVolume': nav_total_volume,
-            'OpenPrice': nav_open_price,
-            'CurrentPrice': nav_current_price,
-            'ProfitLoss': nav_profit_loss,
-            'ProfitLossPercent': nav_profit_loss_percent
-        }
-        result.append(nav_entry)
-
-        # Calculate Weight
-        for stock in result:
-            if stock['Ticker'] == 'NAV':
-                stock['Weight'] = 100
-            else:
-                stock['Weight'] = (stock['CurrentPrice'] / nav_current_price) * 100
+        result = latest_df[SNAPSHOT_COLUMNS + ['Weight']].to_dict('records')
+        nav_entry = {field: nav[field] for field in SNAPSHOT_COLUMNS[2:]}
+        nav_entry.update({'MarketCode': market_code, 'Ticker': 'NAV', 'Weight': 100})
+        result.append({field: nav_entry[field] for field in SNAPSHOT_COLUMNS + ['Weight']})
 
         return jsonify(result)
 
@@ -865,54 +981,47 @@ def data_analysis():
         request_data = request.json or {}
         market_code = request_data.get('market_code')
         tickers = request_data.get('ticker')
+        layout = request_data.get('layout', 'records')  # 'columns' trả predictions dạng cột
 
         if not market_code or not tickers or len(tickers) == 0:
             return jsonify({"error": "Market code and ticker are required"}), 400
 
-        # Get stock data from MongoDB
-        stock_data = list(current_app.db.stock_data.find({'MarketCode': market_code}, {'_id': 0}))
-        if not stock_data:
+        if layout not in ('records', 'columns'):
+            return jsonify({"error": "Layout must be 'records' or 'columns'"}), 400
+
+        # Get stock data from the shared price store
+        report_progress(0.1, 'loading data')
+        # Đọc phiên bản trước dữ liệu: nếu có import xen giữa, mô hình mới hơn phiên bản chứ không cũ hơn
+        mc, _ = benchmark_key(market_code)
+        data_version = current_app.price_store.data_version(market_code)
+        model_version = current_app.price_store.data_version(market_code, mc)
+        stock_df = current_app.price_store.stock_frame(market_code, tickers)
+        if stock_df.empty:
             return jsonify({"error": "No stock data available for analysis"}), 404
 
-        stock_filter = list()
-        for ticker in tickers:
-            for stock in stock_data:
-                if stock['Ticker'] == ticker:
-                    stock_filter.append(stock)
-
-        stock_df = pd.DataFrame(stock_filter)
-
-        # Normalize index codes - handle different naming conventions
-        # Map HSX or HOSE to VNIndex, HNX to HNXIndex
-        code_mapping = {
-            'HSX': 'VNINDEX',
-            'HOSE': 'VNINDEX',
-            'HNX': 'HNXIndex',
-            'UPCOM': 'UpcomIndex',
-            'Upcom': 'UpcomIndex',
-        }
-
-        mc = "HSX" if market_code == "HOSE" else market_code
-        market_data = list(current_app.db.market_index_data.find({'MarketCode': mc, 'IndexCode': code_mapping[mc]}, {'_id': 0}))
-
-        # Convert to DataFrame
-        market_df = pd.DataFrame(market_data)
+        # Lợi nhuận của chỉ số tham chiếu được cache và dùng chung cho mọi mã trên cùng sàn
+        market_series = current_app.price_store.benchmark_returns(market_code)
 
         # Lấy giá trị beta phù hợp với khoảng thời gian dự đoán
-        beta_values = calculate_all_stock_betas(stock_df, market_df, days_to_predict=10)
+        report_progress(0.2, 'calculating beta')
+        beta_values = calculate_all_stock_betas(stock_df, None, days_to_predict=10, market_series=market_series)
 
-        analysis_result = analyze_stocks_with_svm(stock_df, beta_values, days_to_predict=5)
+        report_progress(0.3, 'training model')
 
-        cm = np.array(analysis_result['model_metrics']['confusion_matrix'])
-        plot_confusion_matrix(cm)
+        model_key = make_model_key(market_code, tickers, 5, model_version)
+        analysis_result = analyze_stocks_with_svm(stock_df, beta_values, days_to_predict=5,
+                                                  registry=current_app.model_registry, model_key=model_key,
+                                                  feature_store=current_app.feature_store, data_version=data_version)
 
-        plot_confidence_distribution(analysis_result['predictions'])
+        report_progress(0.9, 'rendering charts')
+        with stage('charts'):
+            cm = np.array(analysis_result['model_metrics']['confusion_matrix'])
+            confusion_matrix_encoded_string = plot_confusion_matrix(cm)
 
-        with open("confusion_matrix.png", "rb") as image_file:
-            confusion_matrix_encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
+            confidence_distribution_encoded_string = plot_confidence_distribution(analysis_result['predictions'])
 
-        with open("confidence_distribution.png", "rb") as image_file:
-            confidence_distribution_encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
+        if layout == 'columns':
+            analysis_result['predictions'] = records_to_columns(analysis_result['predictions'])
 
         return_result = {
             "confusion_matrix": confusion_matrix_encoded_string,
@@ -920,10 +1029,111 @@ def data_analysis():
             "data": analysis_result
         }
 
-        return jsonify(return_result)
+        with stage('jsonify'):
+            return jsonify(return_result)
+
+    except Exception as e:
+        current_app.logger.exception("Error performing data analysis")
+        return jsonify({"error": f"Error performing SVM analysis: {str(e)}"}), 500
+
+
+# Endpoint to queue a long-running analysis as a background job
+@api.route('/jobs', methods=['POST'])
+def submit_job():
+    if not current_app.db:
+        return jsonify({"error": "Database connection not available"}), 500
+
+    try:
+        request_data = request.json or {}
+        job_type = request_data.get('type')  # svm-analysis, data-analysis, calculate-portfolio-beta
+        params = request_data.get('params', {})  # Same JSON body as the synchronous endpoint
+
+        if job_type not in JOB_TYPES:
+            return jsonify({"error": f"Job type must be one of: {', '.join(sorted(JOB_TYPES))}"}), 400
+
+        if not isinstance(params, dict):
+            return jsonify({"error": "Job params must be an object"}), 400
+
+        job_id = create_job(current_app.db, job_type, params)
+
+        return jsonify({"status": "queued", "job_id": job_id}), 202
 
     except Exception as e:
-        print(f"Error performing SVM analysis: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({"error": f"Error performing SVM analysis: {str(e)}"}), 500
\ No newline at end of file
+        print(f"Error submitting job: {str(e)}")
+        return jsonify({"error": f"Error submitting job: {str(e)}"}), 500
+
+# Endpoint to poll the status of a background job
+@api.route('/jobs/<string:job_id>', methods=['GET'])
+def get_job(job_id):
+    if not current_app.db:
+        return jsonify({"error": "Database connection not available"}), 500
+
+    try:
+        object_id = parse_job_id(job_id)
+        job = current_app.db.jobs.find_one({'_id': object_id}) if object_id else None
+        if not job:
+            return jsonify({"error": "Job not found"}), 404
+
+        return jsonify(job_status(job))
+
+    except Exception as e:
+        print(f"Error retrieving job: {str(e)}")
+        return jsonify({"error": f"Error retrieving job: {str(e)}"}), 500
+
+# Endpoint to fetch the result of a finished background job
+@api.route('/jobs/<string:job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    if not current_app.db:
+        return jsonify({"error": "Database connection not available"}), 500
+
+    try:
+        object_id = parse_job_id(job_id)
+        job = current_app.db.jobs.find_one({'_id': object_id}) if object_id else None
+        if not job:
+            return jsonify({"error": "Job not found"}), 404
+
+        if not job.get('result_id'):
+            if job.get('status') == 'failed':
+                return jsonify({"error": job.get('error') or "Job failed"}), 500
+            # Job chưa xong, trả về trạng thái để frontend tiếp tục poll
+            return jsonify(job_status(job)), 202
+
+        # Kết quả đã được lưu dưới dạng JSON, trả nguyên văn
+        body, content_type = load_job_result(current_app.db, job)
+        return Response(body, status=job.get('result_status_code', 200), content_type=content_type)
+
+    except Exception as e:
+        print(f"Error retrieving job result: {str(e)}")
+        return jsonify({"error": f"Error retrieving job result: {str(e)}"}), 500
+
+# Admin endpoint: index definitions, usage counters and query plans per collection
+@api.route('/admin/indexes', methods=['GET'])
+def get_index_report():
+    if not current_app.db:
+        return jsonify({"error": "Database connection not available"}), 500
+
+    try:
+        explain = request.args.get('explain', '1') != '0'
+        return jsonify(index_report(current_app.db, explain=explain))
+
+    except Exception as e:
+        print(f"Error building index report: {str(e)}")
+        return jsonify({"error": f"Error building index report: {str(e)}"}), 500
+
+# Admin endpoint: create the missing indexes and drop the superseded ones
+@api.route('/admin/indexes', methods=['POST'])
+def ensure_db_indexes():
+    if not current_app.db:
+        return jsonify({"error": "Database connection not available"}), 500
+
+    try:
+        return jsonify(ensure_indexes(current_app.db))
+
+    except Exception as e:
+        print(f"Error ensuring indexes: {str(e)}")
+        return jsonify({"error": f"Error ensuring indexes: {str(e)}"}), 500
+
+# Request counters, latency histograms, payload sizes and stage timings in Prometheus text format
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(render_metrics(), content_type=PROMETHEUS_CONTENT_TYPE)
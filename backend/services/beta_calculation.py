@@ -2,6 +2,8 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 
+from services.metrics import timed
+
 
 def calculate_daily_returns(prices):
     """Calculate daily returns from a series of prices
@@ -45,7 +47,8 @@ def calculate_beta(stock_returns, market_returns):
     return beta
 
 
-def get_beta_for_stock(stock_data, market_data, stock_code, days_to_predict=5):
+@timed('beta')
+def get_beta_for_stock(stock_data, market_data, stock_code, days_to_predict=5, market_series=None):
     """
     Calculate Beta for a specific stock on a given date (or latest available)
 
@@ -55,28 +58,30 @@ def get_beta_for_stock(stock_data, market_data, stock_code, days_to_predict=5):
     stock_code (str): The stock code to calculate Beta for (can be MarketCode, Ticker, or combined)
     date (str, optional): Date in format 'YYYY-MM-DD', defaults to latest
     days_to_predict (int, optional): Number of days to predict ahead, affects Beta calculation window
+    market_series (tuple, optional): Precomputed (dates, returns) of the market index, used instead of market_data
 
     Returns:
     dict: Beta coefficient and related metrics
     """
-    date = max(stock_data['TradeDate'].values, key=lambda d: datetime.strptime(d, '%Y-%m-%d'))
-
     # If no data found for the stock code, return error
     if stock_data.empty:
         return {
             'stock_code': stock_code,
-            'date': date if isinstance(date, str) else date.strftime('%Y-%m-%d'),
+            'date': None,
             'beta': None,
             'error': f'No data found for stock code: {stock_code}'
         }
 
+    # TradeDate may be stored as BSON dates or 'YYYY-MM-DD' strings, compare as datetimes
+    stock_df = stock_data.assign(TradeDate=parse_trade_dates(stock_data['TradeDate']))
+    date = stock_df['TradeDate'].max()
+
     # Ensure data is sorted by date
-    stock_df = stock_data.sort_values('TradeDate')
-    market_data = market_data.sort_values('TradeDate')
+    stock_df = stock_df.sort_values('TradeDate')
 
-    # Calculate daily returns
+    # Calculate daily returns (market returns are shared when precomputed)
     stock_df['Returns'] = calculate_daily_returns(stock_df['ClosePrice'])
-    market_data['Returns'] = calculate_daily_returns(market_data['CurrentIndex'])
+    market_dates, market_returns = market_series if market_series is not None else market_return_series(market_data)
 
     # Adjust calculation window based on prediction horizon
     # if days_to_predict <= 5:  # For medium-term predictions (3-5 days)
@@ -86,11 +91,15 @@ def get_beta_for_stock(stock_data, market_data, stock_code, days_to_predict=5):
     days_window = 365
 
     # Get data for the specified window from the given date
-    end_date = date
-    start_date = (datetime.strptime(end_date, '%Y-%m-%d') - timedelta(days=days_window)).strftime('%Y-%m-%d')
+    end = date
+    start = end - pd.Timedelta(days=days_window)
+    end_date = end.strftime('%Y-%m-%d')
+    start_date = start.strftime('%Y-%m-%d')
 
-    stock_period = stock_df[(stock_df['TradeDate'] >= start_date) & (stock_df['TradeDate'] <= end_date)]
-    market_period = market_data[(market_data['TradeDate'] >= start_date) & (market_data['TradeDate'] <= end_date)]
+    stock_period = stock_df[(stock_df['TradeDate'] >= start) & (stock_df['TradeDate'] <= end)]
+    first = np.searchsorted(market_dates, start.to_datetime64(), side='left')
+    last = np.searchsorted(market_dates, end.to_datetime64(), side='right')
+    market_period = pd.DataFrame({'TradeDate': market_dates[first:last], 'Returns': market_returns[first:last]})
 
     # Ensure we have enough data points
     if len(stock_period) < 5 or len(market_period) < 5:
@@ -160,14 +169,317 @@ def interpret_beta(beta):
         return "The stock is highly volatile compared to the market."
 
 
-def calculate_all_stock_betas(stock_data, market_data, days_to_predict=5):
+def parse_trade_dates(values):
+    """Convert a TradeDate column to datetime64[ns], parsing each distinct value only once"""
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.astype('datetime64[ns]')
+    codes, uniques = pd.factorize(np.asarray(values), sort=False)
+    parsed = pd.to_datetime(uniques).values
+    return np.where(codes >= 0, parsed[np.maximum(codes, 0)], np.datetime64('NaT'))
+
+
+def factorize_stock_keys(stock_data):
+    """
+    Number every (MarketCode, Ticker) pair in order of first appearance
+
+    Returns:
+    tuple: (per-row column index, DataFrame of unique MarketCode/Ticker pairs)
+    """
+    market_codes, market_uniques = pd.factorize(stock_data['MarketCode'].values, sort=False)
+    tickers, ticker_uniques = pd.factorize(stock_data['Ticker'].values, sort=False)
+    columns, pairs = pd.factorize(market_codes.astype(np.int64) * len(ticker_uniques) + tickers, sort=False)
+    keys = pd.DataFrame({
+        'MarketCode': market_uniques[pairs // len(ticker_uniques)],
+        'Ticker': ticker_uniques[pairs % len(ticker_uniques)],
+    })
+    return columns, keys
+
+
+def market_return_series(market_data):
+    """
+    Sort a market index DataFrame by date and compute its daily returns
+
+    Parameters:
+    market_data (DataFrame): Market index data with TradeDate and CurrentIndex
+
+    Returns:
+    tuple: (datetime64[ns] dates, float64 returns) like PriceStore.benchmark_returns
+    """
+    market_df = pd.DataFrame({
+        'TradeDate': parse_trade_dates(market_data['TradeDate']),
+        'CurrentIndex': market_data['CurrentIndex'].astype(float),
+    })
+    market_df = market_df.sort_values('TradeDate', kind='mergesort').drop_duplicates('TradeDate', keep='last')
+    return market_df['TradeDate'].values, calculate_daily_returns(market_df['CurrentIndex']).values
+
+
+@timed('return_matrix')
+def build_return_matrix(stock_data, market_data, market_series=None):
+    """
+    Align the daily returns of every stock to the market index returns
+
+    Returns are computed per (MarketCode, Ticker) between the stock's own
+    consecutive trading days, exactly like calculate_daily_returns, and then
+    pivoted onto the market index trading dates.
+
+    Parameters:
+    stock_data (DataFrame): Stock price data with MarketCode, Ticker, TradeDate, ClosePrice
+    market_data (DataFrame): Market index data with TradeDate and CurrentIndex
+    market_series (tuple, optional): Precomputed (dates, returns) of the market index, used instead of market_data
+
+    Returns:
+    dict: dates (datetime64 array of market dates), keys (DataFrame of MarketCode/Ticker
+          in first-seen order), returns (dates x tickers matrix, NaN where the stock did not
+          trade), market_returns (vector aligned to dates), stock_dates (per-row TradeDate),
+          stock_keys (per-row column index into keys)
+    """
+    columns, keys = factorize_stock_keys(stock_data)
+
+    # Chuỗi lợi nhuận của thị trường, chỉ tính một lần cho toàn bộ các mã
+    market_dates, market_returns = market_series if market_series is not None else market_return_series(market_data)
+
+    # Lợi nhuận của từng mã giữa các ngày giao dịch liên tiếp của chính mã đó
+    stock_df = pd.DataFrame({
+        'column': columns,
+        'TradeDate': parse_trade_dates(stock_data['TradeDate']),
+        'ClosePrice': stock_data['ClosePrice'].astype(float).values,
+    })
+    stock_df = stock_df.sort_values(['column', 'TradeDate'], kind='mergesort')
+    previous = stock_df.groupby('column', sort=False)['ClosePrice'].shift(1)
+    stock_df['Returns'] = (stock_df['ClosePrice'] / previous - 1).replace(np.nan, 0)
+
+    # Đưa lợi nhuận về ma trận ngày x mã theo lịch giao dịch của chỉ số
+    rows = np.searchsorted(market_dates, stock_df['TradeDate'].values)
+    rows_clipped = np.minimum(rows, max(len(market_dates) - 1, 0))
+    matched = (rows < len(market_dates)) & (market_dates[rows_clipped] == stock_df['TradeDate'].values) \
+        if len(market_dates) else np.zeros(len(stock_df), dtype=bool)
+
+    returns = np.full((len(market_dates), len(keys)), np.nan)
+    returns[rows[matched], stock_df['column'].values[matched]] = stock_df['Returns'].values[matched]
+
+    return {
+        'dates': market_dates,
+        'keys': keys,
+        'returns': returns,
+        'market_returns': market_returns,
+        'stock_dates': stock_df['TradeDate'].values,
+        'stock_keys': stock_df['column'].values,
+    }
+
+
+@timed('beta_batch')
+def calculate_betas_batch(stock_data, market_data, days_to_predict=5, days_window=365, market_series=None):
+    """
+    Calculate Beta for every stock at once from an aligned return matrix
+
+    Produces the same values as calling get_beta_for_stock for each
+    (MarketCode, Ticker): each stock uses the window of days_window calendar
+    days ending on its own latest trading date, Beta is Cov(Re, Rm) / Var(Rm)
+    and the insufficient-data rules are identical.
+
+    Parameters:
+    stock_data (DataFrame): Stock price data with MarketCode, Ticker, TradeDate, ClosePrice
+    market_data (DataFrame): Market index data with TradeDate and CurrentIndex
+    days_to_predict (int, optional): Prediction horizon stored with each result
+    days_window (int, optional): Calculation window in calendar days
+    market_series (tuple, optional): Precomputed (dates, returns) of the market index, used instead of market_data
+
+    Returns:
+    list: One result dict per stock, in the order the stocks first appear
+    """
+    aligned = build_return_matrix(stock_data, market_data, market_series)
+    keys = aligned['keys']
+    dates = aligned['dates']
+    returns = aligned['returns']
+    market_returns = aligned['market_returns']
+
+    # Cửa sổ tính toán của từng mã kết thúc tại ngày giao dịch cuối cùng của mã đó
+    n_stocks = len(keys)
+    end_dates = np.full(n_stocks, np.datetime64('NaT'), dtype='datetime64[ns]')
+    np.maximum.at(end_dates.view('int64'), aligned['stock_keys'], aligned['stock_dates'].view('int64'))
+    start_dates = end_dates - np.timedelta64(days_window, 'D')
+
+    stock_in_window = aligned['stock_dates'] >= start_dates[aligned['stock_keys']]
+    stock_points = np.bincount(aligned['stock_keys'][stock_in_window], minlength=n_stocks)
+    market_points = np.searchsorted(dates, end_dates, side='right') - np.searchsorted(dates, start_dates, side='left')
+
+    # Các cặp lợi nhuận (cổ phiếu, thị trường) hợp lệ trong cửa sổ
+    valid = ~np.isnan(returns) \
+        & (dates[:, None] >= start_dates[None, :]) \
+        & (dates[:, None] <= end_dates[None, :])
+    data_points = valid.sum(axis=0)
+
+    market_matrix = np.broadcast_to(market_returns[:, None], returns.shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_stock = np.where(valid, returns, 0).sum(axis=0) / data_points
+        avg_market = np.where(valid, market_matrix, 0).sum(axis=0) / data_points
+        stock_dev = np.where(valid, returns - avg_stock, 0)
+        market_dev = np.where(valid, market_matrix - avg_market, 0)
+        covariance = (stock_dev * market_dev).sum(axis=0) / (data_points - 1)
+        market_variance = (market_dev * market_dev).sum(axis=0) / data_points
+        betas = covariance / market_variance
+
+    results = []
+    for i, (market_code, ticker) in enumerate(keys.itertuples(index=False)):
+        stock_code = f"{market_code}:{ticker}"
+        end_date = pd.Timestamp(end_dates[i]).strftime('%Y-%m-%d')
+        start_date = pd.Timestamp(start_dates[i]).strftime('%Y-%m-%d')
+
+        if stock_points[i] < 5 or market_points[i] < 5:
+            result = {
+                'stock_code': stock_code,
+                'date': end_date,
+                'beta': None,
+                'error': 'Insufficient data points for reliable beta calculation'
+            }
+        elif data_points[i] < 5:
+            result = {
+                'stock_code': stock_code,
+                'date': end_date,
+                'beta': None,
+                'error': 'No overlapping data between stock and market'
+            }
+        else:
+            beta = betas[i]
+            result = {
+                'stock_code': stock_code,
+                'date': end_date,
+                'beta': beta,
+                'period_start': start_date,
+                'period_end': end_date,
+                'data_points': int(data_points[i]),
+                'calculation_window': days_window,
+                'prediction_horizon': days_to_predict,
+                'avg_stock_return': avg_stock[i],
+                'avg_market_return': avg_market[i],
+                'interpretation': interpret_beta(beta)
+            }
+        result['market_code'] = market_code
+        result['ticker'] = ticker
+        results.append(result)
+
+    return results
+
+
+def rolling_beta_from_returns(stock_returns, market_returns, windows, min_periods=None):
+    """
+    Rolling Beta over several trailing windows from running moment sums
+
+    The cumulative sums of Re, Rm, Re*Rm and Rm^2 are computed once and every
+    window is read off them by differencing, so the cost is O(n) per window
+    instead of re-slicing and calling np.cov for each date. Beta uses the
+    same Cov / Var convention as calculate_beta.
+
+    Parameters:
+    stock_returns (array): Stock returns aligned to market_returns
+    market_returns (array): Market returns
+    windows (list): Window lengths in trading days (aligned observations)
+    min_periods (int, optional): Minimum observations for a value, defaults to the full window
+
+    Returns:
+    dict: window -> array of Beta values (NaN until enough observations)
+    """
+    x = np.asarray(stock_returns, dtype=np.float64)
+    y = np.asarray(market_returns, dtype=np.float64)
+    n = len(x)
+    if n == 0:
+        return {window: np.array([], dtype=np.float64) for window in windows}
+
+    # Trừ trung bình toàn chuỗi để giảm sai số khi lấy hiệu các tổng tích lũy
+    x = x - x.mean()
+    y = y - y.mean()
+
+    def running(values):
+        return np.concatenate(([0.0], np.cumsum(values)))
+
+    sum_x = running(x)
+    sum_y = running(y)
+    sum_xy = running(x * y)
+    sum_yy = running(y * y)
+
+    end = np.arange(1, n + 1)
+    result = {}
+    for window in windows:
+        start = np.maximum(end - window, 0)
+        count = (end - start).astype(np.float64)
+        sx = sum_x[end] - sum_x[start]
+        sy = sum_y[end] - sum_y[start]
+        sxy = sum_xy[end] - sum_xy[start]
+        syy = sum_yy[end] - sum_yy[start]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            covariance = (sxy - sx * sy / count) / (count - 1)
+            market_variance = (syy - sy * sy / count) / count
+            betas = covariance / market_variance
+
+        required = window if min_periods is None else max(min(min_periods, window), 2)
+        betas[count < required] = np.nan
+        result[window] = betas
+    return result
+
+
+@timed('rolling_beta')
+def calculate_rolling_betas(stock_data, market_data, stock_code, windows=(30, 90, 180, 365), min_periods=None,
+                            market_series=None):
+    """
+    Calculate the rolling Beta series of one stock for several windows at once
+
+    Parameters:
+    stock_data (DataFrame): Stock price data for a single stock
+    market_data (DataFrame): Market index data with TradeDate and CurrentIndex
+    stock_code (str): Stock code reported in the result ("MarketCode:Ticker")
+    windows (list, optional): Window lengths in trading days
+    min_periods (int, optional): Minimum observations for a value, defaults to the full window
+    market_series (tuple, optional): Precomputed (dates, returns) of the market index, used instead of market_data
+
+    Returns:
+    dict: Dates and one Beta series per window (None where the window is not filled)
+    """
+    windows = sorted({int(window) for window in windows if int(window) >= 2})
+    no_market = len(market_series[0]) == 0 if market_series is not None else market_data.empty
+    if stock_data.empty or no_market or not windows:
+        return {
+            'stock_code': stock_code,
+            'dates': [],
+            'windows': windows,
+            'betas': {},
+            'error': f'No data found for stock code: {stock_code}'
+        }
+
+    aligned = build_return_matrix(stock_data, market_data, market_series)
+    stock_returns = aligned['returns'][:, 0]
+    traded = ~np.isnan(stock_returns)
+    dates = aligned['dates'][traded]
+
+    series = rolling_beta_from_returns(
+        stock_returns[traded],
+        aligned['market_returns'][traded],
+        windows,
+        min_periods
+    )
+
+    return {
+        'stock_code': stock_code,
+        'dates': list(np.datetime_as_string(dates, unit='D')),
+        'windows': windows,
+        'betas': {
+            str(window): [None if np.isnan(beta) else float(beta) for beta in values]
+            for window, values in series.items()
+        },
+        'data_points': int(traded.sum())
+    }
+
+
+def calculate_all_stock_betas(stock_data, market_data, days_to_predict=5, market_series=None):
     """
     Calculate Beta for all stocks on a specific date
 
     Parameters:
     stock_data (DataFrame): Stock price data
     market_data (DataFrame): Market index data
-    date (str, optional): Date to calculate Beta for, defaults to latest
+    days_to_predict (int, optional): Prediction horizon stored with each result
+    market_series (tuple, optional): Precomputed (dates, returns) of the market index, used instead of market_data
 
     Returns:
     DataFrame: Beta coefficients for all stocks
@@ -175,22 +487,8 @@ def calculate_all_stock_betas(stock_data, market_data, days_to_predict=5):
 
     # Check if we have both MarketCode and Ticker columns
     if 'MarketCode' in stock_data.columns and 'Ticker' in stock_data.columns:
-        # Get unique combinations of MarketCode and Ticker
-        combined_df = stock_data[['MarketCode', 'Ticker']].drop_duplicates()
-
-        # Calculate beta for each unique combination
-        results = []
-        for _, row in combined_df.iterrows():
-            market_code = row['MarketCode']
-            ticker = row['Ticker']
-            combined_code = f"{market_code}:{ticker}"
-
-            stock_df = stock_data[stock_data['Ticker'] == ticker]
-
-            beta_result = get_beta_for_stock(stock_df, market_data, combined_code, days_to_predict)
-            beta_result['market_code'] = market_code
-            beta_result['ticker'] = ticker
-            results.append(beta_result)
+        # Calculate beta for every (MarketCode, Ticker) in one vectorized pass
+        results = calculate_betas_batch(stock_data, market_data, days_to_predict, market_series=market_series)
     else:
         # Fallback to just using MarketCode
         stock_codes = stock_data['MarketCode'].unique()
@@ -198,12 +496,24 @@ def calculate_all_stock_betas(stock_data, market_data, days_to_predict=5):
         # Calculate beta for each stock
         results = []
         for code in stock_codes:
-            beta_result = get_beta_for_stock(stock_data, market_data, code, date)
+            beta_result = get_beta_for_stock(stock_data, market_data, code, days_to_predict, market_series)
             results.append(beta_result)
 
     return pd.DataFrame(results)
 
 
+def stock_rows(stock_data, stock_code, date=None):
+    """Select the rows of one stock code (MarketCode, Ticker or "MarketCode:Ticker") up to an optional date"""
+    if ':' in stock_code:
+        market_code, ticker = stock_code.split(':', 1)
+        selected = (stock_data['MarketCode'] == market_code) & (stock_data['Ticker'] == ticker)
+    else:
+        selected = (stock_data['Ticker'] == stock_code) | (stock_data['MarketCode'] == stock_code)
+    if date is not None:
+        selected &= parse_trade_dates(stock_data['TradeDate']) <= np.datetime64(pd.Timestamp(date), 'ns')
+    return stock_data[selected]
+
+
 def get_beta_portfolio(stock_data, market_data, portfolio, date=None, days_to_predict=5):
     """
     Calculate the Beta for a portfolio of stocks
@@ -224,7 +534,8 @@ def get_beta_portfolio(stock_data, market_data, portfolio, date=None, days_to_pr
     component_betas = []
 
     for stock_code, weight in portfolio.items():
-        beta_result = get_beta_for_stock(stock_data, market_data, stock_code, date, days_to_predict)
+        beta_result = get_beta_for_stock(stock_rows(stock_data, stock_code, date), market_data, stock_code,
+                                         days_to_predict)
         if beta_result['beta'] is not None:
             betas.append(beta_result['beta'])
             weights.append(weight)
@@ -0,0 +1,492 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from pymongo import ASCENDING, DESCENDING, ReplaceOne
+
+from services.beta_calculation import interpret_beta
+from services.beta_store import beta_record, publish_betas
+from services.price_store import benchmark_key, to_numeric_column
+
+# Cửa sổ tính beta (ngày lịch), giống get_beta_for_stock
+BETA_WINDOW_DAYS = 365
+# Tầm dự báo của beta được công bố ngay sau khi import
+DEFAULT_PREDICTION_HORIZON = 5
+# Sau số lần cập nhật này trạng thái được tính lại từ đầu để tránh sai số cộng dồn
+MOMENT_REBUILD_UPDATES = 250
+
+SUM_FIELDS = ['sum_stock', 'sum_market', 'sum_stock_sq', 'sum_market_sq', 'sum_cross']
+
+
+def earliest_trade_dates(frame, code_column='Ticker'):
+    """
+    Earliest TradeDate of every (MarketCode, code) in a batch of imported rows
+
+    Returns:
+    dict: {(MarketCode, code): datetime64[ns]}
+    """
+    if frame.empty or not {'MarketCode', code_column, 'TradeDate'} <= set(frame.columns):
+        return {}
+    dates = pd.DataFrame({
+        'MarketCode': frame['MarketCode'].values,
+        'Code': frame[code_column].values,
+        'TradeDate': pd.to_datetime(pd.Series(frame['TradeDate'].values), errors='coerce').values,
+    }).dropna()
+    earliest = dates.groupby(['MarketCode', 'Code'], sort=False)['TradeDate'].min()
+    return {key: np.datetime64(value, 'ns') for key, value in earliest.items()}
+
+
+def merge_earliest_dates(target, update):
+    """Merge the result of earliest_trade_dates for another batch into target"""
+    for key, value in update.items():
+        if key not in target or value < target[key]:
+            target[key] = value
+    return target
+
+
+def _to_datetime(value):
+    return pd.Timestamp(value).to_pydatetime() if value is not None and not np.isnat(value) else None
+
+
+def _to_datetime64(value):
+    return np.datetime64(value, 'ns') if value is not None else np.datetime64('NaT', 'ns')
+
+
+def _last_market_date(market_dates, end):
+    """Last benchmark date on or before end, NaT if none"""
+    position = np.searchsorted(market_dates, end, side='right') - 1
+    return market_dates[position] if position >= 0 else np.datetime64('NaT', 'ns')
+
+
+def _pair_sums(stock_dates, stock_returns, market_dates, market_returns):
+    """Count and sums of the (stock, market) return pairs of the stock bars that have a benchmark bar"""
+    if not len(stock_dates) or not len(market_dates):
+        return np.zeros(6)
+    rows = np.searchsorted(market_dates, stock_dates)
+    rows_clipped = np.minimum(rows, len(market_dates) - 1)
+    matched = (rows < len(market_dates)) & (market_dates[rows_clipped] == stock_dates)
+    stock = stock_returns[matched]
+    market = market_returns[rows[matched]]
+    return np.array([len(stock), stock.sum(), market.sum(), (stock * stock).sum(), (market * market).sum(),
+                     (stock * market).sum()])
+
+
+def build_moments(series, market_dates, market_returns, days_window=BETA_WINDOW_DAYS):
+    """
+    Compute the moment state of one stock from scratch
+
+    The window covers days_window calendar days ending on the stock's last
+    bar. The sums run over the bars that also have a benchmark bar, with the
+    same returns as calculate_daily_returns.
+
+    Parameters:
+    series (PriceSeries): Cached stock series
+    market_dates (array): Benchmark dates (datetime64[ns])
+    market_returns (array): Benchmark daily returns
+
+    Returns:
+    dict: Moment state (see advance_moments)
+    """
+    return _build_moments(series.market_code, series.code, series.dates.astype('datetime64[ns]'),
+                          series.daily_returns('ClosePrice'), market_dates, market_returns, days_window)
+
+
+def _build_moments(market_code, ticker, dates, returns, market_dates, market_returns, days_window):
+    end = dates[-1]
+    start = end - np.timedelta64(days_window, 'D')
+    lo = np.searchsorted(dates, start, side='left')
+    sums = _pair_sums(dates[lo:], returns[lo:], market_dates, market_returns)
+
+    state = {
+        'market_code': market_code,
+        'ticker': ticker,
+        'window_days': days_window,
+        'window_start': start,
+        'window_end': end,
+        'market_last': _last_market_date(market_dates, end),
+        'stock_points': int(len(dates) - lo),
+        'count': int(sums[0]),
+        'updates': 0,
+    }
+    state.update({field: float(value) for field, value in zip(SUM_FIELDS, sums[1:])})
+    return state
+
+
+def advance_moments(state, series, market_dates, market_returns):
+    """
+    Move a moment state to the stock's latest bar and benchmark data
+
+    Bars that entered the window are added and bars that fell out of it are
+    subtracted; benchmark days that arrived after the stock bars complete
+    their pairs. Positions are found by binary search and only the days
+    that changed are read from the cached arrays.
+
+    Returns:
+    dict: Updated state, or None when the data moved backwards and the state must be rebuilt
+    """
+    return _advance_moments(state, series.dates, series.daily_returns('ClosePrice'),
+                            series.dates[-1].astype('datetime64[ns]'), market_dates, market_returns)
+
+
+def _advance_moments(state, dates, returns, new_end, market_dates, market_returns):
+    """
+    advance_moments on bare arrays
+
+    dates and returns only have to hold the stock bars of the days that
+    changed: those leaving the window and those after the old benchmark
+    pairs (see _stock_moments).
+    """
+    def position(value, side):
+        # Tìm trên mảng ngày gốc (datetime64[D]) để không phải đổi kiểu cả lịch sử
+        return np.searchsorted(dates, value.astype(dates.dtype), side=side)
+
+    def pair_sums(lo, hi):
+        return _pair_sums(dates[lo:hi].astype('datetime64[ns]'), returns[lo:hi], market_dates, market_returns)
+
+    old_start, old_end, old_last = state['window_start'], state['window_end'], state['market_last']
+    new_last = _last_market_date(market_dates, new_end)
+    if new_end < old_end or (not np.isnat(old_last) and (np.isnat(new_last) or new_last < old_last)):
+        return None
+    new_start = new_end - np.timedelta64(state['window_days'], 'D')
+
+    sums = np.array([state['count']] + [state[field] for field in SUM_FIELDS], dtype=np.float64)
+
+    # Các ngày rơi ra khỏi cửa sổ: [old_start, new_start), chỉ những cặp đã được cộng trước đó
+    evict_lo = position(old_start, 'left')
+    evict_hi = min(position(new_start, 'left'), position(old_end, 'right'))
+    evict_hi = max(evict_hi, evict_lo)
+    paired_hi = evict_lo if np.isnat(old_last) else max(evict_lo, min(evict_hi, position(old_last, 'right')))
+    sums -= pair_sums(evict_lo, paired_hi)
+
+    # Các ngày mới của cổ phiếu: (old_end, new_end]
+    add_lo = max(position(old_end, 'right'), position(new_start, 'left'))
+    stock_points = state['stock_points'] - (evict_hi - evict_lo) + (len(dates) - add_lo)
+
+    # Các cặp mới: ngày cổ phiếu trong cửa sổ mới có chỉ số trong (old_last, new_last]
+    if not np.isnat(new_last):
+        pair_lo = position(new_start, 'left')
+        if not np.isnat(old_last):
+            pair_lo = max(pair_lo, position(old_last, 'right'))
+        pair_hi = max(pair_lo, position(new_last, 'right'))
+        sums += pair_sums(pair_lo, pair_hi)
+
+    state = dict(state)
+    state.update({
+        'window_start': new_start,
+        'window_end': new_end,
+        'market_last': new_last,
+        'stock_points': int(stock_points),
+        'count': int(round(sums[0])),
+        'updates': state['updates'] + 1,
+    })
+    state.update({field: float(value) for field, value in zip(SUM_FIELDS, sums[1:])})
+    return state
+
+
+def beta_from_moments(state, market_dates):
+    """
+    Beta of a moment state, with the same result fields and rules as get_beta_for_stock
+
+    Returns:
+    dict: Beta coefficient and related metrics
+    """
+    stock_code = f"{state['market_code']}:{state['ticker']}"
+    start, end = state['window_start'], state['window_end']
+    end_date = pd.Timestamp(end).strftime('%Y-%m-%d')
+    market_points = np.searchsorted(market_dates, end, side='right') - np.searchsorted(market_dates, start,
+                                                                                       side='left')
+    count = state['count']
+
+    if state['stock_points'] < 5 or market_points < 5:
+        return {'stock_code': stock_code, 'date': end_date, 'beta': None,
+                'error': 'Insufficient data points for reliable beta calculation'}
+    if count < 5:
+        return {'stock_code': stock_code, 'date': end_date, 'beta': None,
+                'error': 'No overlapping data between stock and market'}
+
+    # Cov(Re, Rm) với ddof=1 và Var(Rm) với ddof=0, như calculate_beta
+    covariance = (state['sum_cross'] - state['sum_stock'] * state['sum_market'] / count) / (count - 1)
+    market_variance = (state['sum_market_sq'] - state['sum_market'] ** 2 / count) / count
+    with np.errstate(divide='ignore', invalid='ignore'):
+        beta = float(np.float64(covariance) / np.float64(market_variance))
+
+    return {
+        'stock_code': stock_code,
+        'date': end_date,
+        'beta': beta,
+        'period_start': pd.Timestamp(start).strftime('%Y-%m-%d'),
+        'period_end': end_date,
+        'data_points': count,
+        'calculation_window': state['window_days'],
+        'prediction_horizon': DEFAULT_PREDICTION_HORIZON,
+        'avg_stock_return': state['sum_stock'] / count,
+        'avg_market_return': state['sum_market'] / count,
+        'interpretation': interpret_beta(beta)
+    }
+
+
+def state_to_document(state):
+    document = dict(state)
+    document['stock_code'] = f"{state['market_code']}:{state['ticker']}"
+    for field in ('window_start', 'window_end', 'market_last'):
+        document[field] = _to_datetime(state[field])
+    document['updated_at'] = datetime.utcnow()
+    return document
+
+
+def state_from_document(document):
+    state = {key: value for key, value in document.items() if key not in ('_id', 'stock_code', 'updated_at')}
+    for field in ('window_start', 'window_end', 'market_last'):
+        state[field] = _to_datetime64(document.get(field))
+    return state
+
+
+def _load_returns(collection, key, date_filter, field):
+    """
+    Dates and daily returns of one series over a TradeDate range, read through the (MarketCode, code, TradeDate) index
+
+    The bar before the range is read too, so the first return is the one
+    calculate_daily_returns gives over the whole history. When the same bar
+    was imported more than once the last imported row wins, as in build_series.
+
+    Parameters:
+    collection: stock_data or market_index_data
+    key (dict): MarketCode and Ticker / IndexCode of the series
+    date_filter (dict): TradeDate range with a '$gte' or '$gt' lower bound
+    field (str): Price field
+
+    Returns:
+    tuple: (datetime64[ns] dates, float64 returns)
+    """
+    projection = {'_id': 0, 'TradeDate': 1, field: 1}
+    documents = list(collection.find(dict(key, TradeDate=date_filter), projection,
+                                     sort=[('TradeDate', ASCENDING), ('_id', ASCENDING)]))
+    documents = [document for document in documents if isinstance(document.get('TradeDate'), datetime)]
+    if not documents:
+        return np.array([], dtype='datetime64[ns]'), np.array([], dtype=np.float64)
+
+    before = {'$lt': date_filter['$gte']} if '$gte' in date_filter else {'$lte': date_filter['$gt']}
+    previous = collection.find_one(dict(key, TradeDate=before), projection,
+                                   sort=[('TradeDate', DESCENDING), ('_id', DESCENDING)])
+    if previous is not None:
+        documents.insert(0, previous)
+
+    dates = np.array([document['TradeDate'] for document in documents], dtype='datetime64[D]')
+    prices = to_numeric_column([document.get(field) for document in documents])
+    # Phiên bị import nhiều lần: giữ bản ghi cuối cùng
+    keep = np.append(dates[1:] != dates[:-1], True)
+    dates, prices = dates[keep].astype('datetime64[ns]'), prices[keep]
+
+    returns = np.zeros(len(prices), dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns[1:] = prices[1:] / prices[:-1] - 1
+    returns[np.isnan(returns)] = 0
+    if previous is not None:
+        dates, returns = dates[1:], returns[1:]
+    return dates, returns
+
+
+def _stock_moments(db, market_code, ticker, state, new_end, market_dates, market_returns):
+    """
+    Advance or rebuild the moment state of one ticker from Mongo
+
+    An advance reads only the bars leaving the window and the bars after the
+    old benchmark pairs; a rebuild reads the bars of the new window.
+
+    Returns:
+    tuple: (state, True if it was rebuilt)
+    """
+    key = {'MarketCode': market_code, 'Ticker': ticker}
+    if state is not None:
+        old_start, old_end, old_last = state['window_start'], state['window_end'], state['market_last']
+        new_start = new_end - np.timedelta64(state['window_days'], 'D')
+        parts = []
+        # Các ngày rơi ra khỏi cửa sổ: [old_start, new_start) và không sau old_end
+        evict_end = min(new_start, old_end + np.timedelta64(1, 'D'))
+        if evict_end > old_start:
+            parts.append(_load_returns(db.stock_data, key, {'$gte': _to_datetime(old_start),
+                                                            '$lt': _to_datetime(evict_end)}, 'ClosePrice'))
+        # Các ngày mới và các ngày chưa có cặp chỉ số: sau old_last, trong cửa sổ mới
+        if not np.isnat(old_last) and old_last >= new_start:
+            parts.append(_load_returns(db.stock_data, key, {'$gt': _to_datetime(old_last)}, 'ClosePrice'))
+        else:
+            parts.append(_load_returns(db.stock_data, key, {'$gte': _to_datetime(new_start)}, 'ClosePrice'))
+        dates = np.concatenate([part[0] for part in parts])
+        returns = np.concatenate([part[1] for part in parts])
+        state = _advance_moments(state, dates, returns, new_end, market_dates, market_returns)
+        if state is not None:
+            return state, False
+
+    start = new_end - np.timedelta64(BETA_WINDOW_DAYS, 'D')
+    dates, returns = _load_returns(db.stock_data, key, {'$gte': _to_datetime(start)}, 'ClosePrice')
+    return _build_moments(market_code, ticker, dates, returns, market_dates, market_returns, BETA_WINDOW_DAYS), True
+
+
+def update_market_moments(db, market_code, tickers=None, stale_from=None):
+    """
+    Bring the moment states of a market up to date and publish the new Betas
+
+    Only the days that changed are read: the last bar of each ticker, the
+    bars entering and leaving its window and the benchmark over the oldest
+    window, all through the (MarketCode, code, TradeDate) indexes, so the
+    cost follows the size of the import rather than the market's history.
+    TradeDate must be stored as BSON dates (see migrate_trade_dates).
+
+    Parameters:
+    db: MongoDB database
+    market_code (str): Stock market code
+    tickers (iterable, optional): Tickers touched by a stock import, defaults to every stored state
+    stale_from (dict or datetime64, optional): Earliest imported date per ticker (stock import) or
+                                               of the benchmark (index import); states that already
+                                               cover that date are rebuilt instead of advanced
+
+    Returns:
+    dict: Number of states advanced, rebuilt and Betas published
+    """
+    summary = {'advanced': 0, 'rebuilt': 0, 'published': 0}
+    try:
+        index_market_code, index_code = benchmark_key(market_code)
+    except KeyError:
+        return summary
+
+    query = {'market_code': market_code}
+    if tickers is not None:
+        tickers = list(tickers)
+        query['ticker'] = {'$in': tickers}
+    states = {document['ticker']: state_from_document(document) for document in db.beta_moments.find(query)}
+    if tickers is None:
+        tickers = list(states)
+
+    # Phiên cuối của từng mã và trạng thái còn dùng tiếp được
+    work = []
+    for ticker in tickers:
+        last = db.stock_data.find_one({'MarketCode': market_code, 'Ticker': ticker}, {'_id': 0, 'TradeDate': 1},
+                                      sort=[('TradeDate', DESCENDING), ('_id', DESCENDING)])
+        if last is None or not isinstance(last.get('TradeDate'), datetime):
+            continue
+        new_end = np.datetime64(last['TradeDate'], 'D').astype('datetime64[ns]')
+        state = states.get(ticker)
+
+        # Dữ liệu được sửa hoặc chèn vào quá khứ thì không cộng dồn được, tính lại từ đầu
+        if state is not None and state['updates'] >= MOMENT_REBUILD_UPDATES:
+            state = None
+        elif state is not None and isinstance(stale_from, dict) and ticker in stale_from:
+            if stale_from[ticker] <= state['window_end']:
+                state = None
+        elif state is not None and stale_from is not None and not isinstance(stale_from, dict):
+            if not np.isnat(state['market_last']) and stale_from <= state['market_last']:
+                state = None
+        work.append((ticker, state, new_end))
+    if not work:
+        return summary
+
+    # Chỉ số tham chiếu từ đầu cửa sổ cũ nhất cần đọc
+    market_start = min(state['window_start'] if state is not None else new_end - np.timedelta64(BETA_WINDOW_DAYS, 'D')
+                       for _, state, new_end in work)
+    market_dates, market_returns = _load_returns(db.market_index_data,
+                                                 {'MarketCode': index_market_code, 'IndexCode': index_code},
+                                                 {'$gte': _to_datetime(market_start)}, 'CurrentIndex')
+
+    documents, records = [], []
+    calculation_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    for ticker, state, new_end in work:
+        state, rebuilt = _stock_moments(db, market_code, ticker, state, new_end, market_dates, market_returns)
+        summary['rebuilt' if rebuilt else 'advanced'] += 1
+
+        document = state_to_document(state)
+        documents.append(ReplaceOne({'stock_code': document['stock_code']}, document, upsert=True))
+        result = beta_from_moments(state, market_dates)
+        if result['beta'] is not None and np.isfinite(result['beta']):
+            records.append(beta_record(result, market_code, ticker, DEFAULT_PREDICTION_HORIZON, calculation_date))
+
+    db.beta_moments.bulk_write(documents, ordered=False)
+    publish_betas(db, records)
+    summary['published'] = len(records)
+    return summary
+
+
+def on_stock_import(db, earliest_dates):
+    """
+    Update the moment states of the tickers of a stock import
+
+    Parameters:
+    earliest_dates (dict): {(MarketCode, Ticker): earliest imported date} from earliest_trade_dates
+    """
+    by_market = {}
+    for (market_code, ticker), first_date in earliest_dates.items():
+        by_market.setdefault(market_code, {})[ticker] = first_date
+    return {market_code: update_market_moments(db, market_code, list(tickers), tickers)
+            for market_code, tickers in by_market.items()}
+
+
+def on_index_import(db, earliest_dates):
+    """
+    Complete the pairs of the stock markets whose benchmark index was imported
+
+    Parameters:
+    earliest_dates (dict): {(MarketCode, IndexCode): earliest imported date} from earliest_trade_dates
+    """
+    summaries = {}
+    for market_code in db.beta_moments.distinct('market_code'):
+        try:
+            key = benchmark_key(market_code)
+        except KeyError:
+            continue
+        if key in earliest_dates:
+            summaries[market_code] = update_market_moments(db, market_code, stale_from=earliest_dates[key])
+    return summaries
+
+
+class MomentUpdater:
+    """
+    Runs the Beta moment updates of imports
+
+    Updates run inline by default: they read only the days an import
+    changed, so the import returns with its Betas already published. With
+    background=True (BETA_UPDATE_BACKGROUND=1) they go to one background
+    thread per process instead, so updates of the same process never run
+    concurrently.
+    """
+
+    def __init__(self, background=False):
+        self.background = background
+        self._executor = None
+        self._lock = threading.Lock()
+    def _run(self, function, args):
+        try:
+            return function(*args)
+        except Exception as e:
+            # Dữ liệu đã được ghi, lỗi cập nhật beta không làm hỏng lần import
+            print(f"Error updating beta moments: {str(e)}")
+            raise
+
+    def submit(self, function, *args):
+        """
+        Schedule function(*args)
+
+        Returns:
+        Future: Resolved with the function's result (already done when not in background)
+        """
+        if not self.background:
+            future = Future()
+            try:
+                future.set_result(self._run(function, args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        # Tạo thread khi cần, sau khi fork, để mỗi worker có thread riêng
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='beta-moments')
+            return self._executor.submit(self._run, function, args)
+
+
+def rebuild_market_moments(db, market_code):
+    """Recompute the moment state and Beta of every ticker of a market from the price history"""
+    db.beta_moments.delete_many({'market_code': market_code})
+    tickers = sorted(ticker for ticker in db.stock_data.distinct('Ticker', {'MarketCode': market_code})
+                     if ticker is not None)
+    return update_market_moments(db, market_code, tickers)
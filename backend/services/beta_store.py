@@ -0,0 +1,111 @@
+from datetime import datetime
+
+from pymongo import ReturnDocument, UpdateMany, UpdateOne
+
+# Mỗi mã chỉ giữ một bản ghi beta cho mỗi tầm dự báo
+BETA_KEY_FIELDS = ['stock_code', 'prediction_horizon']
+
+
+# Thống kê của cửa sổ tính beta được lưu kèm khi kết quả có
+BETA_STAT_FIELDS = ['period_start', 'period_end', 'data_points', 'calculation_window', 'avg_stock_return',
+                    'avg_market_return']
+
+
+def beta_record(result, market_code, ticker, days_to_predict, calculation_date=None):
+    """
+    Build the beta_values document stored for one Beta result
+
+    The window statistics (BETA_STAT_FIELDS) are stored when the result has
+    them.
+
+    Parameters:
+    result (dict): Result of get_beta_for_stock / calculate_betas_batch with a Beta value
+    market_code (str): Market code (HNX, HOSE)
+    ticker (str): Stock ticker
+    days_to_predict (int): Prediction horizon
+    calculation_date (str, optional): Timestamp shared by a batch, defaults to now
+
+    Returns:
+    dict: Document for the beta_values collection
+    """
+    record = {
+        'stock_code': result['stock_code'],
+        'market_code': market_code,
+        'ticker': ticker,
+        'date': result['date'],
+        'beta': result['beta'],
+        'calculation_date': calculation_date or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'interpretation': result['interpretation'],
+        'prediction_horizon': days_to_predict
+    }
+    record.update({field: result[field] for field in BETA_STAT_FIELDS if field in result})
+    return record
+
+
+def beta_key(record):
+    return {field: record[field] for field in BETA_KEY_FIELDS}
+
+
+def save_beta(db, record):
+    """
+    Upsert one beta_values document
+
+    Returns:
+    ObjectId: Id of the stored document
+    """
+    stored = db.beta_values.find_one_and_update(
+        beta_key(record),
+        {'$set': record},
+        projection={'_id': 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return stored['_id']
+
+
+def save_betas(db, records):
+    """
+    Upsert many beta_values documents with one unordered bulk write
+
+    Parameters:
+    db: MongoDB database
+    records (list): Documents built by beta_record
+
+    Returns:
+    dict: Number of documents inserted, updated and unchanged
+    """
+    if not records:
+        return {'upserted': 0, 'modified': 0, 'matched': 0}
+    operations = [UpdateOne(beta_key(record), {'$set': record}, upsert=True) for record in records]
+    result = db.beta_values.bulk_write(operations, ordered=False)
+    return {
+        'upserted': result.upserted_count,
+        'modified': result.modified_count,
+        'matched': result.matched_count,
+    }
+
+
+def publish_betas(db, records):
+    """
+    Upsert fresh Beta values and refresh the other horizons stored for the same stocks
+
+    Beta does not depend on the prediction horizon, so the records stored
+    for other horizons get every field of the new record except their own
+    prediction_horizon; window statistics the new record does not have are
+    removed so no record mixes two calculations.
+    """
+    if not records:
+        return
+    operations = []
+    for record in records:
+        own = {'$set': record}
+        others = {'$set': {field: value for field, value in record.items() if field != 'prediction_horizon'}}
+        missing = {field: '' for field in BETA_STAT_FIELDS if field not in record}
+        if missing:
+            own['$unset'] = others['$unset'] = missing
+        operations.append(UpdateOne(beta_key(record), own, upsert=True))
+        operations.append(UpdateMany(
+            {'stock_code': record['stock_code'], 'prediction_horizon': {'$ne': record['prediction_horizon']}},
+            others
+        ))
+    db.beta_values.bulk_write(operations, ordered=False)
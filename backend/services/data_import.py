@@ -0,0 +1,329 @@
+import os
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+from services.beta_moments import earliest_trade_dates, merge_earliest_dates
+from services.market_snapshot import refresh_market_nav, update_latest_snapshot
+
+# Các định dạng ngày được chấp nhận khi import, theo thứ tự ưu tiên
+DATE_FORMATS = ['%Y-%m-%d', '%Y/%m/%d', '%m/%d/%Y', '%d/%m/%Y']
+
+# Các trường số được chuyển kiểu khi import
+STOCK_NUMERIC_FIELDS = ['OpenPrice', 'HighestPrice', 'LowestPrice', 'ClosePrice', 'TotalVolume']
+INDEX_NUMERIC_FIELDS = ['CurrentIndex', 'OpenIndex', 'HighestIndex', 'LowestIndex', 'CloseIndex', 'TotalVolume',
+                        'TotalValue']
+
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', '20000'))
+
+# Các collection có TradeDate cần chuyển từ chuỗi sang BSON date khi nâng cấp
+TRADE_DATE_COLLECTIONS = ['stock_data', 'market_index_data', 'latest_snapshot']
+
+
+def normalize_trade_date(value):
+    """Convert one TradeDate value to a datetime, or return it unchanged if it cannot be parsed"""
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime() if not pd.isna(value) else None
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    if not isinstance(value, str):
+        return value
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), date_format)
+        except ValueError:
+            continue
+    return value
+
+
+def detect_date_format(values, sample_size=200):
+    """Return the DATE_FORMATS entry parsing most of a sample of strings (earliest on ties), or None"""
+    sample = pd.Series(values[:sample_size], dtype=object).str.strip()
+    best_format, best_count = None, 0
+    for date_format in DATE_FORMATS:
+        count = int(pd.to_datetime(sample, format=date_format, errors='coerce').notna().sum())
+        if count > best_count:
+            best_format, best_count = date_format, count
+    return best_format
+
+
+def normalize_trade_dates(values):
+    """
+    Convert a whole TradeDate column to native datetimes
+
+    Each distinct value is parsed once. The format is detected on a sample
+    of the batch and applied to all strings in one vectorized pass, but
+    only strings that match it unambiguously keep that result: a string
+    that another DATE_FORMATS entry reads as a different date (such as
+    '01/04/2024') or that does not match the batch format goes through
+    normalize_trade_date, so every value gets the same date as when it is
+    parsed on its own. Values that cannot be parsed are kept as they are.
+
+    Parameters:
+    values (list or array): Raw TradeDate values of one import batch
+
+    Returns:
+    array: Object array of datetimes (stored by Mongo as BSON dates) or original values
+    """
+    values = pd.Series(values, dtype=object)
+    codes, uniques = pd.factorize(values, sort=False)
+    uniques = np.asarray(uniques, dtype=object)
+    converted = np.empty(len(uniques), dtype=object)
+
+    is_string = np.array([isinstance(value, str) for value in uniques], dtype=bool)
+    strings = uniques[is_string]
+    date_format = detect_date_format(strings)
+    if date_format is not None:
+        stripped = pd.Series(strings, dtype=object).str.strip()
+        parsed = pd.to_datetime(stripped, format=date_format, errors='coerce')
+        # Chuỗi mà định dạng khác đọc thành ngày khác (ví dụ 01/04/2024) là mơ hồ
+        ambiguous = np.zeros(len(strings), dtype=bool)
+        for other_format in DATE_FORMATS:
+            if other_format != date_format:
+                other = pd.to_datetime(stripped, format=other_format, errors='coerce')
+                ambiguous |= (other.notna() & (other != parsed)).to_numpy()
+        parsed = np.array([value.to_pydatetime() if not pd.isna(value) else None for value in parsed], dtype=object)
+        parsed[ambiguous] = None
+    else:
+        parsed = np.full(len(strings), None, dtype=object)
+
+    # Chuỗi mơ hồ hoặc không khớp định dạng chung thì thử lần lượt các định dạng
+    for i in np.flatnonzero([value is None for value in parsed]):
+        parsed[i] = normalize_trade_date(strings[i])
+    converted[is_string] = parsed
+
+    for i in np.flatnonzero(~is_string):
+        converted[i] = normalize_trade_date(uniques[i])
+
+    result = np.asarray(values.values, dtype=object).copy()
+    present = codes >= 0
+    result[present] = converted[codes[present]]
+    return result
+
+
+def migrate_trade_dates(db, collection, batch_size=None):
+    """
+    Convert the string TradeDate values stored before imports used BSON dates
+
+    Documents are read in _id order in batches, parsed with
+    normalize_trade_dates and rewritten with unordered bulk updates. Each
+    update also matches the old string, so a row changed meanwhile is left
+    alone. Strings matching no DATE_FORMATS entry are kept and counted.
+    Running it again only touches the rows still holding strings.
+
+    Parameters:
+    db: MongoDB database
+    collection (str): Collection to migrate, one of TRADE_DATE_COLLECTIONS
+    batch_size (int, optional): Documents per batch, defaults to IMPORT_CHUNK_SIZE
+
+    Returns:
+    dict: Number of documents converted and of strings left unparsed
+    """
+    from pymongo import UpdateOne
+
+    batch_size = batch_size or IMPORT_CHUNK_SIZE
+    converted = unparsed = 0
+    last_id = None
+    while True:
+        query = {'TradeDate': {'$type': 'string'}}
+        if last_id is not None:
+            query['_id'] = {'$gt': last_id}
+        batch = list(db[collection].find(query, {'TradeDate': 1}).sort('_id', 1).limit(batch_size))
+        if not batch:
+            break
+        last_id = batch[-1]['_id']
+
+        trade_dates = normalize_trade_dates([document['TradeDate'] for document in batch])
+        operations = [
+            UpdateOne({'_id': document['_id'], 'TradeDate': document['TradeDate']},
+                      {'$set': {'TradeDate': trade_date}})
+            for document, trade_date in zip(batch, trade_dates)
+            if isinstance(trade_date, datetime)
+        ]
+        unparsed += len(batch) - len(operations)
+        if operations:
+            converted += db[collection].bulk_write(operations, ordered=False).modified_count
+
+    return {'converted': converted, 'unparsed': unparsed}
+
+
+def coerce_numeric(values):
+    """
+    Convert a column to numbers where possible
+
+    Strings such as '1,234.5' become floats; values that cannot be parsed
+    are kept as they are, like the JSON import endpoints do.
+    """
+    series = pd.Series(values)
+    if series.dtype != object:
+        return series
+    numbers = pd.to_numeric(series.astype(str).str.replace(',', '', regex=False), errors='coerce')
+    return numbers.astype(object).where(numbers.notna(), series)
+
+
+def coerce_chunk(chunk, numeric_fields):
+    """Normalize dates and numeric fields of one parsed chunk"""
+    if 'TradeDate' in chunk.columns:
+        chunk['TradeDate'] = normalize_trade_dates(chunk['TradeDate'].values)
+
+    for field in numeric_fields:
+        if field in chunk.columns:
+            chunk[field] = coerce_numeric(chunk[field])
+    return chunk
+
+
+def iter_csv_chunks(stream, chunk_size=None):
+    """Parse a CSV file stream lazily, yielding DataFrames of at most chunk_size rows"""
+    reader = pd.read_csv(
+        stream,
+        dtype=str,
+        keep_default_na=False,
+        skip_blank_lines=True,
+        encoding='utf-8-sig',
+        chunksize=chunk_size or IMPORT_CHUNK_SIZE
+    )
+    for chunk in reader:
+        yield chunk
+
+
+def iter_excel_chunks(stream, chunk_size=None):
+    """Parse the first sheet of an XLSX file in read-only mode, yielding DataFrames of at most chunk_size rows"""
+    from openpyxl import load_workbook
+
+    chunk_size = chunk_size or IMPORT_CHUNK_SIZE
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(name) if name is not None else f"Column{i}" for i, name in enumerate(header)]
+
+        buffer = []
+        for row in rows:
+            if row is None or all(value is None for value in row):
+                continue
+            buffer.append(row)
+            if len(buffer) >= chunk_size:
+                yield pd.DataFrame.from_records(buffer, columns=columns)
+                buffer = []
+        if buffer:
+            yield pd.DataFrame.from_records(buffer, columns=columns)
+    finally:
+        workbook.close()
+
+
+def iter_xls_chunks(stream, chunk_size=None):
+    """
+    Parse the first sheet of a legacy .xls file, yielding DataFrames of at most chunk_size rows
+
+    xlrd reads the whole workbook at once, so only the Mongo writes are
+    chunked; .xls sheets are limited to 65536 rows anyway.
+    """
+    chunk_size = chunk_size or IMPORT_CHUNK_SIZE
+    frame = pd.read_excel(stream, sheet_name=0, dtype=object, engine='xlrd')
+    frame = frame.dropna(how='all')
+    for start in range(0, len(frame), chunk_size):
+        yield frame.iloc[start:start + chunk_size].reset_index(drop=True)
+
+
+def iter_file_chunks(file_name, stream, chunk_size=None):
+    """Pick the chunked parser matching the uploaded file's extension"""
+    name = (file_name or '').lower()
+    if name.endswith('.csv'):
+        return iter_csv_chunks(stream, chunk_size)
+    if name.endswith('.xlsx') or name.endswith('.xlsm'):
+        return iter_excel_chunks(stream, chunk_size)
+    if name.endswith('.xls'):
+        return iter_xls_chunks(stream, chunk_size)
+    raise ValueError("Unsupported file type, please upload a CSV, XLSX or XLS file")
+
+
+def chunk_to_records(chunk):
+    """Convert a coerced chunk to Mongo documents, mapping NaN/NaT to None"""
+    chunk = chunk.astype(object).where(pd.notna(chunk), None)
+    records = chunk.to_dict('records')
+    for record in records:
+        for key, value in record.items():
+            if isinstance(value, np.generic):
+                record[key] = value.item()
+            elif isinstance(value, pd.Timestamp):
+                record[key] = value.to_pydatetime()
+    return records
+
+
+def stream_import(db, data_collection, imports_collection, import_id, chunks, numeric_fields, market_codes=None,
+                  earliest_dates=None):
+    """
+    Write parsed chunks to Mongo with unordered batched inserts
+
+    The import record is updated after every chunk so clients can follow
+    progress, and marked completed or failed at the end. market_codes and
+    earliest_dates are filled as chunks are written, so a caller passing its
+    own containers still knows what was stored when the import fails partway.
+
+    Parameters:
+    db: MongoDB database
+    data_collection (str): Collection receiving the rows (stock_data, market_index_data)
+    imports_collection (str): Collection holding the import record (imports, market_index_imports)
+    import_id (ObjectId): Id of the import record
+    chunks (iterator): DataFrames produced by iter_file_chunks
+    numeric_fields (list): Fields converted to numbers
+    market_codes (set, optional): Receives the MarketCode values written
+    earliest_dates (dict, optional): Receives the earliest TradeDate of every (MarketCode, Ticker / IndexCode) written
+
+    Returns:
+    tuple: (number of records written, set of MarketCode values seen, preview rows,
+            earliest TradeDate of every (MarketCode, Ticker / IndexCode) written)
+    """
+    import_id_str = str(import_id)
+    records_count = 0
+    market_codes = set() if market_codes is None else market_codes
+    preview = []
+    earliest_dates = {} if earliest_dates is None else earliest_dates
+    code_column = 'Ticker' if data_collection == 'stock_data' else 'IndexCode'
+
+    try:
+        for chunk in chunks:
+            if chunk.empty:
+                continue
+            chunk = coerce_chunk(chunk, numeric_fields)
+            chunk['import_id'] = import_id_str
+            if 'MarketCode' in chunk.columns:
+                market_codes.update(code for code in chunk['MarketCode'].unique() if code is not None)
+
+            records = chunk_to_records(chunk)
+            if not preview:
+                preview = [dict(record) for record in records[:5]]
+            db[data_collection].insert_many(records, ordered=False)
+            merge_earliest_dates(earliest_dates, earliest_trade_dates(chunk, code_column))
+
+            # Cập nhật bản ghi mới nhất của từng mã trong cùng lượt ghi
+            if data_collection == 'stock_data':
+                update_latest_snapshot(db, chunk)
+
+            records_count += len(records)
+            db[imports_collection].update_one(
+                {'_id': import_id},
+                {'$set': {'records_count': records_count, 'status': 'processing'}}
+            )
+    except Exception as e:
+        db[imports_collection].update_one(
+            {'_id': import_id},
+            {'$set': {'records_count': records_count, 'status': 'failed', 'error': str(e)}}
+        )
+        raise
+    finally:
+        # NAV của thị trường tính lại một lần, kể cả khi import dừng giữa chừng
+        if data_collection == 'stock_data' and market_codes:
+            refresh_market_nav(db, market_codes)
+
+    db[imports_collection].update_one(
+        {'_id': import_id},
+        {'$set': {'records_count': records_count, 'status': 'completed',
+                  'completed_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S")}}
+    )
+    return records_count, market_codes, preview, earliest_dates
@@ -0,0 +1,217 @@
+import base64
+import json
+import re
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING
+
+from services.data_import import normalize_trade_date
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 10000
+
+# Thứ tự trang: (TradeDate, _id) tăng dần, khớp với các index *_TradeDate_1_id_1
+PAGE_SORT = [('TradeDate', ASCENDING), ('_id', ASCENDING)]
+
+_FIELD_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def parse_fields(value):
+    """
+    Parse a fields=A,B,C argument into the list of requested fields
+
+    Returns:
+    list: Field names, or None when all fields are requested
+
+    Raises:
+    ValueError: If a name is not a plain field name
+    """
+    if not value:
+        return None
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    for field in fields:
+        if not _FIELD_NAME.match(field):
+            raise ValueError(f"Invalid field name: {field}")
+    return fields or None
+
+
+def parse_limit(value, default=DEFAULT_PAGE_SIZE):
+    """Parse a limit argument, clamped to 1..MAX_PAGE_SIZE"""
+    if value in (None, ''):
+        return default
+    return max(1, min(int(value), MAX_PAGE_SIZE))
+
+
+def parse_date(value):
+    """Parse a from/to date argument in any of the import date formats"""
+    parsed = normalize_trade_date(value)
+    if not isinstance(parsed, datetime):
+        raise ValueError(f"Invalid date: {value}")
+    return parsed
+
+
+def encode_cursor(document):
+    """
+    Build the opaque cursor pointing just after a document
+
+    The TradeDate type is kept ('t'): rows imported before dates were
+    stored as BSON dates hold strings, and Mongo only matches a string
+    against strings.
+    """
+    trade_date = document.get('TradeDate')
+    if isinstance(trade_date, datetime):
+        raw = {'d': trade_date.isoformat(), 't': 'date'}
+    elif isinstance(trade_date, str):
+        raw = {'d': trade_date, 't': 'str'}
+    else:
+        raw = {'d': None}
+    raw['i'] = str(document['_id'])
+    return base64.urlsafe_b64encode(json.dumps(raw).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor from encode_cursor
+
+    Returns:
+    tuple: (TradeDate, ObjectId) of the last document of the previous page, TradeDate
+           being a datetime, a string (legacy rows) or None
+
+    Raises:
+    ValueError: If the cursor is malformed
+    """
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        trade_date = raw.get('d')
+        if trade_date is not None and raw.get('t', 'date') == 'date':
+            trade_date = datetime.fromisoformat(trade_date)
+        elif trade_date is not None and not isinstance(trade_date, str):
+            raise ValueError("Invalid cursor")
+        return trade_date, ObjectId(raw['i'])
+    except (ValueError, KeyError, TypeError, InvalidId):
+        raise ValueError("Invalid cursor")
+
+
+def after_cursor_filter(cursor):
+    """
+    Filter selecting documents strictly after the cursor in PAGE_SORT order
+
+    Mongo sorts null before strings and strings before dates, while $gt
+    only compares values of the same type, so a string cursor also selects
+    every date.
+    """
+    trade_date, object_id = decode_cursor(cursor)
+    if trade_date is None:
+        # null đứng trước mọi ngày khi sắp xếp
+        return {'$or': [{'TradeDate': {'$ne': None}}, {'TradeDate': None, '_id': {'$gt': object_id}}]}
+    clauses = [{'TradeDate': {'$gt': trade_date}}, {'TradeDate': trade_date, '_id': {'$gt': object_id}}]
+    if isinstance(trade_date, str):
+        clauses.append({'TradeDate': {'$type': 'date'}})
+    return {'$or': clauses}
+
+
+def date_range_filter(start=None, end=None):
+    """
+    TradeDate filter between two dates (inclusive)
+
+    BSON dates are compared as dates. Rows still holding 'YYYY-MM-DD'
+    strings (imported before the migration) are matched by comparing
+    strings in that format; other string formats need migrate_trade_dates.
+    """
+    dates, strings = {}, {}
+    if start is not None:
+        dates['$gte'] = start
+        strings['$gte'] = start.strftime('%Y-%m-%d')
+    if end is not None:
+        dates['$lte'] = end
+        strings['$lte'] = end.strftime('%Y-%m-%d')
+    return {'$or': [{'TradeDate': dates}, {'TradeDate': strings}]}
+
+
+def build_query(args, code_column=None, base=None):
+    """
+    Build a Mongo filter from request arguments
+
+    Parameters:
+    args (MultiDict): Request arguments (market_code, ticker / index_code, from, to, after)
+    code_column (str, optional): Ticker or IndexCode, filtered by a comma separated list
+    base (dict, optional): Filter the query always includes (e.g. import_id)
+
+    Returns:
+    dict: Mongo filter
+    """
+    clauses = [dict(base)] if base else []
+
+    market_code = args.get('market_code')
+    if market_code:
+        clauses.append({'MarketCode': market_code})
+
+    if code_column:
+        code_arg = args.get('ticker') if code_column == 'Ticker' else args.get('index_code')
+        codes = [code.strip() for code in (code_arg or '').split(',') if code.strip()]
+        if len(codes) == 1:
+            clauses.append({code_column: codes[0]})
+        elif codes:
+            clauses.append({code_column: {'$in': codes}})
+
+    start = parse_date(args.get('from')) if args.get('from') else None
+    end = parse_date(args.get('to')) if args.get('to') else None
+    if start is not None or end is not None:
+        clauses.append(date_range_filter(start, end))
+
+    if args.get('after'):
+        clauses.append(after_cursor_filter(args.get('after')))
+
+    if not clauses:
+        return {}
+    return clauses[0] if len(clauses) == 1 else {'$and': clauses}
+
+
+def build_projection(fields):
+    """Projection fetching the requested fields plus the keys the cursor needs"""
+    if fields is None:
+        return None
+    projection = {field: 1 for field in fields}
+    projection['TradeDate'] = 1
+    projection['_id'] = 1
+    return projection
+
+
+def shape_document(document, fields):
+    """Drop keys that were only fetched for the cursor"""
+    if fields is None or '_id' not in fields:
+        document.pop('_id', None)
+    if fields is not None and 'TradeDate' not in fields:
+        document.pop('TradeDate', None)
+    return document
+
+
+def find_page(collection, query, fields=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Read one keyset page
+
+    Returns:
+    tuple: (documents, cursor of the next page or None when this is the last page)
+    """
+    documents = list(collection.find(query, build_projection(fields)).sort(PAGE_SORT).limit(limit + 1))
+    next_cursor = encode_cursor(documents[limit - 1]) if len(documents) > limit else None
+    return [shape_document(document, fields) for document in documents[:limit]], next_cursor
+
+
+def iter_ndjson(collection, query, fields=None, limit=None, dumps=json.dumps):
+    """
+    Stream matching documents as newline-delimited JSON straight from the Mongo cursor
+
+    Parameters:
+    dumps (callable): Serializer for one document (the app's JSON encoder)
+    """
+    cursor = collection.find(query, build_projection(fields)).sort(PAGE_SORT)
+    if limit:
+        cursor = cursor.limit(limit)
+    try:
+        for document in cursor:
+            yield dumps(shape_document(document, fields)) + '\n'
+    finally:
+        cursor.close()
@@ -0,0 +1,269 @@
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import ConnectionFailure, DuplicateKeyError, OperationFailure, PyMongoError
+
+# Index cho từng collection, khớp với các dạng truy vấn của API
+# (collection, [(field, direction)], options)
+INDEX_SPECS = [
+    # PriceStore tải theo MarketCode, tra cứu theo mã và quét theo khoảng ngày
+    ('stock_data',
+     [('MarketCode', ASCENDING), ('Ticker', ASCENDING), ('TradeDate', ASCENDING), ('_id', ASCENDING)], {}),
+    # Phân trang keyset theo (TradeDate, _id), có hoặc không lọc theo import_id
+    ('stock_data', [('import_id', ASCENDING), ('TradeDate', ASCENDING), ('_id', ASCENDING)], {}),
+    ('stock_data', [('TradeDate', ASCENDING), ('_id', ASCENDING)], {}),
+    ('market_index_data',
+     [('MarketCode', ASCENDING), ('IndexCode', ASCENDING), ('TradeDate', ASCENDING), ('_id', ASCENDING)], {}),
+    ('market_index_data', [('import_id', ASCENDING), ('TradeDate', ASCENDING), ('_id', ASCENDING)], {}),
+    ('market_index_data', [('TradeDate', ASCENDING), ('_id', ASCENDING)], {}),
+    ('beta_values', [('market_code', ASCENDING), ('ticker', ASCENDING), ('prediction_horizon', ASCENDING)], {}),
+    ('beta_values', [('prediction_horizon', ASCENDING)], {}),
+    # Khóa upsert của kết quả beta: một bản ghi cho mỗi mã và tầm dự báo
+    ('beta_values', [('stock_code', ASCENDING), ('prediction_horizon', ASCENDING)], {'unique': True}),
+    ('beta_moments', [('stock_code', ASCENDING)], {'unique': True}),
+    ('beta_moments', [('market_code', ASCENDING), ('ticker', ASCENDING)], {}),
+    ('svm_analyses', [('market_code', ASCENDING), ('ticker', ASCENDING), ('date', DESCENDING)], {}),
+    ('portfolio_betas', [('calculation_date', DESCENDING)], {}),
+    ('latest_snapshot', [('MarketCode', ASCENDING), ('Ticker', ASCENDING)], {'unique': True}),
+    ('latest_snapshot', [('MarketCode', ASCENDING), ('TradeDate', ASCENDING), ('Ticker', ASCENDING)], {}),
+    ('market_nav', [('MarketCode', ASCENDING)], {'unique': True}),
+    # Phiên đẩy qua /bars, dùng chung cho mọi tiến trình của IndicatorEngine
+    ('stream_bars', [('MarketCode', ASCENDING), ('Ticker', ASCENDING), ('TradeDate', ASCENDING)], {'unique': True}),
+    ('jobs', [('status', ASCENDING), ('created_at', ASCENDING)], {}),
+    ('jobs', [('status', ASCENDING), ('lease_expires_at', ASCENDING)], {}),
+]
+
+# IndexOptionsConflict / IndexKeySpecsConflict: index cùng tên nhưng khác tùy chọn
+INDEX_OPTIONS_CONFLICT_CODES = (85, 86)
+
+# Index của các phiên bản trước đã được thay thế bởi INDEX_SPECS, xóa sau khi index mới được tạo
+# (collection, [(field, direction)])
+SUPERSEDED_INDEXES = [
+    # Thay bằng các index có thêm _id cho phân trang keyset
+    ('stock_data', [('MarketCode', ASCENDING), ('Ticker', ASCENDING), ('TradeDate', ASCENDING)]),
+    ('stock_data', [('import_id', ASCENDING), ('TradeDate', ASCENDING)]),
+    ('market_index_data', [('MarketCode', ASCENDING), ('IndexCode', ASCENDING), ('TradeDate', ASCENDING)]),
+    ('market_index_data', [('import_id', ASCENDING)]),
+]
+
+# Khóa unique mà dữ liệu cũ có thể đang trùng, dọn trước khi tạo index:
+# (collection, các trường của khóa, trường xác định bản ghi mới nhất được giữ lại)
+DEDUPLICATED_KEYS = [
+    # Trước khi có upsert, mỗi lần tính Beta chèn thêm một bản ghi cho cùng mã và tầm dự báo
+    ('beta_values', ['stock_code', 'prediction_horizon'], 'calculation_date'),
+]
+
+# Các truy vấn tiêu biểu được explain: (collection, fields lấy giá trị mẫu cho filter, sort)
+QUERY_SHAPES = [
+    ('stock_data', ['MarketCode'], None),
+    ('stock_data', ['MarketCode', 'Ticker'], [('TradeDate', ASCENDING), ('_id', ASCENDING)]),
+    ('stock_data', ['import_id'], [('TradeDate', ASCENDING), ('_id', ASCENDING)]),
+    ('market_index_data', ['MarketCode', 'IndexCode'], [('TradeDate', ASCENDING), ('_id', ASCENDING)]),
+    ('beta_values', ['market_code', 'ticker'], None),
+    ('beta_values', ['market_code'], None),
+    ('beta_values', ['stock_code', 'prediction_horizon'], None),
+    ('svm_analyses', ['market_code', 'ticker'], [('date', DESCENDING)]),
+]
+
+
+def index_name(keys):
+    """Name an index after its keys, the same way MongoDB does by default"""
+    return '_'.join(f"{field}_{direction}" for field, direction in keys)
+
+
+def remove_duplicate_keys(db, collection, key_fields, newest_field):
+    """
+    Keep only the newest document of every key, so a unique index on it can be built
+
+    Documents sharing the key fields are ordered by newest_field (then _id)
+    and all but the first are deleted.
+
+    Parameters:
+    db: MongoDB database
+    collection (str): Collection to clean
+    key_fields (list): Fields of the unique key
+    newest_field (str): Field whose highest value marks the document kept
+
+    Returns:
+    int: Number of documents deleted
+    """
+    pipeline = [
+        {'$sort': {newest_field: -1, '_id': -1}},
+        {'$group': {'_id': {field: f'${field}' for field in key_fields},
+                    'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}},
+    ]
+    removed = 0
+    for group in db[collection].aggregate(pipeline, allowDiskUse=True):
+        removed += db[collection].delete_many({'_id': {'$in': group['ids'][1:]}}).deleted_count
+    return removed
+
+
+def ensure_indexes(db):
+    """
+    Create the indexes in INDEX_SPECS if they do not exist yet, then drop SUPERSEDED_INDEXES
+
+    create_index is idempotent, so this is safe to call on every startup.
+    Keys listed in DEDUPLICATED_KEYS are cleaned first, keeping the newest
+    document of each key, so their unique index can be built on data
+    written before it existed. A superseded index is only dropped once
+    every index of its collection was created, so its queries are never
+    left without an index. Failures are reported per index and do not stop
+    the application; a unique index failing on duplicate keys is listed
+    under 'failed' with the duplicated key.
+
+    Parameters:
+    db: MongoDB database
+
+    Returns:
+    dict: {'created': {collection: [created or existing index names]},
+           'dropped': {collection: [dropped index names]},
+           'deduplicated': {collection: number of duplicate documents deleted},
+           'failed': {collection: {index name: error message}}}
+    """
+    created, dropped, deduplicated, errors = {}, {}, {}, {}
+    result = {'created': created, 'dropped': dropped, 'deduplicated': deduplicated, 'failed': errors}
+
+    for collection, key_fields, newest_field in DEDUPLICATED_KEYS:
+        try:
+            removed = remove_duplicate_keys(db, collection, key_fields, newest_field)
+        except ConnectionFailure as e:
+            print(f"Could not create indexes, database unavailable: {e}")
+            return result
+        except PyMongoError as e:
+            # Index unique sẽ báo lỗi trùng khóa bên dưới
+            print(f"Could not remove duplicate {'/'.join(key_fields)} keys from {collection}: {e}")
+            continue
+        if removed:
+            deduplicated[collection] = removed
+            print(f"Removed {removed} duplicate {'/'.join(key_fields)} documents from {collection}")
+
+    for collection, keys, options in INDEX_SPECS:
+        try:
+            try:
+                name = db[collection].create_index(keys, name=index_name(keys), background=True, **options)
+            except OperationFailure as e:
+                if e.code not in INDEX_OPTIONS_CONFLICT_CODES:
+                    raise
+                # Index cùng khóa đã tồn tại với tùy chọn cũ (ví dụ chưa unique), tạo lại
+                db[collection].drop_index(index_name(keys))
+                try:
+                    name = db[collection].create_index(keys, name=index_name(keys), background=True, **options)
+                except DuplicateKeyError:
+                    # Giữ lại index cũ (không unique) để các truy vấn vẫn có index
+                    db[collection].create_index(keys, name=index_name(keys), background=True)
+                    raise
+            created.setdefault(collection, []).append(name)
+        except ConnectionFailure as e:
+            # Không kết nối được thì bỏ qua các index còn lại thay vì chờ timeout cho từng index
+            print(f"Could not create indexes, database unavailable: {e}")
+            return result
+        except DuplicateKeyError as e:
+            # E11000: dữ liệu có bản ghi trùng khóa, index unique không được tạo
+            message = f"Duplicate keys, unique index not created: {e}"
+            errors.setdefault(collection, {})[index_name(keys)] = message
+            print(f"Could not create index {index_name(keys)} on {collection}. {message}")
+        except PyMongoError as e:
+            errors.setdefault(collection, {})[index_name(keys)] = str(e)
+            print(f"Could not create index {index_name(keys)} on {collection}: {e}")
+
+    for collection, keys in SUPERSEDED_INDEXES:
+        name = index_name(keys)
+        if collection in errors:
+            continue
+        try:
+            if name in db[collection].index_information():
+                db[collection].drop_index(name)
+                dropped.setdefault(collection, []).append(name)
+        except PyMongoError as e:
+            print(f"Could not drop index {name} on {collection}: {e}")
+    return result
+
+
+def _winning_plan_summary(plan):
+    """Flatten a winning plan tree into its stages and the indexes it uses"""
+    stages, indexes = [], []
+    while plan:
+        stages.append(plan.get('stage'))
+        if plan.get('indexName'):
+            indexes.append(plan['indexName'])
+        plan = plan.get('inputStage') or (plan.get('inputStages') or [None])[0]
+    return stages, indexes
+
+
+def explain_query(collection, query, sort=None):
+    """
+    Explain one query and summarize how MongoDB executes it
+
+    Returns:
+    dict: Winning plan stages, index used and execution statistics
+    """
+    cursor = collection.find(query)
+    if sort:
+        cursor = cursor.sort(sort)
+    explanation = cursor.explain()
+
+    stages, indexes = _winning_plan_summary(explanation.get('queryPlanner', {}).get('winningPlan', {}))
+    stats = explanation.get('executionStats', {})
+    return {
+        'filter': {field: str(value) for field, value in query.items()},
+        'sort': [field for field, _ in sort] if sort else None,
+        'stages': stages,
+        'indexes': indexes,
+        'collection_scan': 'COLLSCAN' in stages,
+        'keys_examined': stats.get('totalKeysExamined'),
+        'docs_examined': stats.get('totalDocsExamined'),
+        'returned': stats.get('nReturned'),
+        'time_ms': stats.get('executionTimeMillis'),
+    }
+
+
+def index_report(db, explain=True):
+    """
+    Report index definitions, usage counters ($indexStats) and query plans per collection
+
+    Parameters:
+    db: MongoDB database
+    explain (bool): Also explain the representative QUERY_SHAPES
+
+    Returns:
+    dict: {collection: {'indexes': [...], 'queries': [...]}}
+    """
+    report = {}
+    for collection_name in sorted({spec[0] for spec in INDEX_SPECS}):
+        collection = db[collection_name]
+        entry = {'indexes': [], 'queries': []}
+
+        try:
+            usage = {stat['name']: stat for stat in collection.aggregate([{'$indexStats': {}}])}
+        except Exception as e:
+            # $indexStats cần MongoDB 3.2+ và quyền clusterMonitor
+            usage = {}
+            entry['index_stats_error'] = str(e)
+
+        for name, info in collection.index_information().items():
+            accesses = usage.get(name, {}).get('accesses', {})
+            since = accesses.get('since')
+            entry['indexes'].append({
+                'name': name,
+                'keys': [[field, direction] for field, direction in info['key']],
+                'unique': bool(info.get('unique', False)),
+                'ops': accesses.get('ops'),
+                'since': since.strftime("%Y-%m-%d %H:%M:%S") if since else None,
+            })
+
+        if explain:
+            for shape_collection, fields, sort in QUERY_SHAPES:
+                if shape_collection != collection_name:
+                    continue
+                # Lấy giá trị mẫu từ một document có sẵn để explain sát với thực tế
+                sample = collection.find_one({field: {'$exists': True} for field in fields},
+                                             {field: 1 for field in fields})
+                if sample is None:
+                    continue
+                query = {field: sample.get(field) for field in fields}
+                try:
+                    entry['queries'].append(explain_query(collection, query, sort))
+                except Exception as e:
+                    entry['queries'].append({'filter': list(fields), 'error': str(e)})
+
+        report[collection_name] = entry
+    return report
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import shutil
+import threading
+
+import numpy as np
+
+# Tăng khi cách tính các chỉ báo thay đổi, để các ma trận đã lưu không còn được dùng
+FEATURE_SCHEMA_VERSION = 1
+
+
+def make_feature_key(stock_code, data_version, feature_columns=()):
+    """
+    Build the feature store key of one ticker's indicator matrix
+
+    The key also covers FEATURE_SCHEMA_VERSION and the feature columns, so
+    a deployment that changes the indicators or their order does not read
+    matrices written by the previous code.
+
+    Parameters:
+    stock_code (str): MarketCode:Ticker
+    data_version (str): Version of the imported stock data (see PriceStore.data_version)
+    feature_columns (list, optional): Columns of the matrix, in order
+
+    Returns:
+    str: Hex digest usable as a directory name
+    """
+    raw = f"{FEATURE_SCHEMA_VERSION}|{stock_code}|{data_version}|{','.join(feature_columns)}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class FeatureStore:
+    """
+    Local-directory store of per-ticker technical indicator matrices
+
+    Each entry is a directory with two uncompressed .npy files: the
+    float64 feature matrix (one row per trading day, columns in
+    FEATURE_COLUMNS order, rows with missing indicators already dropped)
+    and its datetime64 date index. Entries are written once per data
+    version and read back memory-mapped, so every prediction horizon
+    reuses the same features and only the labels are regenerated.
+    Every 64 writes, entries beyond max_entries are deleted least
+    recently used first.
+    """
+
+    FEATURES_FILE = 'features.npy'
+    DATES_FILE = 'dates.npy'
+
+    def __init__(self, directory, max_entries=4096):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """
+        Return (dates, features) for key, memory-mapped, or None on a miss
+        """
+        path = self._path(key)
+        try:
+            dates = np.load(os.path.join(path, self.DATES_FILE), mmap_mode='r', allow_pickle=False)
+            features = np.load(os.path.join(path, self.FEATURES_FILE), mmap_mode='r', allow_pickle=False)
+        except (FileNotFoundError, OSError, ValueError):
+            return None
+
+        # Cập nhật thời điểm sử dụng để phục vụ LRU
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return dates, features
+
+    def put(self, key, dates, features):
+        """Persist one ticker's dates and feature matrix and evict the least recently used entries"""
+        # Ghi vào thư mục tạm rồi đổi tên để tiến trình khác không đọc phải dữ liệu dở dang
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        os.makedirs(tmp_path, exist_ok=True)
+        np.save(os.path.join(tmp_path, self.DATES_FILE), np.ascontiguousarray(dates, dtype='datetime64[ns]'))
+        np.save(os.path.join(tmp_path, self.FEATURES_FILE), np.ascontiguousarray(features, dtype=np.float64))
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Một tiến trình khác đã ghi cùng phiên bản dữ liệu
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % 64 == 1
+        if evict:
+            self._evict()
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the stored (dates, features) for key, computing and storing them on a miss
+
+        Parameters:
+        key (str): Key built by make_feature_key
+        compute (callable): Returns (dates, features) for this key
+
+        Returns:
+        tuple: (dates, features) arrays
+        """
+        stored = self.get(key)
+        if stored is not None:
+            return stored
+        dates, features = compute()
+        self.put(key, dates, features)
+        return dates, features
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.tmp') or not os.path.isdir(path):
+                continue
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+
+        entries.sort()
+        for _, path in entries[:max(len(entries) - self.max_entries, 0)]:
+            shutil.rmtree(path, ignore_errors=True)
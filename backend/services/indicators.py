@@ -0,0 +1,429 @@
+import threading
+
+import numpy as np
+import pandas as pd
+from pymongo import DESCENDING, UpdateOne
+
+# Các chỉ báo do IndicatorState tính, cùng tên cột với calculate_technical_indicators
+INDICATOR_COLUMNS = ['rsi_14', 'macd', 'macd_signal', '20sma', 'volatility_20', 'upper_band', 'lower_band',
+                     'obv', 'atr_14']
+BAR_FIELDS = ['OpenPrice', 'HighestPrice', 'LowestPrice', 'ClosePrice', 'TotalVolume']
+# Các trường của phiên mà IndicatorState dùng, theo thứ tự của IndicatorState.last_bar
+STATE_BAR_FIELDS = ['HighestPrice', 'LowestPrice', 'ClosePrice', 'TotalVolume']
+
+RSI_OVERBOUGHT = 70
+RSI_OVERSOLD = 30
+
+
+def _float(value):
+    try:
+        return float(value) if value is not None else np.nan
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class Ewm:
+    """
+    Exponentially weighted mean updated one value at a time
+
+    Port of the pandas ewm(span=..., adjust=False) recurrence, including its
+    handling of missing values, so results match Series.ewm().mean().
+    """
+
+    __slots__ = ('alpha', 'weighted', 'old_wt', 'nobs')
+
+    def __init__(self, span):
+        self.alpha = 2.0 / (span + 1.0)
+        self.weighted = None
+        self.old_wt = 1.0
+        self.nobs = 0
+
+    def update(self, value):
+        is_observation = value == value
+        if self.weighted is None:
+            self.weighted = value
+        elif self.weighted == self.weighted:
+            self.old_wt *= 1.0 - self.alpha
+            if is_observation:
+                if self.weighted != value:
+                    self.weighted = (self.old_wt * self.weighted + self.alpha * value) / (self.old_wt + self.alpha)
+                self.old_wt = 1.0
+        elif is_observation:
+            self.weighted = value
+        self.nobs += is_observation
+        return self.weighted if self.nobs >= 1 else np.nan
+
+    def undo_point(self):
+        return self.weighted, self.old_wt, self.nobs
+
+    def restore(self, point):
+        self.weighted, self.old_wt, self.nobs = point
+
+
+class RollingWindow:
+    """
+    Ring buffer of the last size values
+
+    mean() and std() follow Series.rolling(size) with the default
+    min_periods: NaN until size valid values fill the window.
+    """
+
+    __slots__ = ('values', 'position', 'count')
+
+    def __init__(self, size):
+        self.values = np.full(size, np.nan)
+        self.position = 0
+        self.count = 0
+
+    def push(self, value):
+        self.values[self.position] = value
+        self.position = (self.position + 1) % len(self.values)
+        self.count = min(self.count + 1, len(self.values))
+
+    def _full(self):
+        return self.count == len(self.values) and not np.isnan(self.values).any()
+
+    def mean(self):
+        return float(self.values.mean()) if self._full() else np.nan
+
+    def std(self):
+        return float(self.values.std(ddof=1)) if self._full() else np.nan
+
+    def undo_point(self):
+        """What the next push changes: the slot it overwrites and the counters"""
+        return self.position, self.count, self.values[self.position]
+
+    def restore(self, point):
+        self.position, self.count, self.values[self.position] = point[0], point[1], point[2]
+
+
+class IndicatorState:
+    """
+    Running state of the technical indicators of one ticker
+
+    update() appends one bar in O(1) and returns the same values
+    calculate_technical_indicators produces for that row: RSI-14 from
+    14-bar windows of gains and losses, MACD/signal from EMA accumulators,
+    Bollinger 20 from a window of closes, OBV as a running sum and ATR-14
+    from a window of true ranges.
+    """
+
+    __slots__ = ('last_date', 'bars', 'prev_close', 'prev_filled_close', 'gains', 'losses', 'ema_fast',
+                 'ema_slow', 'ema_signal', 'closes', 'obv', 'true_ranges', 'last_bar', 'last_values',
+                 'previous_values', '_undo')
+
+    # Các trường vô hướng được ghi lại để hoàn tác phiên cuối
+    SCALARS = ('last_date', 'bars', 'prev_close', 'prev_filled_close', 'obv', 'last_bar', 'last_values',
+               'previous_values')
+    ACCUMULATORS = ('gains', 'losses', 'ema_fast', 'ema_slow', 'ema_signal', 'closes', 'true_ranges')
+
+    def __init__(self):
+        self.last_date = None
+        self.bars = 0
+        self.prev_close = np.nan
+        self.prev_filled_close = np.nan
+        self.gains = RollingWindow(14)
+        self.losses = RollingWindow(14)
+        self.ema_fast = Ewm(12)
+        self.ema_slow = Ewm(26)
+        self.ema_signal = Ewm(9)
+        self.closes = RollingWindow(20)
+        self.obv = 0.0
+        self.true_ranges = RollingWindow(14)
+        self.last_bar = None
+        self.last_values = None
+        self.previous_values = None
+        self._undo = None
+
+    def _undo_point(self):
+        return (tuple(getattr(self, name) for name in IndicatorState.SCALARS),
+                tuple(getattr(self, name).undo_point() for name in IndicatorState.ACCUMULATORS))
+
+    def _restore(self, point):
+        scalars, accumulators = point
+        for name, value in zip(IndicatorState.SCALARS, scalars):
+            setattr(self, name, value)
+        for name, value in zip(IndicatorState.ACCUMULATORS, accumulators):
+            getattr(self, name).restore(value)
+
+    def update(self, trade_date, high, low, close, volume):
+        """
+        Append one bar
+
+        A bar with the same date as the last one replaces it (intraday
+        updates of the current bar). Only what the last bar changed is kept
+        to undo it: the scalars and, for each window, the slot it
+        overwrote.
+
+        Returns:
+        dict: Indicator values of the bar
+        """
+        if self.last_date is not None and trade_date == self.last_date and self._undo is not None:
+            self._restore(self._undo)
+        self._undo = self._undo_point()
+
+        # RSI: chênh lệch NaN được coi là 0 lãi / 0 lỗ như delta.where(...)
+        delta = close - self.prev_close
+        self.gains.push(delta if delta > 0 else 0.0)
+        self.losses.push(-delta if delta < 0 else 0.0)
+        gain, loss = self.gains.mean(), self.losses.mean()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rsi = float(100 - (100 / (1 + np.float64(gain) / np.float64(loss))))
+
+        # MACD
+        macd = self.ema_fast.update(close) - self.ema_slow.update(close)
+        macd_signal = self.ema_signal.update(macd)
+
+        # Bollinger Bands
+        self.closes.push(close)
+        sma = self.closes.mean()
+        volatility = self.closes.std()
+
+        # OBV: pct_change lấp giá trống bằng giá trước đó, lợi nhuận NaN được tính là giảm
+        filled_close = close if close == close else self.prev_filled_close
+        with np.errstate(divide='ignore', invalid='ignore'):
+            daily_ret = np.float64(filled_close) / np.float64(self.prev_filled_close) - 1
+        direction = 1 if daily_ret > 0 else (0 if daily_ret == 0 else -1)
+        flow = volume * direction
+        if flow == flow:
+            self.obv += flow
+            obv = self.obv
+        else:
+            obv = np.nan
+
+        # ATR
+        ranges = [high - low, abs(high - self.prev_close), abs(low - self.prev_close)]
+        ranges = [value for value in ranges if value == value]
+        self.true_ranges.push(max(ranges) if ranges else np.nan)
+        atr = self.true_ranges.mean()
+
+        self.prev_close = close
+        self.prev_filled_close = filled_close
+        self.last_date = trade_date
+        self.last_bar = tuple(_json_value(value) for value in (high, low, close, volume))
+        self.bars += 1
+        self.previous_values = self.last_values
+        self.last_values = {
+            'rsi_14': rsi,
+            'macd': macd,
+            'macd_signal': macd_signal,
+            '20sma': sma,
+            'volatility_20': volatility,
+            'upper_band': sma + volatility * 2,
+            'lower_band': sma - volatility * 2,
+            'obv': obv,
+            'atr_14': atr,
+        }
+        return dict(self.last_values, signals=indicator_signals(close, self.last_values, self.previous_values))
+
+
+def indicator_signals(close, values, previous=None):
+    """Trading signals of one bar from its indicator values (and the previous bar's for crossovers)"""
+    signals = []
+    if values['rsi_14'] > RSI_OVERBOUGHT:
+        signals.append('rsi_overbought')
+    elif values['rsi_14'] < RSI_OVERSOLD:
+        signals.append('rsi_oversold')
+    if previous is not None:
+        before = previous['macd'] - previous['macd_signal']
+        now = values['macd'] - values['macd_signal']
+        if before <= 0 < now:
+            signals.append('macd_bullish_cross')
+        elif before >= 0 > now:
+            signals.append('macd_bearish_cross')
+    if close > values['upper_band']:
+        signals.append('above_upper_band')
+    elif close < values['lower_band']:
+        signals.append('below_lower_band')
+    return signals
+
+
+def _json_value(value):
+    return None if value is None or value != value or value in (np.inf, -np.inf) else float(value)
+
+
+class IndicatorEngine:
+    """
+    Incremental technical indicators for every ticker fed to push()
+
+    A ticker's state is seeded once by replaying its history from the
+    PriceStore, then each pushed bar costs O(1). If the store has bars the
+    state has not seen (a daily import ran meanwhile) the state is seeded
+    again before the new bar is applied.
+
+    Pushed bars are also written to the stream_bars collection, in one
+    bulk write per push(), and every push() / latest() first checks the
+    newest stream bar and replays the ones the state has not seen.
+    The states in memory are only a cache: after a restart, and in every
+    worker of a pre-fork server, a ticker ends on the same bars whichever
+    process received them. Once an import brings a session into the
+    PriceStore, the imported bar wins over the streamed one.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def _seed(self, market_code, ticker, before=None):
+        """Replay the stored history of a ticker (bars strictly before the given date)"""
+        state = IndicatorState()
+        series = self.store.get_stock(market_code, ticker)
+        if series is not None:
+            dates = series.dates.astype('datetime64[ns]')
+            stop = len(dates) if before is None else np.searchsorted(dates, before, side='left')
+            high, low = series['HighestPrice'], series['LowestPrice']
+            close, volume = series['ClosePrice'], series['TotalVolume']
+            for i in range(stop):
+                state.update(dates[i], high[i], low[i], close[i], volume[i])
+        return state
+
+    def _catch_up(self, market_code, ticker, state, stored_last):
+        """
+        Replay the stream bars the state has not seen, possibly pushed by another process
+
+        The newest stream bar of the ticker is read first, through the
+        stream_bars unique index: when it is the state's last bar with the
+        same values the state is current and nothing else is read. A newer
+        bar means another process pushed bars, which are replayed from the
+        state's last bar included so that an intraday update of that bar
+        made elsewhere replaces it. Bars on or before the stored history are
+        skipped, the imported bar wins.
+        """
+        key = {'MarketCode': market_code, 'Ticker': ticker}
+        newest = self.store.db.stream_bars.find_one(key, sort=[('TradeDate', DESCENDING)])
+        if newest is None:
+            return
+        newest_date = np.datetime64(newest['TradeDate'], 'ns')
+        if stored_last is not None and newest_date <= stored_last:
+            return
+        if state.last_date is not None:
+            if newest_date < state.last_date:
+                return
+            if newest_date == state.last_date:
+                if tuple(newest.get(field) for field in STATE_BAR_FIELDS) != state.last_bar:
+                    self._replay(state, newest)
+                return
+
+        query = dict(key)
+        if state.last_date is not None:
+            if stored_last is not None and state.last_date <= stored_last:
+                query['TradeDate'] = {'$gt': pd.Timestamp(stored_last).to_pydatetime()}
+            else:
+                query['TradeDate'] = {'$gte': pd.Timestamp(state.last_date).to_pydatetime()}
+        elif stored_last is not None:
+            query['TradeDate'] = {'$gt': pd.Timestamp(stored_last).to_pydatetime()}
+
+        for bar in self.store.db.stream_bars.find(query).sort('TradeDate', 1):
+            self._replay(state, bar)
+
+    @staticmethod
+    def _replay(state, bar):
+        state.update(np.datetime64(bar['TradeDate'], 'ns'), _float(bar.get('HighestPrice')),
+                     _float(bar.get('LowestPrice')), _float(bar.get('ClosePrice')), _float(bar.get('TotalVolume')))
+
+    def _state_for(self, market_code, ticker, trade_date, catch_up=True):
+        key = (market_code, ticker)
+        state = self._states.get(key)
+        series = self.store.get_stock(market_code, ticker)
+        stored_before = None
+        if series is not None and len(series):
+            dates = series.dates.astype('datetime64[ns]')
+            position = np.searchsorted(dates, trade_date, side='left')
+            stored_before = dates[position - 1] if position > 0 else None
+
+        # Kho giá có các phiên mà trạng thái chưa thấy thì nạp lại lịch sử
+        behind = stored_before is not None and (state is None or state.last_date is None
+                                                or state.last_date < stored_before)
+        if state is None or behind:
+            state = self._seed(market_code, ticker, trade_date)
+            self._states[key] = state
+            catch_up = True
+        if catch_up:
+            self._catch_up(market_code, ticker, state, stored_before)
+        return state
+
+    @staticmethod
+    def _bar_write(market_code, ticker, trade_date, bar):
+        """Upsert of a pushed bar into stream_bars (a bar with the same date is replaced)"""
+        fields = {field: _json_value(_float(bar.get(field))) for field in BAR_FIELDS}
+        return UpdateOne(
+            {'MarketCode': market_code, 'Ticker': ticker, 'TradeDate': trade_date},
+            {'$set': fields},
+            upsert=True
+        )
+
+    def push(self, bars):
+        """
+        Apply new bars in order
+
+        Parameters:
+        bars (list): Dicts with MarketCode, Ticker, TradeDate (datetime) and price fields
+
+        Returns:
+        list: One result per bar, with the indicator values and signals or an error
+        """
+        results, writes, seen = [], [], set()
+        with self._lock:
+            try:
+                for bar in bars:
+                    market_code, ticker = bar.get('MarketCode'), bar.get('Ticker')
+                    result = {'MarketCode': market_code, 'Ticker': ticker, 'TradeDate': bar.get('TradeDate')}
+                    trade_date = pd.to_datetime(bar.get('TradeDate'), errors='coerce')
+                    if not market_code or not ticker or pd.isna(trade_date):
+                        result['error'] = 'MarketCode, Ticker and a valid TradeDate are required'
+                        results.append(result)
+                        continue
+
+                    result['TradeDate'] = trade_date.to_pydatetime()
+                    trade_date = np.datetime64(trade_date, 'ns')
+                    # Các phiên trước của cùng mã trong lần đẩy này chưa được ghi, không đồng bộ lại
+                    state = self._state_for(market_code, ticker, trade_date, (market_code, ticker) not in seen)
+                    seen.add((market_code, ticker))
+                    if state.last_date is not None and trade_date < state.last_date:
+                        result['error'] = 'Bar is older than the last bar of this ticker'
+                        results.append(result)
+                        continue
+
+                    writes.append(self._bar_write(market_code, ticker, result['TradeDate'], bar))
+                    close = _float(bar.get('ClosePrice'))
+                    values = state.update(trade_date, _float(bar.get('HighestPrice')),
+                                          _float(bar.get('LowestPrice')), close, _float(bar.get('TotalVolume')))
+                    result['ClosePrice'] = _json_value(close)
+                    result.update({column: _json_value(values[column]) for column in INDICATOR_COLUMNS})
+                    result['signals'] = values['signals']
+                    results.append(result)
+            finally:
+                # Một lượt ghi cho cả lần đẩy, trước khi nhả khóa để các tiến trình khác thấy các phiên
+                if writes:
+                    self.store.db.stream_bars.bulk_write(writes, ordered=True)
+        return results
+
+    def latest(self, market_code, ticker):
+        """
+        Indicator values of a ticker's last bar
+
+        Returns:
+        dict: Last bar date and indicator values, or None if the ticker has no bars
+        """
+        with self._lock:
+            state = self._states.get((market_code, ticker))
+            series = self.store.get_stock(market_code, ticker)
+            stored_last = series.dates[-1].astype('datetime64[ns]') if series is not None and len(series) else None
+            if state is None or (stored_last is not None and (state.last_date is None
+                                                              or state.last_date < stored_last)):
+                state = self._seed(market_code, ticker)
+                self._states[(market_code, ticker)] = state
+            self._catch_up(market_code, ticker, state, stored_last)
+            if state.last_values is None:
+                return None
+            close = state.prev_close
+            result = {
+                'MarketCode': market_code,
+                'Ticker': ticker,
+                'TradeDate': pd.Timestamp(state.last_date).to_pydatetime(),
+                'ClosePrice': _json_value(close),
+            }
+            result.update({column: _json_value(state.last_values[column]) for column in INDICATOR_COLUMNS})
+            result['signals'] = indicator_signals(close, state.last_values, state.previous_values)
+            return result
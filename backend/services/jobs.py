@@ -0,0 +1,228 @@
+import threading
+from datetime import datetime, timedelta
+
+import gridfs
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument
+
+# Các loại job và endpoint thực hiện chúng
+JOB_TYPES = {
+    'svm-analysis': '/api/svm-analysis',
+    'data-analysis': '/api/data-analysis',
+    'calculate-portfolio-beta': '/api/calculate-portfolio-beta',
+    'calculate-beta-batch': '/api/calculate-beta-batch',
+}
+
+# Worker phải gia hạn lease trong khoảng này, nếu không job được coi là bị bỏ dở
+JOB_LEASE_SECONDS = 120
+JOB_MAX_ATTEMPTS = 3
+
+_current = threading.local()
+
+
+def _results(db):
+    return gridfs.GridFS(db, collection='job_results')
+
+
+def parse_job_id(job_id):
+    """Return the ObjectId of a job id string, or None if it is malformed"""
+    try:
+        return ObjectId(job_id)
+    except (InvalidId, TypeError):
+        return None
+
+
+def create_job(db, job_type, params):
+    """
+    Queue a new job
+
+    Parameters:
+    db: MongoDB database
+    job_type (str): One of JOB_TYPES
+    params (dict): JSON body passed to the job's endpoint
+
+    Returns:
+    str: Job id
+    """
+    now = datetime.utcnow()
+    job = {
+        'type': job_type,
+        'params': params,
+        'status': 'queued',
+        'progress': 0.0,
+        'stage': 'queued',
+        'attempts': 0,
+        'created_at': now,
+        'updated_at': now,
+    }
+    return str(db.jobs.insert_one(job).inserted_id)
+
+
+def claim_job(db, worker_id):
+    """
+    Atomically take the oldest queued job, or a running job whose lease expired
+
+    Each claim gets a new lease_token; only the holder of the current token
+    may renew, complete or fail the job, so a worker whose lease expired
+    and was taken over cannot overwrite the new owner's result.
+
+    Returns:
+    dict: The claimed job document, or None if nothing is waiting
+    """
+    now = datetime.utcnow()
+
+    # Job bị bỏ dở quá số lần cho phép thì đánh dấu thất bại
+    db.jobs.update_many(
+        {'status': 'running', 'lease_expires_at': {'$lt': now}, 'attempts': {'$gte': JOB_MAX_ATTEMPTS}},
+        {'$set': {'status': 'failed', 'error': 'Job was abandoned by its worker too many times',
+                  'finished_at': now, 'updated_at': now}}
+    )
+
+    return db.jobs.find_one_and_update(
+        {'$or': [
+            {'status': 'queued'},
+            {'status': 'running', 'lease_expires_at': {'$lt': now}, 'attempts': {'$lt': JOB_MAX_ATTEMPTS}},
+        ]},
+        {
+            '$set': {
+                'status': 'running',
+                'stage': 'starting',
+                'progress': 0.0,
+                'worker': worker_id,
+                'lease_token': ObjectId(),
+                'started_at': now,
+                'updated_at': now,
+                'lease_expires_at': now + timedelta(seconds=JOB_LEASE_SECONDS),
+            },
+            '$inc': {'attempts': 1},
+        },
+        sort=[('created_at', 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def _lease_filter(job):
+    """Filter matching a job only while it is still running under the given claim"""
+    return {'_id': job['_id'], 'status': 'running', 'lease_token': job.get('lease_token')}
+
+
+def renew_lease(db, job):
+    """
+    Extend the lease of a claimed job
+
+    Parameters:
+    db: MongoDB database
+    job (dict): Job document returned by claim_job
+
+    Returns:
+    bool: False if the lease was lost (expired and claimed by another worker, or finished)
+    """
+    now = datetime.utcnow()
+    result = db.jobs.update_one(
+        _lease_filter(job),
+        {'$set': {'lease_expires_at': now + timedelta(seconds=JOB_LEASE_SECONDS), 'updated_at': now}}
+    )
+    return result.matched_count > 0
+
+
+def complete_job(db, job, status_code, body, content_type='application/json'):
+    """
+    Store the response body of a finished job in GridFS and point the job at it
+
+    Parameters:
+    db: MongoDB database
+    job (dict): Job document returned by claim_job
+    status_code (int): Status code of the endpoint's response
+    body (bytes): Response body
+
+    Returns:
+    bool: False if the lease was lost; the stored result is then deleted
+    """
+    results = _results(db)
+    result_id = results.put(body, job_id=job['_id'], content_type=content_type)
+    now = datetime.utcnow()
+    update = db.jobs.update_one(
+        _lease_filter(job),
+        {'$set': {
+            'status': 'succeeded' if status_code < 400 else 'failed',
+            'stage': 'done',
+            'progress': 1.0,
+            'result_id': result_id,
+            'result_status_code': status_code,
+            'finished_at': now,
+            'updated_at': now,
+        }}
+    )
+    if update.matched_count == 0:
+        # Lease đã hết hạn và job được worker khác nhận, bỏ kết quả này
+        results.delete(result_id)
+        return False
+    return True
+
+
+def fail_job(db, job, error):
+    """
+    Mark a claimed job as failed without a result
+
+    Returns:
+    bool: False if the lease was lost
+    """
+    now = datetime.utcnow()
+    result = db.jobs.update_one(
+        _lease_filter(job),
+        {'$set': {'status': 'failed', 'stage': 'done', 'error': error, 'finished_at': now, 'updated_at': now}}
+    )
+    return result.matched_count > 0
+
+
+def load_job_result(db, job):
+    """Return (body bytes, content type) of a finished job's stored result"""
+    result = _results(db).get(job['result_id'])
+    return result.read(), result.content_type or 'application/json'
+
+
+def job_status(job):
+    """Serializable view of a job document"""
+    status = {
+        'job_id': str(job['_id']),
+        'type': job.get('type'),
+        'status': job.get('status'),
+        'progress': job.get('progress'),
+        'stage': job.get('stage'),
+        'attempts': job.get('attempts'),
+        'error': job.get('error'),
+        'result_status_code': job.get('result_status_code'),
+    }
+    for field in ('created_at', 'started_at', 'finished_at'):
+        value = job.get(field)
+        status[field] = value.strftime("%Y-%m-%d %H:%M:%S") if value else None
+    return status
+
+
+def set_current_job(db, job):
+    """Bind the claimed job executing in this thread so report_progress can update it"""
+    _current.db = db
+    _current.job = job
+
+
+def clear_current_job():
+    _current.db = None
+    _current.job = None
+
+
+def report_progress(progress, stage):
+    """
+    Record the progress of the job running in this thread
+
+    Does nothing when called outside a worker, so endpoints can call it
+    unconditionally.
+    """
+    db = getattr(_current, 'db', None)
+    job = getattr(_current, 'job', None)
+    if db is None or job is None:
+        return
+    db.jobs.update_one(
+        _lease_filter(job),
+        {'$set': {'progress': float(progress), 'stage': stage, 'updated_at': datetime.utcnow()}}
+    )
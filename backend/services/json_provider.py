@@ -0,0 +1,121 @@
+import math
+import os
+from datetime import date, datetime, time
+
+import numpy as np
+from bson import ObjectId
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson là tùy chọn, không có thì dùng thư viện json chuẩn
+    orjson = None
+
+
+def nan_to_none(obj):
+    """Replace NaN and infinity in nested dicts and lists with None, as orjson writes them"""
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: nan_to_none(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [nan_to_none(value) for value in obj]
+    return obj
+
+
+def json_default(obj):
+    """
+    Serialize the types the JSON encoder does not handle natively
+
+    ObjectId becomes its hex string, dates at midnight 'YYYY-MM-DD' (how
+    TradeDate is returned) and other datetimes ISO 8601. NumPy arrays and
+    scalars become lists and Python numbers; NumPy datetime64 values are
+    written to the second as ISO 8601, like orjson does natively, and NaN
+    as None.
+    """
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, datetime):
+        if obj != obj:  # NaT
+            return None
+        # TradeDate được lưu dạng BSON date, trả về 'YYYY-MM-DD' như trước
+        if obj.time() == time.min:
+            return obj.strftime('%Y-%m-%d')
+        return obj.isoformat()
+    if isinstance(obj, date):
+        return obj.strftime('%Y-%m-%d')
+    if isinstance(obj, np.datetime64):
+        return None if np.isnat(obj) else np.datetime_as_string(obj, unit='s')
+    if isinstance(obj, np.ndarray):
+        if obj.dtype.kind == 'M':
+            return np.datetime_as_string(obj, unit='s').tolist()
+        return nan_to_none(obj.tolist())
+    if isinstance(obj, np.generic):
+        return nan_to_none(obj.item())
+    return DefaultJSONProvider.default(obj)
+
+
+def records_to_columns(records, columns=None):
+    """
+    Columnar ("struct of arrays") form of a list of dicts
+
+    Parameters:
+    records (list): Dicts sharing the same keys, e.g. SVM predictions
+    columns (list, optional): Keys to keep, defaults to the keys of the first record
+
+    Returns:
+    dict: {column: [value of each record]}
+    """
+    if columns is None:
+        columns = list(records[0]) if records else []
+    return {column: [record.get(column) for record in records] for column in columns}
+
+
+class AppJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider of the app, backed by orjson when it is installed
+
+    orjson serializes dicts, lists, strings, numbers and NumPy arrays and
+    scalars in native code; only ObjectId and datetimes (kept in the
+    formats of the previous encoder) go through json_default. NaN and
+    infinity are written as null. Calls with json.dumps keyword arguments,
+    values orjson rejects, and the whole provider when fast is False
+    (FAST_JSON=0) use the standard library with the same json_default.
+    """
+
+    default = staticmethod(json_default)
+
+    def __init__(self, app, fast=None):
+        super().__init__(app)
+        if fast is None:
+            fast = os.getenv('FAST_JSON', '1') == '1'
+        self.fast = fast and orjson is not None
+
+    def _orjson_option(self, indent=False):
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs):
+        if self.fast and not kwargs:
+            try:
+                return orjson.dumps(obj, default=json_default, option=self._orjson_option()).decode('utf-8')
+            except TypeError:
+                # orjson từ chối một số giá trị (NaT của NumPy, số nguyên quá 64 bit), dùng json chuẩn
+                pass
+        # json chuẩn ghi NaN thành 'NaN' (không phải JSON hợp lệ), đổi thành null như orjson
+        return super().dumps(nan_to_none(obj), **kwargs)
+
+    def response(self, *args, **kwargs):
+        if not self.fast:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self.compact is False or (self.compact is None and self._app.debug)
+        try:
+            body = orjson.dumps(obj, default=json_default, option=self._orjson_option(indent))
+        except TypeError:
+            return super().response(obj)
+        return self._app.response_class(body + b"\n", mimetype=self.mimetype)
@@ -0,0 +1,244 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from pymongo import ASCENDING, UpdateOne
+
+from services.beta_calculation import parse_trade_dates
+from services.price_store import STOCK_FIELDS, to_date_array, to_numeric_column
+
+# Các cột trả về cho mỗi mã trong bảng giá kèm beta
+SNAPSHOT_COLUMNS = ['MarketCode', 'Ticker', 'ClosePrice', 'TotalVolume', 'OpenPrice', 'CurrentPrice',
+                    'ProfitLoss', 'ProfitLossPercent']
+
+
+def beta_frame(beta_values):
+    """
+    Convert beta_values documents to a DataFrame keyed by (MarketCode, Ticker)
+
+    Parameters:
+    beta_values (list): Documents of the beta_values collection
+
+    Returns:
+    DataFrame: MarketCode, Ticker, beta and BetaDate (datetime64, NaT if unknown), in collection order
+    """
+    frame = pd.DataFrame(beta_values)
+    columns = ['MarketCode', 'Ticker', 'beta', 'BetaDate']
+    if frame.empty or 'market_code' not in frame.columns or 'ticker' not in frame.columns:
+        return pd.DataFrame(columns=columns)
+
+    result = pd.DataFrame({
+        'MarketCode': frame['market_code'].values,
+        'Ticker': frame['ticker'].values,
+        'beta': pd.to_numeric(frame['beta'], errors='coerce').values if 'beta' in frame.columns else np.nan,
+        'BetaDate': parse_trade_dates(frame['date']) if 'date' in frame.columns else np.datetime64('NaT'),
+    })
+    return result.dropna(subset=['MarketCode', 'Ticker'])
+
+
+def add_price_metrics(bars):
+    """Add CurrentPrice, ProfitLoss and ProfitLossPercent columns computed from the bar prices"""
+    bars = bars.copy()
+    for field in ('ClosePrice', 'TotalVolume', 'OpenPrice'):
+        bars[field] = bars[field].fillna(0).astype(np.float64)
+    bars['CurrentPrice'] = bars['ClosePrice']
+    bars['ProfitLoss'] = bars['CurrentPrice'] - bars['OpenPrice']
+    open_price = bars['OpenPrice'].to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bars['ProfitLossPercent'] = np.where(open_price > 0, bars['ProfitLoss'].to_numpy() / open_price * 100, 0.0)
+    return bars
+
+
+def last_bar_per_key(frame):
+    """
+    Keep the last bar of every (MarketCode, Ticker) in a batch of imported rows
+
+    Rows without a parsable TradeDate are ignored. When the same date
+    appears twice the row imported last wins, like in PriceStore.
+
+    Returns:
+    DataFrame: MarketCode, Ticker, TradeDate (datetime64) and the STOCK_FIELDS as floats
+    """
+    columns = ['MarketCode', 'Ticker', 'TradeDate'] + STOCK_FIELDS
+    if frame.empty or not {'MarketCode', 'Ticker', 'TradeDate'} <= set(frame.columns):
+        return pd.DataFrame(columns=columns)
+
+    bars = pd.DataFrame({
+        'MarketCode': frame['MarketCode'].values,
+        'Ticker': frame['Ticker'].values,
+        'TradeDate': to_date_array(frame['TradeDate'].values).astype('datetime64[ns]'),
+    })
+    for field in STOCK_FIELDS:
+        bars[field] = to_numeric_column(frame[field].values) if field in frame.columns else np.nan
+
+    bars = bars.dropna(subset=['MarketCode', 'Ticker', 'TradeDate'])
+    bars = bars.sort_values('TradeDate', kind='mergesort')
+    return bars.drop_duplicates(['MarketCode', 'Ticker'], keep='last')[columns]
+
+
+def update_latest_snapshot(db, frame):
+    """
+    Upsert the latest_snapshot document of every (MarketCode, Ticker) in a batch
+
+    Each document holds the ticker's last bar and its derived fields. A bar
+    only replaces the stored one if it is not older, which the update
+    pipeline checks atomically on the server, so batches may arrive in any
+    order.
+
+    Parameters:
+    db: MongoDB database
+    frame (DataFrame): Imported rows (MarketCode, Ticker, TradeDate and prices)
+
+    Returns:
+    set: MarketCode values touched
+    """
+    bars = last_bar_per_key(frame)
+    if bars.empty:
+        return set()
+    bars = add_price_metrics(bars)
+
+    fields = STOCK_FIELDS + ['CurrentPrice', 'ProfitLoss', 'ProfitLossPercent']
+    operations = []
+    for row in bars.itertuples(index=False):
+        trade_date = row.TradeDate.to_pydatetime()
+        newer = {'$gte': [trade_date, {'$ifNull': ['$TradeDate', datetime.min]}]}
+        values = {'TradeDate': trade_date}
+        values.update({field: float(getattr(row, field)) for field in fields})
+        operations.append(UpdateOne(
+            {'MarketCode': row.MarketCode, 'Ticker': row.Ticker},
+            [{'$set': {field: {'$cond': [newer, value, f"${field}"]} for field, value in values.items()}}],
+            upsert=True
+        ))
+    db.latest_snapshot.bulk_write(operations, ordered=False)
+    return set(bars['MarketCode'].unique())
+
+
+def refresh_market_nav(db, market_codes):
+    """
+    Recompute the NAV aggregate and ticker weights of markets from latest_snapshot
+
+    The NAV sums the tickers traded on the market's latest date, in ticker
+    order, and each of those tickers gets its Weight (share of the NAV
+    current price in percent). Tickers whose last bar is older get no
+    Weight. Costs O(tickers) per market. The snapshot_built marker set by
+    rebuild_snapshot is kept.
+    """
+    for market_code in market_codes:
+        latest = db.latest_snapshot.find_one({'MarketCode': market_code}, {'TradeDate': 1},
+                                             sort=[('TradeDate', -1)])
+        if latest is None:
+            db.market_nav.delete_one({'MarketCode': market_code})
+            continue
+        trade_date = latest['TradeDate']
+
+        nav = {field: 0 for field in SNAPSHOT_COLUMNS[2:]}
+        tickers = 0
+        projection = {'_id': 0}
+        projection.update({field: 1 for field in SNAPSHOT_COLUMNS[2:]})
+        cursor = db.latest_snapshot.find({'MarketCode': market_code, 'TradeDate': trade_date}, projection)
+        for bar in cursor.sort('Ticker', ASCENDING):
+            for field in nav:
+                nav[field] += bar.get(field, 0)
+            tickers += 1
+
+        nav.update({'MarketCode': market_code, 'TradeDate': trade_date, 'tickers': tickers,
+                    'updated_at': datetime.utcnow()})
+        db.market_nav.update_one({'MarketCode': market_code}, {'$set': nav}, upsert=True)
+
+        # Tỷ trọng tính ngay trên server theo giá hiện tại của NAV
+        current_price = nav['CurrentPrice']
+        weight = {'$multiply': [{'$divide': ['$CurrentPrice', current_price]}, 100]} if current_price else 0
+        db.latest_snapshot.update_many({'MarketCode': market_code, 'TradeDate': trade_date},
+                                       [{'$set': {'Weight': weight}}])
+        db.latest_snapshot.update_many({'MarketCode': market_code, 'TradeDate': {'$ne': trade_date}},
+                                       {'$set': {'Weight': None}})
+
+
+def rebuild_snapshot(db, store, market_code):
+    """
+    Rebuild latest_snapshot and market_nav of one market from the full price history
+
+    market_nav is then marked snapshot_built: imports only upsert the
+    tickers they contain, so until this has run once the snapshot of a
+    market with older data may miss tickers.
+    """
+    bars = store.bars_as_of(market_code)
+    if bars.empty:
+        return
+    update_latest_snapshot(db, bars)
+    refresh_market_nav(db, [market_code])
+    db.market_nav.update_one({'MarketCode': market_code}, {'$set': {'snapshot_built': True}})
+
+
+def snapshot_built(nav):
+    """True once a market's snapshot was rebuilt from its full price history"""
+    return nav is not None and bool(nav.get('snapshot_built'))
+
+
+def read_snapshot(db, market_code):
+    """
+    Read the bars of the tickers traded on a market's latest date
+
+    Returns:
+    tuple: (market_nav document or None, DataFrame of snapshot rows sorted by Ticker)
+    """
+    nav = db.market_nav.find_one({'MarketCode': market_code}, {'_id': 0})
+    if nav is None:
+        return None, pd.DataFrame(columns=SNAPSHOT_COLUMNS + ['TradeDate', 'Weight'])
+
+    cursor = db.latest_snapshot.find({'MarketCode': market_code, 'TradeDate': nav['TradeDate']}, {'_id': 0})
+    bars = pd.DataFrame(list(cursor.sort('Ticker', ASCENDING)))
+    if bars.empty:
+        return nav, pd.DataFrame(columns=SNAPSHOT_COLUMNS + ['TradeDate', 'Weight'])
+    return nav, bars
+
+
+def join_stock_beta(bars, beta_values, as_of=None):
+    """
+    Join price bars with stored Beta values on (MarketCode, Ticker)
+
+    Only tickers that have a Beta record are returned. Without as_of the
+    record with the latest date of each ticker is used (the last stored
+    one on ties). With as_of each ticker gets
+    the latest record calculated for a date on or before as_of (as-of merge),
+    or no Beta if all of its records are more recent.
+
+    Parameters:
+    bars (DataFrame): One bar per ticker (PriceStore.latest_bars / bars_as_of)
+    beta_values (list): Documents of the beta_values collection
+    as_of (datetime, optional): Cut-off date of the Beta values
+
+    Returns:
+    list: Stock entries with prices, profit/loss, beta and risk
+    """
+    betas = beta_frame(beta_values)
+    keys = ['MarketCode', 'Ticker']
+
+    # Chỉ giữ các mã có bản ghi beta (inner join theo khóa)
+    known = betas[keys].drop_duplicates()
+    frame = add_price_metrics(bars).merge(known, on=keys, how='inner')
+
+    if as_of is None:
+        # Mỗi mã có thể có một bản ghi cho mỗi tầm dự báo, lấy bản ghi có ngày gần nhất
+        latest = betas.sort_values('BetaDate', kind='mergesort', na_position='first')
+        latest = latest.drop_duplicates(keys, keep='last')[keys + ['beta']]
+        frame = frame.merge(latest, on=keys, how='left')
+    else:
+        dated = betas.dropna(subset=['BetaDate']).sort_values('BetaDate', kind='mergesort')
+        frame['AsOf'] = np.datetime64(pd.Timestamp(as_of).normalize(), 'ns')
+        frame = pd.merge_asof(
+            frame.reset_index().sort_values('AsOf'),
+            dated[keys + ['beta', 'BetaDate']],
+            left_on='AsOf',
+            right_on='BetaDate',
+            by=keys,
+            direction='backward'
+        ).sort_values('index').drop(columns=['index', 'AsOf', 'BetaDate'])
+
+    beta = frame['beta'].to_numpy(dtype=np.float64)
+    frame['risk'] = np.where(np.isnan(beta), 'unknown', np.where(beta == 1, 'medium', 'high'))
+
+    columns = SNAPSHOT_COLUMNS + (['TradeDate'] if as_of is not None else []) + ['beta', 'risk']
+    frame = frame[columns].astype(object)
+    frame['beta'] = frame['beta'].where(pd.notna(frame['beta']), None)
+    return frame.to_dict('records')
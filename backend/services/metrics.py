@@ -0,0 +1,334 @@
+import functools
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+# Giới hạn các bucket (giây / byte) của histogram, theo quy ước của Prometheus
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000, 100000000)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Chu kỳ (giây) ghi số liệu của tiến trình vào thư mục dùng chung METRICS_DIR
+FLUSH_INTERVAL = 1.0
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def combine(value, other):
+        return other if value is None else value + other
+
+    def render(self, values=None):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted((self.values() if values is None else values).items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {_format_number(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative histogram with labels, rendered as Prometheus _bucket/_sum/_count series"""
+
+    def __init__(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def values(self):
+        with self._lock:
+            return {labels: [list(counts), total, count] for labels, (counts, total, count) in self._values.items()}
+
+    @staticmethod
+    def combine(value, other):
+        if value is None:
+            return [list(other[0]), other[1], other[2]]
+        return [[a + b for a, b in zip(value[0], other[0])], value[1] + other[1], value[2] + other[2]]
+
+    def render(self, values=None):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted((self.values() if values is None else values).items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(self.label_names, labels, ('le', _format_number(bound)))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            series_labels = _format_labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{series_labels} {_format_number(total)}")
+            lines.append(f"{self.name}_count{series_labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Metrics rendered in the Prometheus text exposition format
+
+    Without a directory the metrics are those of this process. With one
+    (METRICS_DIR), each process writes a snapshot of its metrics to its own
+    file there every FLUSH_INTERVAL seconds and render() adds up the files
+    of every process, so any worker of a pre-fork server answers a scrape
+    with the totals of all of them. Files of exited workers are kept so
+    counters never go backwards; the directory is emptied when the server
+    starts (see gunicorn.conf.py).
+    """
+
+    def __init__(self, directory=None):
+        self._metrics = []
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._file_pid = None
+        self._file_path = None
+
+    def counter(self, name, documentation, label_names=()):
+        metric = Counter(name, documentation, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, label_names, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def snapshot(self):
+        """Values of every metric of this process, as JSON-serializable lists"""
+        return {metric.name: [[list(labels), value] for labels, value in metric.values().items()]
+                for metric in self._metrics}
+
+    def _snapshot_path(self):
+        # Tên file theo pid và một mã ngẫu nhiên: tiến trình mới trùng pid không ghi đè số liệu cũ
+        pid = os.getpid()
+        if self._file_pid != pid:
+            self._file_pid = pid
+            self._file_path = os.path.join(self.directory, f"metrics-{pid}-{uuid.uuid4().hex[:8]}.json")
+            threading.Thread(target=self._flush_loop, args=(pid,), daemon=True).start()
+        return self._file_path
+
+    def _flush_loop(self, pid):
+        while os.getpid() == pid:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Cannot write metrics snapshot: {e}")
+
+    def flush(self):
+        """Write the snapshot of this process to the shared directory (atomically replaced)"""
+        if self.directory is None:
+            return
+        with self._lock:
+            path = self._snapshot_path()
+            temporary = f"{path}.tmp"
+            with open(temporary, 'w') as snapshot_file:
+                json.dump(self.snapshot(), snapshot_file)
+            os.replace(temporary, path)
+
+    def mark_active(self):
+        """Start the periodic flush of this process once it records metrics"""
+        if self.directory is not None and self._file_pid != os.getpid():
+            with self._lock:
+                self._snapshot_path()
+
+    def _merged_values(self):
+        self.flush()
+        merged = {metric.name: {} for metric in self._metrics}
+        combine = {metric.name: metric.combine for metric in self._metrics}
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            try:
+                with open(path) as snapshot_file:
+                    snapshot = json.load(snapshot_file)
+            except (OSError, ValueError):
+                continue
+            for name, series in snapshot.items():
+                if name not in merged:
+                    continue
+                values = merged[name]
+                for labels, value in series:
+                    labels = tuple(labels)
+                    values[labels] = combine[name](values.get(labels), value)
+        return merged
+
+    def render(self):
+        merged = self._merged_values() if self.directory is not None else {}
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(merged.get(metric.name)))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+REQUESTS = REGISTRY.counter('http_requests_total', 'Requests handled by endpoint, method and status',
+                            ('endpoint', 'method', 'status'))
+ERRORS = REGISTRY.counter('http_request_errors_total', 'Requests answered with a 4xx or 5xx status',
+                          ('endpoint', 'status'))
+LATENCY = REGISTRY.histogram('http_request_duration_seconds', 'Request latency by endpoint',
+                             ('endpoint', 'method'))
+REQUEST_SIZE = REGISTRY.histogram('http_request_size_bytes', 'Request body size by endpoint',
+                                  ('endpoint',), SIZE_BUCKETS)
+RESPONSE_SIZE = REGISTRY.histogram('http_response_size_bytes', 'Response body size by endpoint (unstreamed)',
+                                   ('endpoint',), SIZE_BUCKETS)
+STAGES = REGISTRY.histogram('request_stage_duration_seconds', 'Time spent per request in each stage',
+                            ('endpoint', 'stage'))
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a block as one stage of the current request
+
+    Stages with the same name in one request add up. Outside a request
+    (scripts, benchmarks) the block just runs.
+
+    Parameters:
+    name (str): Stage name, a token such as 'feature_prep' (used in Server-Timing)
+    """
+    if not has_request_context():
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        timings = g.setdefault('stage_timings', {})
+        timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def timed(name):
+    """Decorator timing every call of a function as the given stage"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def render_metrics():
+    return REGISTRY.render()
+
+
+def _start_request():
+    g.request_started = time.perf_counter()
+    g.stage_timings = {}
+
+
+def _finish_request(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+
+    endpoint = request.endpoint or 'unmatched'
+    status = str(response.status_code)
+    REGISTRY.mark_active()
+    REQUESTS.inc((endpoint, request.method, status))
+    if response.status_code >= 400:
+        ERRORS.inc((endpoint, status))
+    LATENCY.observe((endpoint, request.method), elapsed)
+    if request.content_length is not None:
+        REQUEST_SIZE.observe((endpoint,), request.content_length)
+    if not response.is_streamed and response.content_length is not None:
+        RESPONSE_SIZE.observe((endpoint,), response.content_length)
+
+    timings = g.get('stage_timings') or {}
+    for name, seconds in timings.items():
+        STAGES.observe((endpoint, name), seconds)
+
+    if g.get('server_timing_enabled'):
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()]
+        entries.append(f"total;dur={elapsed * 1000:.1f}")
+        response.headers['Server-Timing'] = ', '.join(entries)
+    return response
+
+
+def clear_metrics_dir(directory):
+    """Create the shared metrics directory and remove the snapshots of a previous server run"""
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, 'metrics-*.json*')):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def init_metrics(app, server_timing=None, directory=None):
+    """
+    Record latency, status, payload size and stage timings of every request
+
+    Parameters:
+    app (Flask): Application to instrument
+    server_timing (bool, optional): Add a Server-Timing header with the stage breakdown,
+        defaults to SERVER_TIMING (1)
+    directory (str, optional): Directory shared by the server's processes to aggregate their metrics,
+        defaults to METRICS_DIR (unset: metrics of this process only)
+    """
+    if server_timing is None:
+        server_timing = os.getenv('SERVER_TIMING', '1') == '1'
+    if directory is None:
+        directory = os.getenv('METRICS_DIR') or None
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+    REGISTRY.directory = directory
+
+    @app.before_request
+    def start_request_metrics():
+        _start_request()
+        g.server_timing_enabled = server_timing
+
+    app.after_request(_finish_request)
@@ -0,0 +1,140 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import joblib
+import numpy as np
+
+
+def make_model_key(market_code, tickers, days_to_predict, data_version):
+    """
+    Build the registry key of a trained SVM model
+
+    Parameters:
+    market_code (str): Market code the model was trained on
+    tickers (list): Tickers included in the training set (order does not matter)
+    days_to_predict (int): Prediction horizon
+    data_version (str): Version of the imported data (see PriceStore.data_version)
+
+    Returns:
+    str: Hex digest usable as a file name
+    """
+    ticker_set = ','.join(sorted(str(ticker) for ticker in tickers))
+    raw = f"{market_code}|{ticker_set}|{int(days_to_predict)}|{data_version}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def training_fingerprint(X, y):
+    """Hash of the feature matrix and targets a model was trained on"""
+    digest = hashlib.sha1()
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    y = np.ascontiguousarray(y, dtype=np.int64)
+    digest.update(str(X.shape).encode('utf-8'))
+    digest.update(X.tobytes())
+    digest.update(y.tobytes())
+    return digest.hexdigest()
+
+
+class ModelRegistry:
+    """
+    Local-directory store of trained SVM models with LRU eviction
+
+    Each entry is one joblib file holding the fitted SVC and StandardScaler
+    together with accuracy, classification report, confusion matrix,
+    feature schema and the fingerprint of the training set. Recently used
+    entries are also kept in memory. When more than max_entries files exist
+    the least recently used ones are deleted.
+    """
+
+    def __init__(self, directory, max_entries=32, memory_entries=4):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.joblib")
+
+    def get(self, key, fingerprint=None):
+        """
+        Return the stored entry for key, or None on a miss
+
+        When fingerprint is given the entry is only returned if it was
+        trained on exactly the same features and targets.
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+
+        path = self._path(key)
+        if entry is None:
+            try:
+                entry = joblib.load(path)
+            except (FileNotFoundError, EOFError, OSError, ValueError):
+                return None
+            self._remember(key, entry)
+
+        if fingerprint is not None and entry.get('fingerprint') != fingerprint:
+            return None
+
+        # Cập nhật thời điểm sử dụng để phục vụ LRU
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key, model, scaler, accuracy, report, confusion_matrix, feature_schema, fingerprint):
+        """Persist a trained model and evict the least recently used entries"""
+        entry = {
+            'model': model,
+            'scaler': scaler,
+            'accuracy': accuracy,
+            'report': report,
+            'confusion_matrix': confusion_matrix,
+            'feature_schema': list(feature_schema),
+            'fingerprint': fingerprint,
+            'created_at': time.time(),
+        }
+
+        # Ghi ra file tạm rồi đổi tên để tiến trình khác không đọc phải file dở dang
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        joblib.dump(entry, tmp_path)
+        os.replace(tmp_path, path)
+
+        self._remember(key, entry)
+        self._evict()
+        return entry
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.joblib'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                entries.append((os.path.getmtime(path), path, name[:-len('.joblib')]))
+            except OSError:
+                continue
+
+        entries.sort()
+        for _, path, key in entries[:max(len(entries) - self.max_entries, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            with self._lock:
+                self._memory.pop(key, None)
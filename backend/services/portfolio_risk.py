@@ -0,0 +1,350 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from services.beta_calculation import interpret_beta
+from services.price_store import benchmark_key
+
+TRADING_DAYS_PER_YEAR = 252
+
+
+def ticker_markets(store, ticker):
+    """Markets of the price store listing a ticker"""
+    return [market_code for market_code in store.market_codes() if ticker in store.ticker_list(market_code)]
+
+
+def parse_portfolio(portfolio, market_code=None, store=None):
+    """
+    Resolve the holdings of a portfolio request
+
+    Parameters:
+    portfolio (dict): {stock_code: weight}, stock codes are "MarketCode:Ticker" or a bare Ticker
+    market_code (str, optional): Market of the holdings given as a bare Ticker
+    store (PriceStore, optional): Used to find the market of a bare Ticker when market_code is not given
+
+    Returns:
+    tuple: (list of (MarketCode, Ticker, weight) in request order, list of per-holding errors)
+
+    Raises:
+    ValueError: If a weight is not a number
+    """
+    holdings = OrderedDict()
+    errors = []
+    for code, weight in portfolio.items():
+        try:
+            weight = float(weight)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid weight for {code}: {weight}")
+
+        if ':' in code:
+            key = tuple(code.split(':', 1))
+        elif market_code:
+            key = (market_code, code)
+        else:
+            # Mã không kèm sàn: tìm sàn niêm yết mã đó, chỉ báo lỗi khi không rõ ràng
+            markets = ticker_markets(store, code) if store is not None else []
+            if len(markets) == 1:
+                key = (markets[0], code)
+            elif markets:
+                errors.append({'stock_code': code,
+                               'error': f"Ticker is listed on several markets ({', '.join(markets)}), "
+                                        f"use MarketCode:Ticker"})
+                continue
+            else:
+                errors.append({'stock_code': code, 'error': 'No data found for stock code'})
+                continue
+        # Cùng một mã được ghi theo hai cách thì cộng dồn tỷ trọng
+        holdings[key] = holdings.get(key, 0.0) + weight
+    return [(mc, ticker, weight) for (mc, ticker), weight in holdings.items()], errors
+
+
+def align_returns(store, universe, benchmark_market, end=None, days_window=365):
+    """
+    Build the return matrix of a set of stocks on the benchmark's trading dates
+
+    Returns come from the cached PriceSeries (same values as
+    calculate_daily_returns) and are restricted to the days_window calendar
+    days ending on end.
+
+    Parameters:
+    store (PriceStore): Shared price cache
+    universe (tuple): (MarketCode, Ticker) pairs, one matrix column each
+    benchmark_market (str): Stock market whose benchmark index is used
+    end (datetime64, optional): Last date of the window, defaults to the latest bar of the universe
+    days_window (int): Window length in calendar days
+
+    Returns:
+    dict: dates, returns (dates x stocks, NaN where the stock did not trade), market_returns,
+          stock_points (bars of each stock in the window), found (stock has data), start, end
+    """
+    market_dates, market_returns = store.benchmark_returns(benchmark_market)
+    series = [store.get_stock(market_code, ticker) for market_code, ticker in universe]
+    found = np.array([s is not None and len(s) > 0 for s in series], dtype=bool)
+
+    if end is None:
+        last_dates = [s.last_date for s in series if s is not None and len(s)]
+        if not last_dates:
+            end = np.datetime64('NaT', 'ns')
+        else:
+            end = max(last_dates).astype('datetime64[ns]')
+    end = np.datetime64(end, 'ns')
+    start = end - np.timedelta64(days_window, 'D')
+
+    first = np.searchsorted(market_dates, start, side='left')
+    last = np.searchsorted(market_dates, end, side='right')
+    dates = market_dates[first:last]
+    returns = np.full((len(dates), len(universe)), np.nan)
+    stock_points = np.zeros(len(universe), dtype=np.int64)
+
+    for column, s in enumerate(series):
+        if not found[column] or np.isnat(end):
+            continue
+        stock_dates = s.dates.astype('datetime64[ns]')
+        lo = np.searchsorted(stock_dates, start, side='left')
+        hi = np.searchsorted(stock_dates, end, side='right')
+        stock_points[column] = hi - lo
+        if hi == lo or not len(dates):
+            continue
+
+        # Chỉ giữ các ngày mà chỉ số tham chiếu cũng có giao dịch
+        rows = np.searchsorted(dates, stock_dates[lo:hi])
+        rows_clipped = np.minimum(rows, len(dates) - 1)
+        matched = (rows < len(dates)) & (dates[rows_clipped] == stock_dates[lo:hi])
+        returns[rows[matched], column] = s.daily_returns('ClosePrice')[lo:hi][matched]
+
+    return {
+        'dates': dates,
+        'returns': returns,
+        'market_returns': market_returns[first:last],
+        'stock_points': stock_points,
+        'found': found,
+        'start': start,
+        'end': end,
+    }
+
+
+def covariance_stats(aligned):
+    """
+    Compute the weight independent statistics of a return matrix
+
+    Betas use the estimator of get_beta_for_stock (Cov(Re, Rm) with ddof=1
+    over Var(Rm) with ddof=0, on the days both traded). The covariance
+    matrix of the stocks uses pairwise complete observations (ddof=1), like
+    DataFrame.cov, computed with matrix products.
+
+    Returns:
+    dict: betas, data_points, covariance (stocks x stocks), errors (None or message per stock)
+    """
+    returns = aligned['returns']
+    market_returns = aligned['market_returns']
+    valid = ~np.isnan(returns)
+    mask = valid.astype(np.float64)
+    values = np.where(valid, returns, 0.0)
+
+    data_points = valid.sum(axis=0)
+    market_matrix = np.broadcast_to(market_returns[:, None], returns.shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_stock = values.sum(axis=0) / data_points
+        avg_market = np.where(valid, market_matrix, 0).sum(axis=0) / data_points
+        stock_dev = np.where(valid, returns - avg_stock, 0)
+        market_dev = np.where(valid, market_matrix - avg_market, 0)
+        betas = ((stock_dev * market_dev).sum(axis=0) / (data_points - 1)) \
+            / ((market_dev * market_dev).sum(axis=0) / data_points)
+
+        # Hiệp phương sai từng cặp mã trên các ngày cả hai cùng giao dịch
+        pair_points = mask.T @ mask
+        pair_sums = values.T @ mask
+        covariance = (values.T @ values - pair_sums * pair_sums.T / pair_points) / (pair_points - 1)
+    covariance[~np.isfinite(covariance)] = 0.0
+
+    market_points = len(aligned['dates'])
+    errors = []
+    for column in range(returns.shape[1]):
+        if not aligned['found'][column]:
+            errors.append('No data found for stock code')
+        elif aligned['stock_points'][column] < 5 or market_points < 5:
+            errors.append('Insufficient data points for reliable beta calculation')
+        elif data_points[column] < 5:
+            errors.append('No overlapping data between stock and market')
+        else:
+            errors.append(None)
+
+    return {
+        'betas': betas,
+        'data_points': data_points,
+        'covariance': covariance,
+        'errors': errors,
+    }
+
+
+def risk_decomposition(stats, weights):
+    """
+    Combine cached statistics with portfolio weights
+
+    Weights are normalized over the holdings that have a Beta. The
+    portfolio Beta is the weighted average of the component Betas, the
+    volatility is sqrt(w' S w) and the marginal risk of holding i is
+    (S w)_i / volatility, so the risk contributions w_i * marginal_i add up
+    to the volatility.
+
+    Parameters:
+    stats (dict): Result of covariance_stats
+    weights (array): Weight of every column of the universe
+
+    Returns:
+    dict: valid mask, weight shares, portfolio Beta, daily volatility, marginal risk and
+          contributions of the valid holdings, or None if no holding has a Beta
+    """
+    valid = np.array([error is None for error in stats['errors']], dtype=bool)
+    total = weights[valid].sum()
+    if not valid.any() or total == 0:
+        return None
+
+    shares = weights[valid] / total
+    covariance = stats['covariance'][np.ix_(valid, valid)]
+    exposure = covariance @ shares
+    volatility = float(np.sqrt(max(shares @ exposure, 0.0)))
+    marginal = exposure / volatility if volatility > 0 else np.zeros(len(shares))
+
+    return {
+        'valid': valid,
+        'shares': shares,
+        'portfolio_beta': float(shares @ stats['betas'][valid]),
+        'volatility': volatility,
+        'marginal': marginal,
+        'contributions': shares * marginal,
+    }
+
+
+class PortfolioRiskEngine:
+    """
+    Portfolio Beta and risk calculations on top of the shared PriceStore
+
+    The return matrix, component Betas and covariance matrix depend only on
+    the holdings (universe), the benchmark and the window, so they are kept
+    in a small LRU cache keyed on those and on the data versions of the
+    markets involved. Changing only the weights reuses the cached matrix.
+    """
+
+    def __init__(self, store, max_entries=64):
+        self.store = store
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def statistics(self, universe, benchmark_market, end=None, days_window=365):
+        """
+        Return the cached (or freshly computed) statistics of a universe
+
+        Returns:
+        tuple: (aligned returns dict, covariance_stats dict, True if served from the cache)
+        """
+        index_market_code, _ = benchmark_key(benchmark_market)
+        versions = tuple(self.store.data_version(market_code)
+                         for market_code in sorted({market_code for market_code, _ in universe}))
+        versions += (self.store.data_version(benchmark_market, index_market_code),)
+        key = (universe, benchmark_market, str(end), int(days_window), versions)
+
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self._cache.move_to_end(key)
+                return entry[0], entry[1], True
+
+        aligned = align_returns(self.store, universe, benchmark_market, end, days_window)
+        stats = covariance_stats(aligned)
+        with self._lock:
+            self._cache[key] = (aligned, stats)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return aligned, stats, False
+
+    def analyze(self, portfolio, market_code=None, date=None, days_to_predict=5, days_window=365):
+        """
+        Calculate the Beta and risk decomposition of a portfolio
+
+        Parameters:
+        portfolio (dict): {stock_code: weight}
+        market_code (str, optional): Market of bare tickers and of the benchmark index,
+                                     defaults to the market of the first holding; without it
+                                     bare tickers are looked up in the price store
+        date (datetime, optional): Last date of the calculation window, defaults to latest
+        days_to_predict (int, optional): Prediction horizon stored with the result
+        days_window (int, optional): Calculation window in calendar days
+
+        Returns:
+        dict: Portfolio Beta, volatility, component Betas and risk contributions
+
+        Raises:
+        ValueError: If a weight is invalid or the benchmark market is unknown
+        """
+        holdings, errors = parse_portfolio(portfolio, market_code, self.store)
+        benchmark_market = market_code or (holdings[0][0] if holdings else None)
+        if benchmark_market is None:
+            return {'portfolio_beta': None, 'error': 'No valid holdings in portfolio', 'errors': errors}
+        try:
+            index_market_code, index_code = benchmark_key(benchmark_market)
+        except KeyError:
+            raise ValueError(f"No benchmark index for market {benchmark_market}")
+
+        universe = tuple((mc, ticker) for mc, ticker, _ in holdings)
+        end = np.datetime64(pd.Timestamp(date).normalize(), 'ns') if date is not None else None
+        aligned, stats, cached = self.statistics(universe, benchmark_market, end, days_window)
+        weights = np.array([weight for _, _, weight in holdings], dtype=np.float64)
+
+        end_date = pd.Timestamp(aligned['end']).strftime('%Y-%m-%d') if not np.isnat(aligned['end']) else None
+        start_date = pd.Timestamp(aligned['start']).strftime('%Y-%m-%d') if not np.isnat(aligned['start']) else None
+        for (mc, ticker), error in zip(universe, stats['errors']):
+            if error is not None:
+                errors.append({'stock_code': f"{mc}:{ticker}", 'error': error})
+
+        risk = risk_decomposition(stats, weights)
+        if risk is None:
+            return {
+                'portfolio_beta': None,
+                'error': 'No valid beta values calculated for portfolio components',
+                'date': end_date,
+                'errors': errors
+            }
+
+        component_betas = []
+        for position, column in enumerate(np.flatnonzero(risk['valid'])):
+            mc, ticker = universe[column]
+            beta = float(stats['betas'][column])
+            weight = float(weights[column])
+            component_betas.append({
+                'stock_code': f"{mc}:{ticker}",
+                'market_code': mc,
+                'ticker': ticker,
+                'weight': weight,
+                'weight_share': float(risk['shares'][position]),
+                'beta': beta,
+                'weighted_beta': beta * weight,
+                'data_points': int(stats['data_points'][column]),
+                'marginal_risk': float(risk['marginal'][position]),
+                'risk_contribution': float(risk['contributions'][position]),
+                'risk_contribution_percent': float(risk['contributions'][position] / risk['volatility'] * 100)
+                if risk['volatility'] > 0 else 0.0,
+            })
+
+        portfolio_beta = risk['portfolio_beta']
+        return {
+            'portfolio_beta': portfolio_beta,
+            'date': end_date,
+            'period_start': start_date,
+            'period_end': end_date,
+            'calculation_window': days_window,
+            'benchmark': {'market_code': index_market_code, 'index_code': index_code},
+            'volatility': {
+                'daily': risk['volatility'],
+                'annualized': risk['volatility'] * np.sqrt(TRADING_DAYS_PER_YEAR),
+            },
+            'component_betas': component_betas,
+            'errors': errors,
+            'interpretation': interpret_beta(portfolio_beta),
+            'prediction_horizon': days_to_predict,
+            'covariance_cached': cached
+        }
@@ -0,0 +1,541 @@
+import hashlib
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from services.metrics import stage
+
+# Các cột giá được giữ trong bộ nhớ cho mỗi mã cổ phiếu / chỉ số
+STOCK_FIELDS = ['OpenPrice', 'HighestPrice', 'LowestPrice', 'ClosePrice', 'TotalVolume']
+INDEX_FIELDS = ['CurrentIndex', 'OpenIndex', 'HighestIndex', 'LowestIndex', 'CloseIndex', 'TotalVolume']
+
+# MarketCode của sàn trong market_index_data và chỉ số tham chiếu của từng sàn
+INDEX_MARKET_CODES = {'HOSE': 'HSX'}
+BENCHMARK_INDEX_CODES = {
+    'HSX': 'VNINDEX',
+    'HOSE': 'VNINDEX',
+    'HNX': 'HNXIndex',
+    'UPCOM': 'UpcomIndex',
+    'Upcom': 'UpcomIndex',
+}
+
+
+def benchmark_key(market_code):
+    """
+    Return the benchmark index of a stock market
+
+    Raises:
+    KeyError: If the market has no benchmark index
+
+    Returns:
+    tuple: (MarketCode used in market_index_data, IndexCode)
+    """
+    index_market_code = INDEX_MARKET_CODES.get(market_code, market_code)
+    return index_market_code, BENCHMARK_INDEX_CODES[index_market_code]
+
+
+def to_numeric_column(values):
+    """Convert a raw Mongo column (numbers or strings like '1,234.5') to float64"""
+    series = pd.Series(values)
+    if series.dtype == object:
+        series = series.astype(str).str.replace(',', '', regex=False)
+    return pd.to_numeric(series, errors='coerce').to_numpy(dtype=np.float64)
+
+
+def to_date_array(values):
+    """
+    Convert a raw TradeDate column to datetime64[D]
+
+    BSON dates are taken as they are; strings left by older imports are
+    parsed with the import's DATE_FORMATS rather than guessed by pandas, so
+    a column mixing both gives the same dates as a fresh import. Values
+    matching no format become NaT.
+    """
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.astype('datetime64[ns]').astype('datetime64[D]')
+
+    # Import muộn: data_import phụ thuộc price_store qua beta_moments
+    from services.data_import import normalize_trade_dates
+
+    # Mỗi giá trị khác nhau chỉ được chuyển một lần
+    codes, uniques = pd.factorize(values, sort=False)
+    parsed = [value if isinstance(value, datetime) else None for value in normalize_trade_dates(uniques)]
+    parsed = pd.to_datetime(pd.Series(parsed, dtype=object), errors='coerce').to_numpy(dtype='datetime64[ns]')
+    # Giá trị thiếu có mã -1, trỏ tới NaT được thêm vào cuối
+    parsed = np.append(parsed, np.datetime64('NaT', 'ns'))
+    return parsed[codes].astype('datetime64[D]')
+
+
+class PriceSeries:
+    """
+    Date-sorted, contiguous price arrays for one (MarketCode, Ticker) or
+    (MarketCode, IndexCode) key
+
+    dates is a datetime64[D] array and columns maps each price field to a
+    float64 array of the same length.
+    """
+
+    __slots__ = ('market_code', 'code', 'dates', 'columns', '_returns')
+
+    def __init__(self, market_code, code, dates, columns):
+        self.market_code = market_code
+        self.code = code
+        self.dates = dates
+        self.columns = columns
+        self._returns = {}
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __getitem__(self, field):
+        return self.columns[field]
+
+    @property
+    def last_date(self):
+        return self.dates[-1] if len(self.dates) else None
+
+    def daily_returns(self, field):
+        """
+        Return the daily returns of a price field, computed once and shared by all callers
+
+        Same values as beta_calculation.calculate_daily_returns: returns between
+        consecutive bars, NaN (including the first bar) replaced by 0. The
+        array is read-only.
+        """
+        returns = self._returns.get(field)
+        if returns is None:
+            prices = self.columns[field]
+            returns = np.zeros(len(prices), dtype=np.float64)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                returns[1:] = prices[1:] / prices[:-1] - 1
+            returns[np.isnan(returns)] = 0
+            returns.flags.writeable = False
+            self._returns[field] = returns
+        return returns
+
+    def to_frame(self, code_column='Ticker'):
+        """Build a DataFrame with the column layout of the stock_data collection (TradeDate as datetime64)"""
+        frame = pd.DataFrame(self.columns, copy=False)
+        frame.insert(0, 'TradeDate', self.dates.astype('datetime64[ns]'))
+        frame.insert(0, code_column, self.code)
+        frame.insert(0, 'MarketCode', self.market_code)
+        return frame
+
+
+def build_series(df, code_column, fields):
+    """
+    Split a flat DataFrame of raw documents into one PriceSeries per (MarketCode, code)
+
+    Rows without a parsable TradeDate are dropped. When the same bar was
+    imported more than once the last imported row wins.
+    """
+    if df.empty:
+        return {}
+
+    dates = to_date_array(df['TradeDate'].values)
+    frame = pd.DataFrame({
+        'MarketCode': df['MarketCode'].values,
+        'Code': df[code_column].values,
+        'TradeDate': dates,
+    })
+    for field in fields:
+        frame[field] = to_numeric_column(df[field].values) if field in df.columns else np.nan
+
+    frame = frame[~pd.isna(frame['TradeDate']) & frame['Code'].notna() & frame['MarketCode'].notna()]
+    frame = frame.drop_duplicates(['MarketCode', 'Code', 'TradeDate'], keep='last')
+    frame = frame.sort_values(['MarketCode', 'Code', 'TradeDate'], kind='mergesort')
+
+    # Mảng liên tục cho toàn bộ thị trường, mỗi mã chỉ là một lát cắt (view)
+    all_dates = frame['TradeDate'].to_numpy(dtype='datetime64[ns]').astype('datetime64[D]')
+    all_columns = {field: np.ascontiguousarray(frame[field].to_numpy(dtype=np.float64)) for field in fields}
+    keys = list(zip(frame['MarketCode'].values, frame['Code'].values))
+
+    result = {}
+    start = 0
+    for end in range(1, len(keys) + 1):
+        if end == len(keys) or keys[end] != keys[start]:
+            market_code, code = keys[start]
+            result[(market_code, code)] = PriceSeries(
+                market_code,
+                code,
+                all_dates[start:end],
+                {field: values[start:end] for field, values in all_columns.items()}
+            )
+            start = end
+    return result
+
+
+class PriceStore:
+    """
+    In-process cache of stock and market index price history
+
+    Data is loaded lazily, one market at a time, the first time it is
+    requested and kept as contiguous NumPy arrays keyed by
+    (MarketCode, Ticker) and (MarketCode, IndexCode). Import endpoints call
+    invalidate_stocks / invalidate_indexes after committing so the next read
+    reloads fresh data. Imports done by other processes are picked up by
+    polling the latest import id at most every refresh_interval seconds.
+
+    The MarketCode and Ticker lists used by the UI dropdowns are cached the
+    same way, from distinct queries served by the (MarketCode, Ticker, ...)
+    indexes.
+    """
+
+    def __init__(self, db, refresh_interval=5.0):
+        self.db = db
+        self.refresh_interval = refresh_interval
+        self.version = 0
+        self._lock = threading.RLock()
+        self._stocks = {}
+        self._indexes = {}
+        self._versions = {}
+        self._import_markers = {}
+        self._local_imports = {}
+        self._last_check = 0.0
+        self._market_codes = None
+        self._index_market_codes = None
+        self._ticker_lists = {}
+
+    # ------------------------------------------------------------------
+    # Invalidation
+    # ------------------------------------------------------------------
+
+    def invalidate_stocks(self, market_codes=None, import_id=None):
+        """
+        Drop cached stock series for the given markets (all markets if None)
+
+        Parameters:
+        market_codes (iterable, optional): Markets touched by the import
+        import_id (ObjectId, optional): imports record of the local import, so polling does not reload it again
+        """
+        with self._lock:
+            if market_codes is None:
+                self._stocks.clear()
+                self._ticker_lists.clear()
+            else:
+                for market_code in market_codes:
+                    self._stocks.pop(market_code, None)
+                    self._versions.pop(('stock', market_code), None)
+                    self._ticker_lists.pop(market_code, None)
+            # Có thể xuất hiện thị trường mới nên luôn tải lại danh sách MarketCode
+            self._market_codes = None
+            self._mark_imports_seen('imports', import_id)
+            self.version += 1
+
+    def invalidate_indexes(self, market_codes=None, import_id=None):
+        """Drop cached market index series for the given markets (all markets if None)"""
+        with self._lock:
+            if market_codes is None:
+                self._indexes.clear()
+            else:
+                for market_code in market_codes:
+                    self._indexes.pop(market_code, None)
+                    self._versions.pop(('index', market_code), None)
+            self._index_market_codes = None
+            self._mark_imports_seen('market_index_imports', import_id)
+            self.version += 1
+
+    def _latest_import_id(self, collection_name):
+        doc = self.db[collection_name].find_one({}, {'_id': 1}, sort=[('_id', -1)])
+        return doc['_id'] if doc else None
+
+    def _mark_imports_seen(self, collection_name, import_id):
+        """
+        Record a local import as already reflected
+
+        Only the import itself is recorded, not the newest import id: an
+        import committed meanwhile by another process must still trigger a
+        reload when _check_external_imports polls.
+        """
+        if import_id is not None:
+            self._local_imports.setdefault(collection_name, set()).add(import_id)
+
+    def _check_external_imports(self):
+        """Invalidate caches when another process has committed an import"""
+        now = time.monotonic()
+        if now - self._last_check < self.refresh_interval:
+            return
+        self._last_check = now
+
+        for collection_name, invalidate in (('imports', self.invalidate_stocks),
+                                            ('market_index_imports', self.invalidate_indexes)):
+            if collection_name not in self._import_markers:
+                self._import_markers[collection_name] = self._latest_import_id(collection_name)
+                continue
+
+            # Các import mới hơn lần kiểm tra trước; import của chính tiến trình này đã được làm mới
+            marker = self._import_markers[collection_name]
+            query = {'_id': {'$gt': marker}} if marker is not None else {}
+            new_ids = [doc['_id'] for doc in self.db[collection_name].find(query, {'_id': 1})]
+            if not new_ids:
+                continue
+            local = self._local_imports.get(collection_name, set())
+            if any(import_id not in local for import_id in new_ids):
+                invalidate()
+            marker = max(new_ids)
+            self._import_markers[collection_name] = marker
+            self._local_imports[collection_name] = {import_id for import_id in local if import_id > marker}
+
+    # ------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------
+
+    def _load(self, collection, market_code, code_column, fields):
+        """
+        Load one market from Mongo
+
+        Returns:
+        tuple: ({code: PriceSeries}, data version string derived from the market's import ids)
+        """
+        projection = {'_id': 0, 'MarketCode': 1, code_column: 1, 'TradeDate': 1, 'import_id': 1}
+        projection.update({field: 1 for field in fields})
+        with stage('mongo_fetch'):
+            documents = list(collection.find({'MarketCode': market_code}, projection))
+        if not documents:
+            return {}, 'empty'
+        with stage('dataframe_build'):
+            # Cột được dựng tường minh (kiểu object) thay vì để pandas suy luận từ các document,
+            # vì TradeDate có thể lẫn BSON date và chuỗi của các lần import cũ
+            df = pd.DataFrame({
+                name: pd.Series([document.get(name) for document in documents], dtype=object)
+                for name in ['MarketCode', code_column, 'TradeDate', 'import_id'] + fields
+            })
+
+        import_ids = sorted(str(i) for i in df['import_id'].dropna().unique())
+        version = hashlib.sha1(','.join(import_ids).encode('utf-8')).hexdigest()[:16]
+
+        with stage('dataframe_build'):
+            series = {code: series for (_, code), series in build_series(df, code_column, fields).items()}
+        return series, version
+
+    def _stock_market(self, market_code):
+        with self._lock:
+            self._check_external_imports()
+            market = self._stocks.get(market_code)
+            if market is None:
+                market, version = self._load(self.db.stock_data, market_code, 'Ticker', STOCK_FIELDS)
+                self._stocks[market_code] = market
+                self._versions[('stock', market_code)] = version
+            return market
+
+    def _index_market(self, market_code):
+        with self._lock:
+            self._check_external_imports()
+            market = self._indexes.get(market_code)
+            if market is None:
+                market, version = self._load(self.db.market_index_data, market_code, 'IndexCode', INDEX_FIELDS)
+                self._indexes[market_code] = market
+                self._versions[('index', market_code)] = version
+            return market
+
+    def data_version(self, market_code, index_market_code=None):
+        """
+        Identify the imported data a computation for a market was based on
+
+        Parameters:
+        market_code (str): Stock market code
+        index_market_code (str, optional): Market code of the index series also used
+
+        Returns:
+        str: Version string that changes whenever an import touches these markets
+        """
+        with self._lock:
+            self._stock_market(market_code)
+            parts = [self._versions.get(('stock', market_code), 'empty')]
+            if index_market_code is not None:
+                self._index_market(index_market_code)
+                parts.append(self._versions.get(('index', index_market_code), 'empty'))
+            return '-'.join(parts)
+
+    # ------------------------------------------------------------------
+    # Stock data
+    # ------------------------------------------------------------------
+
+    def market_codes(self):
+        """Return every MarketCode present in stock_data"""
+        with self._lock:
+            self._check_external_imports()
+            if self._market_codes is None:
+                self._market_codes = sorted(
+                    code for code in self.db.stock_data.distinct('MarketCode') if code is not None
+                )
+            return list(self._market_codes)
+
+    def ticker_list(self, market_code):
+        """
+        Return the sorted tickers of a market without loading its price history
+
+        Returns:
+        list: Distinct Ticker values of stock_data for the market
+        """
+        with self._lock:
+            self._check_external_imports()
+            tickers = self._ticker_lists.get(market_code)
+            if tickers is None:
+                tickers = sorted(
+                    ticker for ticker in self.db.stock_data.distinct('Ticker', {'MarketCode': market_code})
+                    if ticker is not None
+                )
+                self._ticker_lists[market_code] = tickers
+            return list(tickers)
+
+    def warm_listings(self):
+        """Fill the MarketCode and Ticker list caches, e.g. at startup"""
+        for market_code in self.market_codes():
+            self.ticker_list(market_code)
+        self.index_market_codes()
+
+    def tickers(self, market_code):
+        """Return the sorted tickers cached for a market"""
+        return sorted(self._stock_market(market_code).keys())
+
+    def get_stock(self, market_code, ticker):
+        """Return the PriceSeries for one ticker, or None if it has no data"""
+        return self._stock_market(market_code).get(ticker)
+
+    def get_stocks(self, market_code, tickers=None):
+        """Return {ticker: PriceSeries} for a market, optionally restricted to some tickers"""
+        market = self._stock_market(market_code)
+        if tickers is None:
+            return dict(market)
+        return {ticker: market[ticker] for ticker in tickers if ticker in market}
+
+    def stock_frame(self, market_code, tickers=None):
+        """
+        Build a stock_data style DataFrame for a market
+
+        Parameters:
+        market_code (str): Market code (HOSE, HNX, ...)
+        tickers (list, optional): Restrict to these tickers, defaults to the whole market
+
+        Returns:
+        DataFrame: MarketCode, Ticker, TradeDate and price columns, sorted by Ticker and date
+        """
+        series = self.get_stocks(market_code, tickers)
+        if not series:
+            return pd.DataFrame(columns=['MarketCode', 'Ticker', 'TradeDate'] + STOCK_FIELDS)
+        return pd.concat([s.to_frame('Ticker') for s in series.values()], ignore_index=True)
+
+    def latest_bars(self, market_code):
+        """
+        Return the last bar of every ticker traded on the market's latest date
+
+        Returns:
+        tuple: (latest date as 'YYYY-MM-DD' or None, DataFrame with one row per ticker)
+        """
+        market = self._stock_market(market_code)
+        if not market:
+            return None, pd.DataFrame(columns=['MarketCode', 'Ticker', 'TradeDate'] + STOCK_FIELDS)
+
+        latest = max(series.last_date for series in market.values())
+        rows = [series for series in market.values() if series.last_date == latest]
+        frame = pd.DataFrame({
+            'MarketCode': [series.market_code for series in rows],
+            'Ticker': [series.code for series in rows],
+            'TradeDate': str(latest),
+        })
+        for field in STOCK_FIELDS:
+            frame[field] = np.array([series.columns[field][-1] for series in rows], dtype=np.float64)
+        return str(latest), frame
+
+    def bars_as_of(self, market_code, as_of=None):
+        """
+        Return each ticker's last bar on or before a date
+
+        Parameters:
+        market_code (str): Market code (HOSE, HNX, ...)
+        as_of (datetime or str, optional): Cut-off date (inclusive), defaults to each ticker's last bar
+
+        Returns:
+        DataFrame: One row per ticker traded on or before as_of, TradeDate as 'YYYY-MM-DD'
+        """
+        market = self._stock_market(market_code)
+        cutoff = np.datetime64(pd.Timestamp(as_of).date(), 'D') if as_of is not None else None
+
+        rows, positions = [], []
+        for series in market.values():
+            # Mỗi chuỗi đã sắp xếp theo ngày nên chỉ cần tìm nhị phân
+            if cutoff is None:
+                position = len(series) - 1
+            else:
+                position = np.searchsorted(series.dates, cutoff, side='right') - 1
+            if position >= 0:
+                rows.append(series)
+                positions.append(position)
+
+        frame = pd.DataFrame({
+            'MarketCode': [series.market_code for series in rows],
+            'Ticker': [series.code for series in rows],
+            'TradeDate': [str(series.dates[position]) for series, position in zip(rows, positions)],
+        })
+        for field in STOCK_FIELDS:
+            frame[field] = np.array([series.columns[field][position] for series, position in zip(rows, positions)],
+                                    dtype=np.float64)
+        return frame
+
+    # ------------------------------------------------------------------
+    # Market index data
+    # ------------------------------------------------------------------
+
+    def get_index(self, market_code, index_code):
+        """Return the PriceSeries for one market index, or None if it has no data"""
+        return self._index_market(market_code).get(index_code)
+
+    def index_frame(self, market_code, index_code=None):
+        """
+        Build a market_index_data style DataFrame
+
+        Parameters:
+        market_code (str): Market code used in market_index_data (HSX, HNX, Upcom)
+        index_code (str, optional): Restrict to one IndexCode, defaults to all indexes of the market
+
+        Returns:
+        DataFrame: MarketCode, IndexCode, TradeDate and index columns sorted by date
+        """
+        market = self._index_market(market_code)
+        if index_code is not None:
+            market = {index_code: market[index_code]} if index_code in market else {}
+        if not market:
+            return pd.DataFrame(columns=['MarketCode', 'IndexCode', 'TradeDate'] + INDEX_FIELDS)
+        return pd.concat([s.to_frame('IndexCode') for s in market.values()], ignore_index=True)
+
+    def index_market_codes(self):
+        """Return every MarketCode present in market_index_data"""
+        with self._lock:
+            self._check_external_imports()
+            if self._index_market_codes is None:
+                self._index_market_codes = sorted(
+                    code for code in self.db.market_index_data.distinct('MarketCode') if code is not None
+                )
+            return list(self._index_market_codes)
+
+    def benchmark_frame(self, market_code):
+        """Build the market_index_data style DataFrame of a stock market's benchmark index"""
+        return self.index_frame(*benchmark_key(market_code))
+
+    def benchmark_returns(self, market_code):
+        """
+        Return the cached daily returns of a stock market's benchmark index
+
+        Every Beta calculation on the same exchange shares these arrays; they
+        are dropped with the index series when market index data is imported.
+
+        Returns:
+        tuple: (datetime64[ns] dates, float64 returns), empty arrays if the index has no data
+        """
+        series = self.get_index(*benchmark_key(market_code))
+        if series is None:
+            return np.array([], dtype='datetime64[ns]'), np.array([], dtype=np.float64)
+        return series.dates.astype('datetime64[ns]'), series.daily_returns('CurrentIndex')
+
+    def all_index_frame(self):
+        """Build a DataFrame with every cached market index series of every market"""
+        frames = [self.index_frame(market_code) for market_code in self.index_market_codes()]
+        frames = [frame for frame in frames if not frame.empty]
+        if not frames:
+            return pd.DataFrame(columns=['MarketCode', 'IndexCode', 'TradeDate'] + INDEX_FIELDS)
+        return pd.concat(frames, ignore_index=True)
@@ -1,12 +1,97 @@
+import base64
+import io
+import os
+
 import pandas as pd
 import numpy as np
+from joblib import Parallel, delayed
 from sklearn.svm import SVC
 from sklearn.preprocessing import StandardScaler
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+
+from services.feature_store import make_feature_key
+from services.metrics import stage, timed
+from services.model_registry import training_fingerprint
+
+# Các cột đặc trưng kỹ thuật dùng cho SVM, theo đúng thứ tự trong ma trận X
+FEATURE_COLUMNS = [
+    'ClosePrice',  # Current price
+    'rsi_14',  # RSI
+    'macd',  # MACD
+    'macd_signal',  # MACD Signal
+    'upper_band',  # Bollinger Upper
+    'lower_band',  # Bollinger Lower
+    'obv',  # On-Balance Volume
+    'atr_14',  # Average True Range
+    'volatility_20',  # Volatility
+]
+CLOSE_COLUMN = FEATURE_COLUMNS.index('ClosePrice')
+
+
+def get_threshold_pct(days_to_predict):
+    """Percent move that separates up/down from neutral for a prediction horizon"""
+    # Điều chỉnh ngưỡng phần trăm dựa trên days_to_predict
+    if days_to_predict <= 2:
+        return 0.5  # Ngưỡng thấp hơn cho dự đoán ngắn hạn
+    return 1.0  # Ngưỡng mặc định
+
+
+def label_price_movement(current_prices, future_prices, threshold_pct):
+    """
+    Classify price moves as 1 (up), 0 (neutral) or -1 (down)
+
+    Parameters:
+    current_prices (array): Prices at the prediction date
+    future_prices (array): Prices days_to_predict trading days later
+    threshold_pct (float): Percent move required to count as up or down
+
+    Returns:
+    array: Movement class for each sample
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percent_change = (future_prices - current_prices) / current_prices * 100
+
+    return np.where(percent_change > threshold_pct, 1, np.where(percent_change < -threshold_pct, -1, 0))
 
-def prepare_features(stock_data, beta_values, days_to_predict=5):
+
+def build_beta_lookup(beta_values, column='beta'):
+    """
+    Map stock_code -> value of the most recent row of beta_values
+
+    beta_values may hold one record per prediction horizon; the record with
+    the latest date (then calculation_date) is used, the first one on ties.
+    """
+    if beta_values is None or beta_values.empty or 'stock_code' not in beta_values.columns:
+        return {}
+    order = [field for field in ('date', 'calculation_date') if field in beta_values.columns]
+    if order:
+        beta_values = beta_values.sort_values(order, ascending=False, kind='mergesort', na_position='last')
+    first_rows = beta_values.drop_duplicates('stock_code', keep='first')
+    return dict(zip(first_rows['stock_code'], first_rows[column]))
+
+
+def ticker_features(group):
+    """
+    Technical indicator matrix of one ticker
+
+    Parameters:
+    group (DataFrame): Price history of one ticker sorted by TradeDate
+
+    Returns:
+    tuple: (TradeDate array, float matrix of FEATURE_COLUMNS) without the rows that have missing indicators
+    """
+    group = calculate_technical_indicators(group)
+
+    # Drop rows with NaN (due to rolling calculations)
+    group = group.dropna()
+
+    return group['TradeDate'].values, group[FEATURE_COLUMNS].to_numpy(dtype=np.float64)
+
+
+@timed('feature_prep')
+def prepare_features(stock_data, beta_values, days_to_predict=5, feature_store=None, data_version=None):
     """
     Prepare features for SVM analysis from stock data and beta values
 
@@ -14,6 +99,8 @@ def prepare_features(stock_data, beta_values, days_to_predict=5):
     stock_data (DataFrame): Historical stock data
     beta_values (DataFrame): Beta values for the stocks
     days_to_predict (int): Number of days to use for prediction horizon
+    feature_store (FeatureStore, optional): Store of indicator matrices shared across horizons
+    data_version (str, optional): Version of stock_data (see PriceStore.data_version), required by feature_store
 
     Returns:
     DataFrame: Features and target variables for SVM
@@ -30,17 +117,16 @@ def prepare_features(stock_data, beta_values, days_to_predict=5):
     # Group by stock code to process each stock individually
     grouped = df.groupby(['MarketCode', 'Ticker'])
 
-    # Initialize lists to store results
-    all_features = []
-    all_targets = []
+    # Beta của từng mã được tra cứu qua dict thay vì lọc DataFrame
+    beta_lookup = build_beta_lookup(beta_values)
+
+    # Initialize lists of per-stock blocks, concatenated once at the end
+    feature_blocks = []
+    target_blocks = []
+    date_blocks = []
     all_stock_codes = []
-    all_dates = []
 
-    # Điều chỉnh ngưỡng phần trăm dựa trên days_to_predict
-    if days_to_predict <= 2:
-        threshold_pct = 0.5  # Ngưỡng thấp hơn cho dự đoán ngắn hạn
-    else:
-        threshold_pct = 1.0  # Ngưỡng mặc định
+    threshold_pct = get_threshold_pct(days_to_predict)
 
     print(
         f"Using threshold of {threshold_pct}% for price movement classification with days_to_predict={days_to_predict}")
@@ -52,62 +138,46 @@ def prepare_features(stock_data, beta_values, days_to_predict=5):
 
         # Get beta value for this stock
         stock_code = ':'.join(code)
-        beta_value = None
-        if beta_values is not None:
-            beta_row = beta_values[beta_values['stock_code'] == stock_code]
-            if not beta_row.empty:
-                beta_value = beta_row.iloc[0]['beta']
+        beta_value = beta_lookup.get(stock_code)
+
+        # Calculate technical indicators, once per data version when a feature store is given
+        if feature_store is not None and data_version is not None:
+            feature_key = make_feature_key(stock_code, data_version, FEATURE_COLUMNS)
+            dates, matrix = feature_store.get_or_compute(feature_key, lambda: ticker_features(group))
+        else:
+            dates, matrix = ticker_features(group)
 
-        # Calculate technical indicators
-        group = calculate_technical_indicators(group)
+        n_samples = len(matrix) - days_to_predict
+        if n_samples <= 0:
+            continue
 
-        # Drop rows with NaN (due to rolling calculations)
-        group = group.dropna()
+        # Features of every sample of this stock at once
+        features = np.array(matrix[:n_samples], dtype=np.float64)
 
-        # Prepare features
-        for i in range(len(group) - days_to_predict):
-            # Current data point
-            current_data = group.iloc[i]
-
-            # Features
-            features = [
-                current_data['ClosePrice'],  # Current price
-                current_data['rsi_14'],  # RSI
-                current_data['macd'],  # MACD
-                current_data['macd_signal'],  # MACD Signal
-                current_data['upper_band'],  # Bollinger Upper
-                current_data['lower_band'],  # Bollinger Lower
-                current_data['obv'],  # On-Balance Volume
-                current_data['atr_14'],  # Average True Range
-                current_data['volatility_20'],  # Volatility
-            ]
-
-            # Add beta as a feature if available
-            if beta_value is not None:
-                features.append(beta_value)
-
-            # Target: Will the price go up in the next 'days_to_predict' days?
-            future_price = float(group.iloc[i + days_to_predict]['ClosePrice'])
-            current_price = float(current_data['ClosePrice'])
-
-            # Classify as 1 (up), 0 (neutral), -1 (down) with adjusted thresholds
-            percent_change = (future_price - current_price) / current_price * 100
-
-            if percent_change > threshold_pct:  # Up more than threshold_pct
-                target = 1
-            elif percent_change < -threshold_pct:  # Down more than threshold_pct
-                target = -1
-            else:  # Between -threshold_pct and threshold_pct
-                target = 0
-
-            all_features.append(features)
-            all_targets.append(target)
-            all_stock_codes.append(stock_code)
-            all_dates.append(current_data['TradeDate'])
-
-    # Convert lists to arrays
-    X = np.array(all_features)
-    y = np.array(all_targets)
+        # Add beta as a feature if available
+        if beta_value is not None:
+            features = np.column_stack([features, np.full(n_samples, beta_value, dtype=np.float64)])
+
+        # Target: Will the price go up in the next 'days_to_predict' days?
+        close_prices = matrix[:, CLOSE_COLUMN]
+        targets = label_price_movement(
+            close_prices[:n_samples],
+            close_prices[days_to_predict:days_to_predict + n_samples],
+            threshold_pct
+        )
+
+        feature_blocks.append(features)
+        target_blocks.append(targets)
+        date_blocks.append(np.asarray(dates[:n_samples]))
+        all_stock_codes.extend([stock_code] * n_samples)
+
+    if not feature_blocks:
+        return np.array([]), np.array([]), [], []
+
+    # Convert blocks to arrays
+    X = np.concatenate(feature_blocks)
+    y = np.concatenate(target_blocks)
+    all_dates = list(pd.DatetimeIndex(np.concatenate(date_blocks)))
 
     return X, y, all_stock_codes, all_dates
 
@@ -152,14 +222,66 @@ def calculate_technical_indicators(df):
     return df
 
 
-def train_svm_model(X, y, days_to_predict=5):
+def get_svm_n_jobs(n_jobs=None):
+    """
+    Worker count for the hyperparameter search
+
+    Defaults to SVM_N_JOBS, or to every core (os.cpu_count()) when it is
+    unset. Each request runs its own search, so servers running several
+    processes set SVM_N_JOBS to their share of the cores: gunicorn.conf.py
+    and worker.py divide the cores by their worker processes.
+
+    Raises:
+    ValueError: If the count (or SVM_N_JOBS) is not a positive integer
+    """
+    if n_jobs is None:
+        value = os.getenv('SVM_N_JOBS')
+        if value is None or not value.strip():
+            return os.cpu_count() or 1
+        try:
+            n_jobs = int(value)
+        except ValueError:
+            raise ValueError(f"SVM_N_JOBS must be a positive integer, got {value!r}") from None
+    if n_jobs <= 0:
+        raise ValueError(f"SVM_N_JOBS must be a positive integer (number of grid workers), got {n_jobs}")
+    return n_jobs
+
+
+def evaluate_svm_candidate(kernel, C, X_train, y_train, X_test, y_test):
+    """
+    Fit one SVC configuration without probability calibration and score it
+
+    Runs inside a joblib worker. With the process backend the training and
+    test matrices arrive as read-only memory maps shared by all workers.
+
+    Returns:
+    tuple: (accuracy, classification report dict)
+    """
+    model = SVC(kernel=kernel, C=C, gamma='scale', random_state=42, class_weight='balanced')
+    model.fit(X_train, y_train)
+
+    # Predict on test set
+    y_pred = model.predict(X_test)
+
+    # Calculate accuracy
+    accuracy = accuracy_score(y_test, y_pred)
+    report = classification_report(y_test, y_pred, output_dict=True)
+    return accuracy, report
+
+
+def train_svm_model(X, y, days_to_predict=5, n_jobs=None, backend=None):
     """
     Train an SVM model for stock prediction
 
+    The kernel x C grid is evaluated in parallel without Platt scaling;
+    only the winning configuration is refitted with probability=True.
+
     Parameters:
     X (array): Feature matrix
     y (array): Target vector
     days_to_predict (int): Number of days to predict ahead
+    n_jobs (int, optional): Number of grid workers, defaults to SVM_N_JOBS or the core count
+    backend (str, optional): joblib backend, 'loky' (processes, default) or 'threading'
 
     Returns:
     tuple: (model, scaler, accuracy, report, confusion_matrix)
@@ -183,48 +305,35 @@ def train_svm_model(X, y, days_to_predict=5):
         # Khoảng thời gian dài cần một mô hình với nhiều regularization hơn
         C_values = [0.1, 1.0, 5.0]
 
-    best_accuracy = 0
-    best_model = None
-    best_report = None
-
-    for kernel in kernels:
-        for C in C_values:
-            model = SVC(kernel=kernel, C=C, gamma='scale', random_state=42, probability=True, class_weight='balanced')
-            model.fit(X_train_scaled, y_train)
-
-            # Predict on test set
-            y_pred = model.predict(X_test_scaled)
-
-            # Calculate accuracy
-            accuracy = accuracy_score(y_test, y_pred)
-            report = classification_report(y_test, y_pred, output_dict=True)
-
-            # Save the best model
-            if accuracy > best_accuracy:
-                best_accuracy = accuracy
-                best_model = model
-                best_report = report
+    grid = [(kernel, C) for kernel in kernels for C in C_values]
+
+    # Đánh giá song song các cấu hình; joblib memory-map các ma trận lớn cho worker
+    backend = backend or os.getenv('SVM_PARALLEL_BACKEND', 'loky')
+    n_jobs = min(get_svm_n_jobs(n_jobs), len(grid))
+    with stage('svm_grid'):
+        scores = Parallel(n_jobs=n_jobs, backend=backend)(
+            delayed(evaluate_svm_candidate)(kernel, C, X_train_scaled, y_train, X_test_scaled, y_test)
+            for kernel, C in grid
+        )
+
+    # Save the best model (first configuration with the highest accuracy)
+    best_index = 0
+    for i, (accuracy, _) in enumerate(scores):
+        if accuracy > scores[best_index][0]:
+            best_index = i
+    best_kernel, best_C = grid[best_index]
+    best_accuracy, best_report = scores[best_index]
+
+    # Chỉ hiệu chỉnh xác suất (Platt scaling) cho cấu hình tốt nhất
+    best_model = SVC(kernel=best_kernel, C=best_C, gamma='scale', random_state=42, probability=True,
+                     class_weight='balanced')
+    with stage('svm_calibration'):
+        best_model.fit(X_train_scaled, y_train)
 
     # Get confusion matrix
     y_pred = best_model.predict(X_test_scaled)
     cm = confusion_matrix(y_test, y_pred)
 
-    # Đảm bảo report có thể serializable
-    processed_report = {}
-    for key, value in best_report.items():
-        if isinstance(value, dict):
-            processed_report[key] = {}
-            for metric, metric_value in value.items():
-                if hasattr(metric_value, 'item') or hasattr(metric_value, 'tolist'):
-                    processed_report[key][metric] = float(metric_value)
-                else:
-                    processed_report[key][metric] = metric_value
-        else:
-            if hasattr(value, 'item') or hasattr(value, 'tolist'):
-                processed_report[key] = float(value)
-            else:
-                processed_report[key] = value
-
     # Chuyển confusion matrix thành list
     cm_list = cm.tolist()
 
@@ -233,7 +342,8 @@ def train_svm_model(X, y, days_to_predict=5):
 
     print(f"Trained SVM model for days_to_predict={days_to_predict} with accuracy: {accuracy:.4f}")
 
-    return best_model, scaler, accuracy, processed_report, cm_list
+    # classification_report(output_dict=True) chỉ chứa số Python nên lưu và trả về trực tiếp
+    return best_model, scaler, accuracy, best_report, cm_list
 
 
 def predict_stock_movement(model, scaler, features):
@@ -273,7 +383,41 @@ def get_prediction_label(prediction, confidence=None):
     else:
         return f"Giảm giá{confidence_str}", "strong_sell"
 
-def analyze_stocks_with_svm(stock_data, beta_values, days_to_predict=5):
+@timed('inference')
+def predict_stock_movements(model, scaler, X):
+    """
+    Predict stock movement for a whole feature matrix at once
+
+    Parameters:
+    model: Trained SVM model
+    scaler: Feature scaler
+    X (array): Feature matrix, one row per sample
+
+    Returns:
+    tuple: (predicted classes, confidence score of each prediction)
+    """
+    # Scale all features in one call
+    X_scaled = scaler.transform(X)
+
+    # Predict
+    predictions = model.predict(X_scaled)
+
+    # Confidence score
+    confidence_scores = np.max(model.predict_proba(X_scaled), axis=1)
+
+    return predictions, confidence_scores
+
+
+def get_prediction_labels(predictions, confidences):
+    """Vectorized version of get_prediction_label for arrays of predictions"""
+    base_labels = np.select([predictions == 1, predictions == 0], ["Tăng giá", "Đi ngang"], "Giảm giá")
+    signals = np.select([predictions == 1, predictions == 0], ["strong_buy", "hold"], "strong_sell")
+    confidence_str = np.char.add(np.char.add(" (Độ tin cậy: ", np.char.mod('%.2f', confidences)), ")")
+    return np.char.add(base_labels, confidence_str), signals
+
+
+def analyze_stocks_with_svm(stock_data, beta_values, days_to_predict=5, registry=None, model_key=None,
+                            feature_store=None, data_version=None):
     """
     Analyze stocks with SVM model to predict price movements
 
@@ -281,13 +425,18 @@ def analyze_stocks_with_svm(stock_data, beta_values, days_to_predict=5):
     stock_data (DataFrame): Historical stock data
     beta_values (DataFrame): Beta values (optional)
     days_to_predict (int): Number of days to predict ahead
+    registry (ModelRegistry, optional): Registry used to reuse previously trained models
+    model_key (str, optional): Registry key of this analysis (see make_model_key)
+    feature_store (FeatureStore, optional): Store of indicator matrices shared across horizons
+    data_version (str, optional): Version of stock_data, required by feature_store
 
     Returns:
     dict: Result of SVM analysis including predictions and metrics
     """
     try:
         # Prepare features
-        X, y, stock_codes, dates = prepare_features(stock_data, beta_values, days_to_predict)
+        X, y, stock_codes, dates = prepare_features(stock_data, beta_values, days_to_predict,
+                                                    feature_store=feature_store, data_version=data_version)
 
         if len(X) == 0 or len(y) == 0:
             return {
@@ -295,37 +444,64 @@ def analyze_stocks_with_svm(stock_data, beta_values, days_to_predict=5):
                 "error": "Insufficient data for analysis after filtering"
             }
 
-        # Train SVM model
-        model, scaler, accuracy, report, cm = train_svm_model(X, y, days_to_predict)
-
-        # Predict for all samples
-        predictions = []
-        for i, features in enumerate(X):
-            prediction, confidence = predict_stock_movement(model, scaler, features)
-            label, signal = get_prediction_label(prediction, confidence)
-
-            # Get beta value and interpretation if available
-            beta = None
-            beta_interpretation = None
-            if beta_values is not None and not beta_values.empty:
-                beta_row = beta_values[beta_values['stock_code'] == stock_codes[i]]
-                if not beta_row.empty:
-                    beta = beta_row.iloc[0]['beta']
-                    beta_interpretation = beta_row.iloc[0]['interpretation']
-
-            predictions.append({
-                'stock_code': stock_codes[i],
-                'date': str(dates[i]),
-                'prediction': str(prediction),
-                'prediction_label': label,
-                'signal': signal,
-                'confidence': float(confidence),
-                'beta': float(beta) if beta is not None else None,
-                'beta_interpretation': beta_interpretation
-            })
+        # Reuse a registered model trained on exactly these samples, otherwise train one
+        cached = None
+        fingerprint = None
+        if registry is not None and model_key is not None:
+            with stage('model_registry'):
+                fingerprint = training_fingerprint(X, y)
+                cached = registry.get(model_key, fingerprint)
+
+        if cached is not None:
+            model, scaler = cached['model'], cached['scaler']
+            accuracy, report, cm = cached['accuracy'], cached['report'], cached['confusion_matrix']
+            print(f"Reusing registered SVM model for days_to_predict={days_to_predict}")
+        else:
+            # Train SVM model
+            model, scaler, accuracy, report, cm = train_svm_model(X, y, days_to_predict)
+            if registry is not None and model_key is not None:
+                feature_schema = FEATURE_COLUMNS + ['beta'] if X.shape[1] > len(FEATURE_COLUMNS) else FEATURE_COLUMNS
+                with stage('model_registry'):
+                    registry.put(model_key, model, scaler, accuracy, report, cm, feature_schema, fingerprint)
+
+        # Predict for all samples in one batch
+        classes, confidences = predict_stock_movements(model, scaler, X)
+        labels, signals = get_prediction_labels(classes, confidences)
 
         # Sort predictions by stock code and date
-        predictions = sorted(predictions, key=lambda x: (x['stock_code'], x['date']))
+        codes = np.asarray(stock_codes)
+        date_strings = pd.DatetimeIndex(dates).strftime('%Y-%m-%d %H:%M:%S').to_numpy(dtype=str)
+        order = np.lexsort((date_strings, codes))
+
+        # Get beta value and interpretation per stock, joined once by stock code
+        beta_lookup = build_beta_lookup(beta_values)
+        interpretation_lookup = {}
+        if beta_values is not None and 'interpretation' in beta_values.columns:
+            interpretation_lookup = build_beta_lookup(beta_values, 'interpretation')
+        stock_beta = {}
+        for code in set(stock_codes):
+            beta = beta_lookup.get(code)
+            stock_beta[code] = (float(beta) if beta is not None else None, interpretation_lookup.get(code))
+
+        codes = codes[order].tolist()
+        date_strings = date_strings[order].tolist()
+        class_strings = classes[order].astype(str).tolist()
+        labels = labels[order].tolist()
+        signals = signals[order].tolist()
+        confidences = confidences[order].tolist()
+        predictions = [
+            {
+                'stock_code': codes[i],
+                'date': date_strings[i],
+                'prediction': class_strings[i],
+                'prediction_label': labels[i],
+                'signal': signals[i],
+                'confidence': confidences[i],
+                'beta': stock_beta[codes[i]][0],
+                'beta_interpretation': stock_beta[codes[i]][1]
+            }
+            for i in range(len(codes))
+        ]
 
         print(f"Completed SVM analysis with {len(predictions)} predictions for days_ahead={days_to_predict}")
 
@@ -338,7 +514,8 @@ def analyze_stocks_with_svm(stock_data, beta_values, days_to_predict=5):
             },
             "predictions": predictions,
             "days_ahead": days_to_predict,
-            "beta_used": beta_values is not None
+            "beta_used": beta_values is not None,
+            "model_cached": cached is not None
         }
 
     except Exception as e:
@@ -349,48 +526,70 @@ def analyze_stocks_with_svm(stock_data, beta_values, days_to_predict=5):
             "error": str(e)
         }
 
+def figure_to_base64(fig):
+    """Encode a figure as a base64 PNG string"""
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png')
+    return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
 # Plot confusion matrix
+# Mỗi lần gọi vẽ trên một Figure riêng (không dùng trạng thái toàn cục của pyplot)
+# nên các request đồng thời không ghi đè hình của nhau
 def plot_confusion_matrix(cm, class_names=['Giảm', 'Đi ngang', 'Tăng']):
-    plt.figure(figsize=(8, 6))
-    plt.imshow(cm, interpolation='nearest', cmap=plt.cm.Blues)
-    plt.title('Ma trận nhầm lẫn')
-    plt.colorbar()
+    """
+    Render the confusion matrix
+
+    Returns:
+    str: Base64-encoded PNG image
+    """
+    fig = Figure(figsize=(8, 6))
+    ax = fig.subplots()
+    image = ax.imshow(cm, interpolation='nearest', cmap='Blues')
+    ax.set_title('Ma trận nhầm lẫn')
+    fig.colorbar(image, ax=ax)
 
     tick_marks = np.arange(len(class_names))
-    plt.xticks(tick_marks, class_names, rotation=45)
-    plt.yticks(tick_marks, class_names)
+    ax.set_xticks(tick_marks)
+    ax.set_xticklabels(class_names, rotation=45)
+    ax.set_yticks(tick_marks)
+    ax.set_yticklabels(class_names)
 
     # Add text annotations in each cell
     thresh = cm.max() / 2
     for i in range(len(class_names)):
         for j in range(len(class_names)):
-            plt.text(j, i, format(cm[i, j], 'd'),
-                     ha="center", va="center",
-                     color="white" if cm[i, j] > thresh else "black")
+            ax.text(j, i, format(cm[i, j], 'd'),
+                    ha="center", va="center",
+                    color="white" if cm[i, j] > thresh else "black")
 
-    plt.tight_layout()
-    plt.ylabel('Nhãn thực tế')
-    plt.xlabel('Nhãn dự đoán')
-    plt.savefig('confusion_matrix.png')
-    plt.close()
+    ax.set_ylabel('Nhãn thực tế')
+    ax.set_xlabel('Nhãn dự đoán')
+    fig.tight_layout()
+    return figure_to_base64(fig)
 
 # Plot confidence distribution
 def plot_confidence_distribution(predictions):
+    """
+    Render the histogram of confidence scores of each predicted class
+
+    Returns:
+    str: Base64-encoded PNG image
+    """
     confidences = [pred['confidence'] for pred in predictions]
     labels = [int(pred['prediction']) + 1 for pred in predictions]  # Convert -1,0,1 to 0,1,2
 
-    plt.figure(figsize=(10, 6))
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
 
     # Plot confidence distribution for each class
     for class_idx, class_name in enumerate(['Giảm', 'Đi ngang', 'Tăng']):
         class_confidences = [conf for conf, label in zip(confidences, labels) if label == class_idx]
         if class_confidences:
-            plt.hist(class_confidences, alpha=0.5, bins=20, label=class_name)
-
-    plt.xlabel('Điểm tin cậy')
-    plt.ylabel('Tần suất')
-    plt.title('Phân phối điểm tin cậy theo nhóm dự đoán')
-    plt.legend()
-    plt.grid(True, alpha=0.3)
-    plt.savefig('confidence_distribution.png')
-    plt.close()
\ No newline at end of file
+            ax.hist(class_confidences, alpha=0.5, bins=20, label=class_name)
+
+    ax.set_xlabel('Điểm tin cậy')
+    ax.set_ylabel('Tần suất')
+    ax.set_title('Phân phối điểm tin cậy theo nhóm dự đoán')
+    ax.legend()
+    ax.grid(True, alpha=0.3)
+    return figure_to_base64(fig)
\ No newline at end of file
@@ -0,0 +1,68 @@
+import importlib
+import os
+import time
+
+# Các module nặng được nạp trước để request đầu tiên không phải chờ import
+WARMUP_MODULES = ['sklearn.svm', 'sklearn.preprocessing', 'sklearn.model_selection', 'sklearn.metrics',
+                  'matplotlib.figure', 'openpyxl', 'joblib']
+
+
+def warmup_markets(value=None):
+    """
+    Markets whose prices are preloaded, from WARMUP_MARKETS
+
+    Returns:
+    list or None: Market codes, None for every market, [] to skip price preloading
+    """
+    value = os.getenv('WARMUP_MARKETS', 'all') if value is None else value
+    if value.strip().lower() == 'all':
+        return None
+    return [code.strip() for code in value.split(',') if code.strip()]
+
+
+def warmup(app, markets=None):
+    """
+    Preload heavy modules and the hot price caches before serving traffic
+
+    In a pre-fork server this runs once in the master process, so the
+    imported modules and cached price arrays are shared by every worker
+    (copy-on-write) instead of being loaded by the first request of each.
+
+    Parameters:
+    app (Flask): Application created by create_app
+    markets (list, optional): Market codes to preload, defaults to WARMUP_MARKETS (all markets)
+
+    Returns:
+    dict: Loaded modules, markets and tickers, and the elapsed seconds
+    """
+    started = time.perf_counter()
+    summary = {'modules': [], 'markets': [], 'tickers': 0}
+
+    for name in WARMUP_MODULES:
+        try:
+            importlib.import_module(name)
+            summary['modules'].append(name)
+        except ImportError as e:
+            print(f"Warmup: cannot import {name}: {e}")
+
+    store = app.price_store
+    if markets is None:
+        markets = warmup_markets()
+    if store is not None and app.db_connected and markets != []:
+        try:
+            store.warm_listings()
+            for market_code in store.market_codes() if markets is None else markets:
+                summary['tickers'] += len(store.tickers(market_code))
+                # Lợi nhuận chỉ số tham chiếu dùng chung cho mọi phép tính Beta của sàn
+                try:
+                    store.benchmark_returns(market_code)
+                except KeyError:
+                    pass
+                summary['markets'].append(market_code)
+        except Exception as e:
+            print(f"Warmup: cannot preload prices: {e}")
+
+    summary['seconds'] = round(time.perf_counter() - started, 3)
+    print(f"Warmup done in {summary['seconds']}s: {len(summary['markets'])} markets, "
+          f"{summary['tickers']} tickers, {len(summary['modules'])} modules")
+    return summary
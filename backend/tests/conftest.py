@@ -0,0 +1,35 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Các module của backend được import như khi chạy app.py từ thư mục backend
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def mongo_db():
+    """In-memory MongoDB database (mongomock)"""
+    mongomock = pytest.importorskip('mongomock')
+    return mongomock.MongoClient().intelligent_system_db
+
+
+@pytest.fixture
+def flask_app(monkeypatch, tmp_path):
+    """Application created by create_app on an in-memory MongoDB"""
+    mongomock = pytest.importorskip('mongomock')
+    import app as app_module
+
+    monkeypatch.setattr(app_module, 'MongoClient', mongomock.MongoClient)
+    monkeypatch.setenv('MODEL_REGISTRY_DIR', str(tmp_path / 'model_registry'))
+    monkeypatch.setenv('FEATURE_STORE_DIR', str(tmp_path / 'feature_store'))
+    # Cập nhật beta sau import chạy ngay để kết quả kiểm tra được xác định
+    monkeypatch.setenv('BETA_UPDATE_BACKGROUND', '0')
+    application = app_module.create_app()
+    application.config['TESTING'] = True
+    return application
+
+
+@pytest.fixture
+def client(flask_app):
+    return flask_app.test_client()
@@ -0,0 +1,27 @@
+import pytest
+
+
+def record_calls(monkeypatch, store, calls):
+    for name in ('data_version', 'stock_frame'):
+        method = getattr(store, name)
+
+        def wrapper(*args, _name=name, _method=method, **kwargs):
+            calls.append(_name)
+            return _method(*args, **kwargs)
+
+        monkeypatch.setattr(store, name, wrapper)
+
+
+@pytest.mark.parametrize('path, payload', [
+    ('/api/svm-analysis', {'market_code': 'HOSE', 'ticker': 'AAA'}),
+    ('/api/data-analysis', {'market_code': 'HOSE', 'ticker': ['AAA']}),
+])
+def test_data_version_is_read_before_the_prices(flask_app, client, monkeypatch, path, payload):
+    # Một import xen giữa hai lần đọc chỉ có thể làm dữ liệu mới hơn phiên bản, không cũ hơn
+    calls = []
+    record_calls(monkeypatch, flask_app.price_store, calls)
+
+    client.post(path, json=payload)
+
+    assert 'stock_frame' in calls
+    assert calls.index('data_version') < calls.index('stock_frame')
@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from services.beta_calculation import (calculate_all_stock_betas, calculate_beta, calculate_daily_returns,
+                                       calculate_rolling_betas, get_beta_for_stock)
+
+COMPARED_FIELDS = ['date', 'data_points', 'period_start', 'period_end', 'calculation_window', 'error']
+
+
+def make_market(days=600, seed=11):
+    """Stocks of two markets with suspended days, plus the index, TradeDate as 'YYYY-MM-DD' strings"""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2021-01-04', periods=days)
+    index = 1000 * np.cumprod(1 + rng.normal(0, 0.01, days))
+    market = pd.DataFrame({'TradeDate': dates.strftime('%Y-%m-%d'), 'CurrentIndex': index})
+
+    frames = []
+    for market_code, ticker, beta, traded_share in [('HOSE', 'AAA', 1.2, 0.97), ('HOSE', 'BBB', 0.6, 0.8),
+                                                    ('HNX', 'AAA', 1.8, 1.0), ('HNX', 'CCC', 0.9, 0.95)]:
+        returns = beta * np.r_[0, index[1:] / index[:-1] - 1] + rng.normal(0, 0.01, days)
+        traded = rng.random(days) < traded_share
+        frames.append(pd.DataFrame({
+            'MarketCode': market_code,
+            'Ticker': ticker,
+            'TradeDate': dates[traded].strftime('%Y-%m-%d'),
+            'ClosePrice': (30 * np.cumprod(1 + returns))[traded],
+        }))
+    # Mã mới niêm yết: quá ít phiên để tính Beta
+    frames.append(pd.DataFrame({'MarketCode': 'HOSE', 'Ticker': 'NEW', 'TradeDate': dates[-3:].strftime('%Y-%m-%d'),
+                                'ClosePrice': [10.0, 10.5, 10.2]}))
+    return pd.concat(frames, ignore_index=True), market
+
+
+def test_batch_matches_get_beta_for_stock():
+    stock_data, market_data = make_market()
+
+    batch = calculate_all_stock_betas(stock_data, market_data, days_to_predict=5)
+
+    assert len(batch) == 5
+    for row in batch.to_dict('records'):
+        group = stock_data[(stock_data['MarketCode'] == row['market_code'])
+                           & (stock_data['Ticker'] == row['ticker'])]
+        expected = get_beta_for_stock(group.copy(), market_data.copy(), row['stock_code'], 5)
+        for field in COMPARED_FIELDS:
+            if field in expected:
+                assert row[field] == expected[field], (row['stock_code'], field)
+        if expected['beta'] is None:
+            assert row['beta'] is None or np.isnan(row['beta'])
+        else:
+            assert row['beta'] == pytest.approx(expected['beta'], rel=1e-9)
+            assert row['avg_stock_return'] == pytest.approx(expected['avg_stock_return'], rel=1e-9)
+            assert row['avg_market_return'] == pytest.approx(expected['avg_market_return'], rel=1e-9)
+
+
+def test_same_ticker_on_two_markets_is_kept_apart():
+    stock_data, market_data = make_market()
+
+    batch = calculate_all_stock_betas(stock_data, market_data).set_index('stock_code')
+
+    assert batch.loc['HOSE:AAA', 'beta'] == pytest.approx(1.2, abs=0.2)
+    assert batch.loc['HNX:AAA', 'beta'] == pytest.approx(1.8, abs=0.2)
+
+
+def naive_rolling_betas(stock, market, window, min_periods):
+    """Reference: slice the last window aligned returns of every date and call calculate_beta"""
+    stock = stock.sort_values('TradeDate').assign(Returns=lambda df: calculate_daily_returns(df['ClosePrice']))
+    market = market.sort_values('TradeDate').assign(Returns=lambda df: calculate_daily_returns(df['CurrentIndex']))
+    merged = pd.merge(stock[['TradeDate', 'Returns']], market[['TradeDate', 'Returns']], on='TradeDate',
+                      suffixes=('_stock', '_market'))
+    betas = []
+    for end in range(1, len(merged) + 1):
+        period = merged.iloc[max(end - window, 0):end]
+        if len(period) < min_periods:
+            betas.append(None)
+        else:
+            betas.append(calculate_beta(period['Returns_stock'].values, period['Returns_market'].values))
+    return list(merged['TradeDate']), betas
+
+
+@pytest.mark.parametrize('min_periods', [None, 20])
+def test_rolling_beta_matches_a_naive_window(min_periods):
+    stock_data, market_data = make_market(400)
+    stock = stock_data[(stock_data['MarketCode'] == 'HOSE') & (stock_data['Ticker'] == 'BBB')]
+
+    result = calculate_rolling_betas(stock, market_data, 'HOSE:BBB', windows=(30, 90), min_periods=min_periods)
+
+    for window in (30, 90):
+        dates, expected = naive_rolling_betas(stock, market_data, window, min_periods or window)
+        assert result['dates'] == dates
+        for actual, reference in zip(result['betas'][str(window)], expected):
+            if reference is None:
+                assert actual is None
+            else:
+                assert actual == pytest.approx(reference, rel=1e-7)
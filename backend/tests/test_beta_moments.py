@@ -0,0 +1,180 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from services import beta_moments
+from services.beta_moments import (SUM_FIELDS, MomentUpdater, advance_moments, beta_from_moments, build_moments,
+                                   earliest_trade_dates, on_index_import, on_stock_import, state_from_document)
+from services.beta_store import publish_betas
+from services.price_store import INDEX_FIELDS, STOCK_FIELDS, build_series
+
+
+def make_history(days, seed=3):
+    """Stock bars with a few suspended days and the benchmark index of the same period"""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2022-01-03', periods=days)
+    index = 1000 * np.cumprod(1 + rng.normal(0, 0.01, days))
+    close = 20 * np.cumprod(1 + 1.3 * (np.r_[0, index[1:] / index[:-1] - 1]) + rng.normal(0, 0.01, days))
+    traded = rng.random(days) > 0.05
+    stocks = pd.DataFrame({'MarketCode': 'HOSE', 'Ticker': 'AAA', 'TradeDate': dates[traded]})
+    for field in STOCK_FIELDS:
+        stocks[field] = close[traded]
+    indexes = pd.DataFrame({'MarketCode': 'HSX', 'IndexCode': 'VNINDEX', 'TradeDate': dates})
+    for field in INDEX_FIELDS:
+        indexes[field] = index
+    return stocks, indexes
+
+
+def series_until(stocks, indexes, stock_days, index_days):
+    stock = build_series(stocks.iloc[:stock_days], 'Ticker', STOCK_FIELDS)[('HOSE', 'AAA')]
+    index = build_series(indexes.iloc[:index_days], 'IndexCode', INDEX_FIELDS)[('HSX', 'VNINDEX')]
+    return stock, index.dates.astype('datetime64[ns]'), index.daily_returns('CurrentIndex')
+
+
+def assert_same_state(advanced, rebuilt):
+    for field in ('window_start', 'window_end', 'market_last', 'stock_points', 'count'):
+        assert advanced[field] == rebuilt[field], field
+    for field in SUM_FIELDS:
+        assert advanced[field] == pytest.approx(rebuilt[field], rel=1e-9, abs=1e-12), field
+
+
+@pytest.mark.parametrize('new_days', [1, 5, 400])
+def test_advance_matches_rebuild(new_days):
+    stocks, indexes = make_history(700)
+    stock, market_dates, market_returns = series_until(stocks, indexes, 250, 260)
+    state = build_moments(stock, market_dates, market_returns)
+
+    stock, market_dates, market_returns = series_until(stocks, indexes, 250 + new_days, 260 + new_days)
+    advanced = advance_moments(state, stock, market_dates, market_returns)
+    rebuilt = build_moments(stock, market_dates, market_returns)
+
+    assert_same_state(advanced, rebuilt)
+    assert beta_from_moments(advanced, market_dates)['beta'] == pytest.approx(
+        beta_from_moments(rebuilt, market_dates)['beta'], rel=1e-9)
+
+
+def test_advance_completes_pairs_when_the_index_arrives_later():
+    stocks, indexes = make_history(400)
+    # Giá cổ phiếu được import trước chỉ số của cùng các phiên
+    stock, market_dates, market_returns = series_until(stocks, indexes, 300, 280)
+    state = build_moments(stock, market_dates, market_returns)
+
+    stock, market_dates, market_returns = series_until(stocks, indexes, 300, 330)
+    advanced = advance_moments(state, stock, market_dates, market_returns)
+
+    assert_same_state(advanced, build_moments(stock, market_dates, market_returns))
+
+
+def test_advance_refuses_data_moving_backwards():
+    stocks, indexes = make_history(300)
+    stock, market_dates, market_returns = series_until(stocks, indexes, 280, 300)
+    state = build_moments(stock, market_dates, market_returns)
+
+    stock, market_dates, market_returns = series_until(stocks, indexes, 270, 300)
+
+    assert advance_moments(state, stock, market_dates, market_returns) is None
+
+
+def import_rows(db, collection, frame, code_column='Ticker'):
+    """Insert rows as an import does (TradeDate as BSON dates) and return their earliest dates"""
+    rows = frame.assign(TradeDate=frame['TradeDate'].dt.to_pydatetime()).to_dict('records')
+    db[collection].insert_many(rows)
+    return earliest_trade_dates(frame, code_column)
+
+
+def assert_matches_full_history(db, stocks, indexes, stock_days, index_days):
+    stock, market_dates, market_returns = series_until(stocks, indexes, stock_days, index_days)
+    stored = state_from_document(db.beta_moments.find_one({'stock_code': 'HOSE:AAA'}))
+    assert_same_state(stored, build_moments(stock, market_dates, market_returns))
+    published = db.beta_values.find_one({'stock_code': 'HOSE:AAA', 'prediction_horizon': 5})
+    assert published['beta'] == pytest.approx(
+        beta_from_moments(build_moments(stock, market_dates, market_returns), market_dates)['beta'], rel=1e-9)
+
+
+@pytest.mark.parametrize('new_days', [1, 5, 400])
+def test_imports_advance_the_stored_state_like_a_rebuild(mongo_db, new_days):
+    stocks, indexes = make_history(700)
+    import_rows(mongo_db, 'market_index_data', indexes.iloc[:260], 'IndexCode')
+    on_stock_import(mongo_db, import_rows(mongo_db, 'stock_data', stocks.iloc[:250]))
+    assert_matches_full_history(mongo_db, stocks, indexes, 250, 260)
+
+    # Giá cổ phiếu đến trước, chỉ số của cùng các phiên đến sau
+    summary = on_stock_import(mongo_db, import_rows(mongo_db, 'stock_data', stocks.iloc[250:250 + new_days]))
+    assert summary['HOSE']['advanced'] == 1
+    summary = on_index_import(mongo_db, import_rows(mongo_db, 'market_index_data',
+                                                    indexes.iloc[260:260 + new_days], 'IndexCode'))
+    assert summary['HOSE']['advanced'] == 1
+
+    assert_matches_full_history(mongo_db, stocks, indexes, 250 + new_days, 260 + new_days)
+
+
+def test_corrected_past_bars_rebuild_the_state(mongo_db):
+    stocks, indexes = make_history(400)
+    import_rows(mongo_db, 'market_index_data', indexes, 'IndexCode')
+    on_stock_import(mongo_db, import_rows(mongo_db, 'stock_data', stocks.iloc[:300]))
+
+    # Phiên đã có được import lại với giá khác: bản ghi mới nhất được dùng
+    corrected = stocks.iloc[[290]].assign(ClosePrice=stocks['ClosePrice'].iloc[290] * 1.1)
+    summary = on_stock_import(mongo_db, import_rows(mongo_db, 'stock_data', corrected))
+
+    assert summary['HOSE']['rebuilt'] == 1
+    fixed = pd.concat([stocks.iloc[:290], corrected, stocks.iloc[291:300]], ignore_index=True)
+    assert_matches_full_history(mongo_db, fixed, indexes, 300, 400)
+
+
+def test_advance_reads_only_the_changed_days(mongo_db, monkeypatch):
+    stocks, indexes = make_history(700)
+    import_rows(mongo_db, 'market_index_data', indexes, 'IndexCode')
+    on_stock_import(mongo_db, import_rows(mongo_db, 'stock_data', stocks.iloc[:590]))
+
+    read = []
+    load_returns = beta_moments._load_returns
+
+    def counting_load_returns(collection, key, date_filter, field):
+        dates, returns = load_returns(collection, key, date_filter, field)
+        read.append((collection.name, len(dates)))
+        return dates, returns
+
+    monkeypatch.setattr(beta_moments, '_load_returns', counting_load_returns)
+    on_stock_import(mongo_db, import_rows(mongo_db, 'stock_data', stocks.iloc[590:592]))
+
+    # Cổ phiếu: vài phiên rời cửa sổ và hai phiên mới, không phải toàn bộ lịch sử
+    stock_rows = sum(count for name, count in read if name == 'stock_data')
+    assert 2 <= stock_rows <= 6
+    assert_matches_full_history(mongo_db, stocks, indexes, 592, 700)
+
+
+def test_publish_betas_refreshes_every_field_of_other_horizons(mongo_db):
+    mongo_db.beta_values.insert_one({
+        'stock_code': 'HOSE:AAA', 'market_code': 'HOSE', 'ticker': 'AAA', 'prediction_horizon': 10,
+        'beta': 0.7, 'date': '2024-01-02', 'data_points': 100, 'period_start': '2023-01-02',
+        'period_end': '2024-01-02', 'avg_stock_return': 0.1, 'avg_market_return': 0.2, 'calculation_window': 365,
+    })
+    record = {
+        'stock_code': 'HOSE:AAA', 'market_code': 'HOSE', 'ticker': 'AAA', 'prediction_horizon': 5,
+        'beta': 1.1, 'date': '2024-02-01', 'calculation_date': '2024-02-01 10:00:00', 'interpretation': 'x',
+        'data_points': 120, 'period_start': '2023-02-01', 'period_end': '2024-02-01', 'calculation_window': 365,
+        'avg_stock_return': 0.01, 'avg_market_return': 0.02,
+    }
+
+    publish_betas(mongo_db, [record])
+
+    other = mongo_db.beta_values.find_one({'prediction_horizon': 10}, {'_id': 0})
+    assert other == dict(record, prediction_horizon=10)
+
+
+def test_publish_betas_drops_statistics_the_new_record_lacks(mongo_db):
+    mongo_db.beta_values.insert_one({'stock_code': 'HOSE:AAA', 'prediction_horizon': 10, 'beta': 0.7,
+                                     'data_points': 100, 'period_start': '2023-01-02'})
+
+    publish_betas(mongo_db, [{'stock_code': 'HOSE:AAA', 'prediction_horizon': 5, 'beta': 1.1}])
+
+    other = mongo_db.beta_values.find_one({'prediction_horizon': 10}, {'_id': 0})
+    assert other == {'stock_code': 'HOSE:AAA', 'prediction_horizon': 10, 'beta': 1.1}
+
+
+@pytest.mark.parametrize('background', [True, False])
+def test_moment_updater_runs_submitted_updates(background):
+    updater = MomentUpdater(background=background)
+
+    assert updater.submit(sum, [1, 2, 3]).result(timeout=5) == 6
@@ -0,0 +1,55 @@
+import pandas as pd
+import pytest
+
+from services.db_indexes import ensure_indexes
+from services.svm_analysis import build_beta_lookup
+
+
+def test_beta_lookup_uses_the_latest_record_of_each_stock():
+    beta_values = pd.DataFrame([
+        {'stock_code': 'HOSE:AAA', 'prediction_horizon': 5, 'date': '2024-01-02', 'beta': 0.8},
+        {'stock_code': 'HOSE:AAA', 'prediction_horizon': 10, 'date': '2024-03-01', 'beta': 1.2},
+        {'stock_code': 'HOSE:BBB', 'prediction_horizon': 5, 'date': '2024-03-01', 'beta': 0.5},
+    ])
+
+    assert build_beta_lookup(beta_values) == {'HOSE:AAA': 1.2, 'HOSE:BBB': 0.5}
+
+
+def test_beta_values_key_is_unique(mongo_db):
+    ensure_indexes(mongo_db)
+    mongo_db.beta_values.insert_one({'stock_code': 'HOSE:AAA', 'prediction_horizon': 5, 'beta': 1.0})
+
+    with pytest.raises(Exception):
+        mongo_db.beta_values.insert_one({'stock_code': 'HOSE:AAA', 'prediction_horizon': 5, 'beta': 1.1})
+
+
+def test_duplicate_beta_values_keep_the_newest_record(mongo_db):
+    mongo_db.beta_values.insert_many([
+        {'stock_code': 'HOSE:AAA', 'prediction_horizon': 5, 'calculation_date': '2024-01-02 10:00:00', 'beta': 0.9},
+        {'stock_code': 'HOSE:AAA', 'prediction_horizon': 5, 'calculation_date': '2024-03-01 09:00:00', 'beta': 1.1},
+        {'stock_code': 'HOSE:AAA', 'prediction_horizon': 5, 'calculation_date': '2024-02-01 08:00:00', 'beta': 1.0},
+        {'stock_code': 'HOSE:AAA', 'prediction_horizon': 10, 'calculation_date': '2024-01-02 10:00:00', 'beta': 1.3},
+    ])
+
+    result = ensure_indexes(mongo_db)
+
+    assert result['deduplicated'] == {'beta_values': 2}
+    assert 'beta_values' not in result['failed']
+    assert sorted((row['prediction_horizon'], row['beta']) for row in mongo_db.beta_values.find()) == \
+        [(5, 1.1), (10, 1.3)]
+    with pytest.raises(Exception):
+        mongo_db.beta_values.insert_one({'stock_code': 'HOSE:AAA', 'prediction_horizon': 10, 'beta': 1.0})
+
+
+def test_duplicate_key_failure_is_reported(mongo_db, monkeypatch):
+    import services.db_indexes as db_indexes
+
+    # Không dọn dữ liệu: index unique gặp bản ghi trùng khóa
+    monkeypatch.setattr(db_indexes, 'DEDUPLICATED_KEYS', [])
+    mongo_db.beta_values.insert_many([{'stock_code': 'HOSE:AAA', 'prediction_horizon': 5, 'beta': 1.0},
+                                      {'stock_code': 'HOSE:AAA', 'prediction_horizon': 5, 'beta': 1.1}])
+
+    result = ensure_indexes(mongo_db)
+
+    message = result['failed']['beta_values']['stock_code_1_prediction_horizon_1']
+    assert message.startswith('Duplicate keys, unique index not created')
@@ -0,0 +1,121 @@
+import io
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from services.data_import import (STOCK_NUMERIC_FIELDS, iter_file_chunks, migrate_trade_dates, normalize_trade_date,
+                                  normalize_trade_dates, stream_import)
+
+HEADER = ['MarketCode', 'Ticker', 'TradeDate', 'OpenPrice', 'HighestPrice', 'LowestPrice', 'ClosePrice',
+          'TotalVolume']
+ROWS = [
+    ['HOSE', 'AAA', '2024-01-02', '10.5', '11', '10', '10.8', '1,200'],
+    ['HOSE', 'AAA', '2024/01/03', '10.8', '11.2', '10.6', '11.1', '900'],
+    ['HOSE', 'BBB', '01/04/2024', '20', '20.5', '19.5', '20.1', '3000'],
+    ['HNX', 'CCC', '2024-01-05', '5', '5.2', '4.9', '5.1', '150'],
+    ['HNX', 'CCC', '2024-01-08', '5.1', '5.3', '5', '5.2', '170'],
+]
+
+
+def csv_file():
+    lines = [','.join(HEADER)] + [','.join(f'"{value}"' for value in row) for row in ROWS]
+    return io.BytesIO('\n'.join(lines).encode('utf-8'))
+
+
+def xlsx_file():
+    from openpyxl import Workbook
+
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(HEADER)
+    for row in ROWS:
+        sheet.append(row)
+    stream = io.BytesIO()
+    workbook.save(stream)
+    stream.seek(0)
+    return stream
+
+
+def imported_rows(db, file_name, stream, chunk_size):
+    db.stock_data.delete_many({})
+    import_id = db.imports.insert_one({'status': 'processing'}).inserted_id
+    market_codes = set()
+    count, _, _, _ = stream_import(db, 'stock_data', 'imports', import_id,
+                                iter_file_chunks(file_name, stream, chunk_size), STOCK_NUMERIC_FIELDS, market_codes)
+    rows = [{key: value for key, value in row.items() if key not in ('_id', 'import_id')}
+            for row in db.stock_data.find()]
+    return count, market_codes, rows, db.imports.find_one({'_id': import_id})
+
+
+@pytest.mark.parametrize('file_name, make_file', [('prices.csv', csv_file), ('prices.xlsx', xlsx_file)])
+def test_chunked_import_matches_a_single_chunk(mongo_db, file_name, make_file):
+    count, market_codes, chunked, record = imported_rows(mongo_db, file_name, make_file(), 2)
+    _, _, whole, _ = imported_rows(mongo_db, file_name, make_file(), 1000)
+
+    assert count == len(ROWS)
+    assert market_codes == {'HOSE', 'HNX'}
+    assert record['status'] == 'completed' and record['records_count'] == len(ROWS)
+    assert chunked == whole
+    assert chunked[0]['TotalVolume'] == 1200
+    assert chunked[2]['TradeDate'] == datetime(2024, 1, 4)
+
+
+def test_csv_and_xlsx_give_the_same_rows(mongo_db):
+    assert imported_rows(mongo_db, 'prices.csv', csv_file(), 2)[2] == \
+        imported_rows(mongo_db, 'prices.xlsx', xlsx_file(), 2)[2]
+
+
+def test_failed_import_still_reports_the_markets_written(mongo_db):
+    def chunks():
+        yield from iter_file_chunks('prices.csv', csv_file(), 2)
+        raise ValueError('broken file')
+
+    import_id = ObjectId()
+    market_codes, earliest_dates = set(), {}
+    with pytest.raises(ValueError):
+        stream_import(mongo_db, 'stock_data', 'imports', import_id, chunks(), STOCK_NUMERIC_FIELDS, market_codes,
+                      earliest_dates)
+
+    assert market_codes == {'HOSE', 'HNX'}
+    assert set(earliest_dates) == {('HOSE', 'AAA'), ('HOSE', 'BBB'), ('HNX', 'CCC')}
+    assert mongo_db.stock_data.count_documents({}) == len(ROWS)
+
+
+def test_batch_dates_match_per_value_parsing():
+    values = ['2024-01-02', ' 2024-01-03', '2024/01/04', '01/05/2024', '25/01/2024', '2024-01-02', 'not a date',
+              datetime(2024, 1, 8), None, 20240109]
+
+    assert list(normalize_trade_dates(values)) == [normalize_trade_date(value) for value in values]
+
+
+def test_ambiguous_dates_are_not_read_with_the_batch_format():
+    # Lô chủ yếu là ngày/tháng/năm; '01/04/2024' khớp cả hai định dạng tháng/ngày và ngày/tháng
+    values = ['13/01/2024', '25/01/2024', '30/01/2024', '31/01/2024', '01/04/2024', '02/03/2024', '12/12/2024']
+
+    result = list(normalize_trade_dates(values))
+
+    assert result == [normalize_trade_date(value) for value in values]
+    assert result[4] == datetime(2024, 1, 4) and result[5] == datetime(2024, 2, 3)
+    assert result[0] == datetime(2024, 1, 13) and result[6] == datetime(2024, 12, 12)
+
+
+def test_migration_converts_only_string_dates(mongo_db):
+    mongo_db.stock_data.insert_many([
+        {'Ticker': 'AAA', 'TradeDate': '2024-01-02'},
+        {'Ticker': 'AAA', 'TradeDate': '01/03/2024'},
+        {'Ticker': 'AAA', 'TradeDate': datetime(2024, 1, 4)},
+        {'Ticker': 'AAA', 'TradeDate': 'unknown'},
+    ])
+
+    result = migrate_trade_dates(mongo_db, 'stock_data', batch_size=2)
+
+    assert result == {'converted': 2, 'unparsed': 1}
+    assert [row['TradeDate'] for row in mongo_db.stock_data.find().sort('_id', 1)] == \
+        [datetime(2024, 1, 2), datetime(2024, 1, 3), datetime(2024, 1, 4), 'unknown']
+    assert migrate_trade_dates(mongo_db, 'stock_data') == {'converted': 0, 'unparsed': 1}
+
+
+def test_unsupported_extension_is_rejected():
+    with pytest.raises(ValueError):
+        iter_file_chunks('prices.txt', io.BytesIO(b''))
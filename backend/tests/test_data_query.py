@@ -0,0 +1,60 @@
+from datetime import datetime
+
+from werkzeug.datastructures import MultiDict
+
+from services.data_query import build_query, decode_cursor, encode_cursor, find_page
+
+
+def read_all_pages(collection, args, limit):
+    rows, cursor = [], None
+    while True:
+        page_args = MultiDict(args)
+        if cursor:
+            page_args['after'] = cursor
+        page, cursor = find_page(collection, build_query(page_args, 'Ticker'), ['Ticker', 'TradeDate'], limit)
+        rows.extend(page)
+        if cursor is None:
+            return rows
+
+
+def test_cursor_keeps_trade_date_type():
+    document = {'_id': '0123456789abcdef01234567', 'TradeDate': '2024-01-02'}
+    assert decode_cursor(encode_cursor(document))[0] == '2024-01-02'
+
+    document['TradeDate'] = datetime(2024, 1, 2)
+    assert decode_cursor(encode_cursor(document))[0] == datetime(2024, 1, 2)
+
+
+def test_pages_through_string_dated_rows(mongo_db):
+    mongo_db.stock_data.insert_many([
+        {'MarketCode': 'HOSE', 'Ticker': 'AAA', 'TradeDate': f'2024-01-0{day}'} for day in range(1, 6)
+    ])
+
+    rows = read_all_pages(mongo_db.stock_data, {'market_code': 'HOSE'}, limit=2)
+
+    assert [row['TradeDate'] for row in rows] == [f'2024-01-0{day}' for day in range(1, 6)]
+
+
+def test_pages_through_mixed_string_and_date_rows(mongo_db):
+    mongo_db.stock_data.insert_many(
+        [{'Ticker': 'AAA', 'TradeDate': f'2024-01-0{day}'} for day in range(1, 4)]
+        + [{'Ticker': 'AAA', 'TradeDate': datetime(2024, 1, day)} for day in range(4, 7)]
+    )
+
+    rows = read_all_pages(mongo_db.stock_data, {}, limit=2)
+
+    assert len(rows) == 6
+    assert [row['TradeDate'] for row in rows[3:]] == [datetime(2024, 1, day) for day in range(4, 7)]
+
+
+def test_date_range_matches_string_and_date_rows(mongo_db):
+    mongo_db.stock_data.insert_many([
+        {'Ticker': 'AAA', 'TradeDate': '2024-01-02'},
+        {'Ticker': 'AAA', 'TradeDate': '2024-01-09'},
+        {'Ticker': 'AAA', 'TradeDate': datetime(2024, 1, 3)},
+        {'Ticker': 'AAA', 'TradeDate': datetime(2024, 1, 10)},
+    ])
+
+    rows = read_all_pages(mongo_db.stock_data, {'from': '2024-01-02', 'to': '2024-01-05'}, limit=10)
+
+    assert [row['TradeDate'] for row in rows] == ['2024-01-02', datetime(2024, 1, 3)]
@@ -0,0 +1,25 @@
+import numpy as np
+
+from services import feature_store
+from services.feature_store import FeatureStore, make_feature_key
+from services.svm_analysis import FEATURE_COLUMNS
+
+
+def test_key_changes_with_the_feature_schema(monkeypatch):
+    key = make_feature_key('HOSE:AAA', 'v1', FEATURE_COLUMNS)
+
+    assert make_feature_key('HOSE:AAA', 'v1', FEATURE_COLUMNS) == key
+    assert make_feature_key('HOSE:AAA', 'v1', FEATURE_COLUMNS[:-1]) != key
+    assert make_feature_key('HOSE:AAA', 'v1', FEATURE_COLUMNS[::-1]) != key
+    monkeypatch.setattr(feature_store, 'FEATURE_SCHEMA_VERSION', feature_store.FEATURE_SCHEMA_VERSION + 1)
+    assert make_feature_key('HOSE:AAA', 'v1', FEATURE_COLUMNS) != key
+
+
+def test_matrices_of_an_older_schema_are_not_served(tmp_path, monkeypatch):
+    store = FeatureStore(str(tmp_path))
+    dates = np.array(['2024-01-02'], dtype='datetime64[ns]')
+    store.put(make_feature_key('HOSE:AAA', 'v1', FEATURE_COLUMNS), dates, np.ones((1, len(FEATURE_COLUMNS))))
+
+    monkeypatch.setattr(feature_store, 'FEATURE_SCHEMA_VERSION', feature_store.FEATURE_SCHEMA_VERSION + 1)
+
+    assert store.get(make_feature_key('HOSE:AAA', 'v1', FEATURE_COLUMNS)) is None
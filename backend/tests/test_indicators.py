@@ -0,0 +1,149 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from services.indicators import INDICATOR_COLUMNS, IndicatorEngine, IndicatorState
+from services.price_store import PriceStore
+from services.svm_analysis import calculate_technical_indicators
+
+
+def make_bars(days, seed=5):
+    """Daily bars of one ticker with a few missing closes"""
+    rng = np.random.default_rng(seed)
+    close = 50 * np.cumprod(1 + rng.normal(0, 0.02, days))
+    close[rng.random(days) < 0.03] = np.nan
+    return pd.DataFrame({
+        'MarketCode': 'HOSE',
+        'Ticker': 'AAA',
+        'TradeDate': pd.bdate_range('2023-01-02', periods=days),
+        'OpenPrice': close,
+        'HighestPrice': close * 1.01,
+        'LowestPrice': close * 0.99,
+        'ClosePrice': close,
+        'TotalVolume': np.round(rng.lognormal(10, 1, days)),
+    })
+
+
+def assert_matches(values, expected):
+    for column in INDICATOR_COLUMNS:
+        if np.isnan(expected[column]):
+            assert values[column] is None or np.isnan(values[column]), column
+        else:
+            assert values[column] == pytest.approx(expected[column], rel=1e-9), column
+
+
+def test_stream_matches_calculate_technical_indicators():
+    bars = make_bars(120)
+    expected = calculate_technical_indicators(bars)
+
+    state = IndicatorState()
+    for i, bar in enumerate(bars.itertuples(index=False)):
+        values = state.update(np.datetime64(bar.TradeDate, 'ns'), bar.HighestPrice, bar.LowestPrice,
+                              bar.ClosePrice, bar.TotalVolume)
+        assert_matches(values, expected.iloc[i])
+
+
+def test_replaced_bar_matches_the_batch_result():
+    bars = make_bars(60)
+    expected = calculate_technical_indicators(bars)
+
+    state = IndicatorState()
+    for bar in bars.itertuples(index=False):
+        trade_date = np.datetime64(bar.TradeDate, 'ns')
+        # Cập nhật trong phiên rồi giá đóng cửa cuối cùng của cùng phiên
+        state.update(trade_date, bar.HighestPrice, bar.LowestPrice, bar.ClosePrice * 1.05, 1.0)
+        values = state.update(trade_date, bar.HighestPrice, bar.LowestPrice, bar.ClosePrice, bar.TotalVolume)
+    assert_matches(values, expected.iloc[-1])
+
+
+def test_pushed_bars_survive_a_restart_and_reach_other_workers(mongo_db):
+    bars = make_bars(80)
+    mongo_db.stock_data.insert_many(bars.iloc[:50].to_dict('records'))
+    expected = calculate_technical_indicators(bars)
+
+    pushed = bars.iloc[50:].copy()
+    pushed['TradeDate'] = [date.to_pydatetime() for date in pushed['TradeDate']]
+    first = IndicatorEngine(PriceStore(mongo_db))
+    results = first.push(pushed.iloc[:20].to_dict('records'))
+    assert all('error' not in result for result in results)
+    assert_matches(results[-1], expected.iloc[69])
+
+    # Một tiến trình khác (hoặc sau khi khởi động lại) thấy các phiên đã được đẩy
+    second = IndicatorEngine(PriceStore(mongo_db))
+    latest = second.latest('HOSE', 'AAA')
+    assert latest['TradeDate'] == pushed['TradeDate'].iloc[19]
+    assert_matches(latest, expected.iloc[69])
+
+    results = second.push(pushed.iloc[20:].to_dict('records'))
+    assert_matches(results[-1], expected.iloc[-1])
+    assert_matches(first.latest('HOSE', 'AAA'), expected.iloc[-1])
+
+
+def test_repeated_corrections_match_a_fresh_replay():
+    bars = make_bars(60)
+    state, replayed = IndicatorState(), IndicatorState()
+    for bar in bars.itertuples(index=False):
+        trade_date = np.datetime64(bar.TradeDate, 'ns')
+        for factor in (1.02, 0.97, 1.0):
+            values = state.update(trade_date, bar.HighestPrice, bar.LowestPrice, bar.ClosePrice * factor,
+                                  bar.TotalVolume * factor)
+        expected = replayed.update(trade_date, bar.HighestPrice, bar.LowestPrice, bar.ClosePrice, bar.TotalVolume)
+        assert values['signals'] == expected['signals']
+        assert_matches(values, expected)
+    assert state.bars == replayed.bars == len(bars)
+
+
+def pushed_bars(bars):
+    bars = bars.copy()
+    bars['TradeDate'] = [date.to_pydatetime() for date in bars['TradeDate']]
+    return bars.to_dict('records')
+
+
+def test_push_writes_its_bars_in_one_bulk_write(mongo_db, monkeypatch):
+    bars = make_bars(60)
+    mongo_db.stock_data.insert_many(bars.iloc[:40].to_dict('records'))
+    engine = IndicatorEngine(PriceStore(mongo_db))
+
+    writes = []
+    collection = type(mongo_db.stream_bars)
+    bulk_write = collection.bulk_write
+    monkeypatch.setattr(collection, 'bulk_write', lambda self, requests, **kwargs: (
+        writes.append(len(requests)), bulk_write(self, requests, **kwargs))[1])
+    monkeypatch.setattr(collection, 'update_one', lambda *args, **kwargs: pytest.fail('per-bar write'))
+
+    # Phiên cuối được sửa ngay trong cùng lần đẩy
+    batch = pushed_bars(bars.iloc[40:])
+    batch.append(dict(batch[-1], ClosePrice=batch[-1]['ClosePrice'] * 1.1))
+    results = engine.push(batch)
+
+    assert writes == [len(batch)]
+    assert mongo_db.stream_bars.count_documents({}) == 20
+    corrected = bars.copy()
+    corrected.loc[corrected.index[-1], 'ClosePrice'] *= 1.1
+    assert_matches(results[-1], calculate_technical_indicators(corrected).iloc[-1])
+
+
+def test_catch_up_reads_only_the_newest_bar_when_current(mongo_db, monkeypatch):
+    bars = make_bars(60)
+    mongo_db.stock_data.insert_many(bars.iloc[:40].to_dict('records'))
+    expected = calculate_technical_indicators(bars)
+    engine, other = IndicatorEngine(PriceStore(mongo_db)), IndicatorEngine(PriceStore(mongo_db))
+    engine.push(pushed_bars(bars.iloc[40:59]))
+    other.latest('HOSE', 'AAA')
+
+    reads = []
+    collection = type(mongo_db.stream_bars)
+    find = collection.find
+    monkeypatch.setattr(collection, 'find', lambda self, *args, **kwargs: (
+        reads.append(args), find(self, *args, **kwargs))[1])
+    results = engine.push(pushed_bars(bars.iloc[59:]))
+    # Chỉ đọc phiên mới nhất (find_one), không phát lại các phiên đã thấy
+    assert len(reads) == 1
+    assert_matches(results[-1], expected.iloc[-1])
+    monkeypatch.undo()
+
+    # Phiên cuối được sửa ở tiến trình khác: chỉ phiên đó được áp dụng lại
+    corrected = bars.copy()
+    corrected.loc[corrected.index[-1], 'ClosePrice'] *= 0.9
+    other.push(pushed_bars(corrected.iloc[59:]))
+    assert_matches(engine.latest('HOSE', 'AAA'), calculate_technical_indicators(corrected).iloc[-1])
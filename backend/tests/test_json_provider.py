@@ -0,0 +1,62 @@
+import json
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+from bson import ObjectId
+from flask import Flask
+
+from services.json_provider import AppJSONProvider, records_to_columns
+
+pytest.importorskip('orjson')
+
+PAYLOAD = {
+    '_id': ObjectId('65a1b2c3d4e5f60718293a4b'),
+    'TradeDate': datetime(2024, 1, 2),
+    'calculation_date': datetime(2024, 1, 2, 15, 30, 5),
+    'period_start': date(2023, 6, 1),
+    'beta': float('nan'),
+    'ratios': [1.5, float('inf'), -float('inf'), None],
+    'np_values': {'count': np.int64(7), 'mean': np.float64('nan'), 'small': np.float32(0.5)},
+    'matrix': np.array([[1.0, np.nan], [2.0, 3.0]]),
+    'labels': np.array([-1, 0, 1]),
+    'dates': np.array(['2024-01-02T00:00:00', '2024-01-03T12:00:00'], dtype='datetime64[s]'),
+    'predictions': [{'stock_code': 'HOSE:AAA', 'confidence': np.float64(0.75), 'date': pd.Timestamp('2024-01-05')}],
+}
+
+
+@pytest.fixture
+def json_app():
+    # Provider chỉ giữ weakref tới app nên app phải sống suốt test
+    return Flask(__name__)
+
+
+def test_orjson_and_stdlib_write_the_same_json(json_app):
+    fast, stdlib = AppJSONProvider(json_app, fast=True), AppJSONProvider(json_app, fast=False)
+
+    fast_json, stdlib_json = fast.dumps(PAYLOAD), stdlib.dumps(PAYLOAD)
+
+    assert json.loads(fast_json) == json.loads(stdlib_json)
+    assert 'NaN' not in stdlib_json and 'Infinity' not in stdlib_json
+
+
+@pytest.mark.parametrize('fast', [True, False])
+def test_values_keep_the_previous_formats(json_app, fast):
+    result = json.loads(AppJSONProvider(json_app, fast=fast).dumps(PAYLOAD))
+
+    assert result['_id'] == '65a1b2c3d4e5f60718293a4b'
+    assert result['TradeDate'] == '2024-01-02'
+    assert result['calculation_date'] == '2024-01-02T15:30:05'
+    assert result['period_start'] == '2023-06-01'
+    assert result['beta'] is None
+    assert result['ratios'] == [1.5, None, None, None]
+    assert result['matrix'] == [[1.0, None], [2.0, 3.0]]
+    assert result['predictions'][0]['date'] == '2024-01-05'
+
+
+def test_records_to_columns():
+    records = [{'stock_code': 'HOSE:AAA', 'prediction': 1}, {'stock_code': 'HOSE:BBB', 'prediction': -1}]
+
+    assert records_to_columns(records) == {'stock_code': ['HOSE:AAA', 'HOSE:BBB'], 'prediction': [1, -1]}
+    assert records_to_columns([]) == {}
@@ -0,0 +1,28 @@
+def bar(ticker, trade_date, close):
+    return {'MarketCode': 'HOSE', 'Ticker': ticker, 'TradeDate': trade_date, 'OpenPrice': close - 1,
+            'HighestPrice': close + 1, 'LowestPrice': close - 2, 'ClosePrice': close, 'TotalVolume': 100}
+
+
+def test_partial_import_backfills_tickers_imported_before_the_snapshot(flask_app, client):
+    # Dữ liệu cũ được ghi trước khi có latest_snapshot
+    flask_app.db.stock_data.insert_many([bar('AAA', '2024-01-02', 10.0), bar('BBB', '2024-01-02', 20.0)])
+
+    response = client.post('/api/import-data', json={'data': [bar('CCC', '2024-01-02', 30.0)]})
+    assert response.status_code == 201
+
+    rows = client.get('/api/stock-data-asset?market_code=HOSE').get_json()
+
+    assert [row['Ticker'] for row in rows] == ['AAA', 'BBB', 'CCC', 'NAV']
+    assert rows[-1]['ClosePrice'] == 60.0
+
+
+def test_snapshot_is_rebuilt_only_once(flask_app, client):
+    client.post('/api/import-data', json={'data': [bar('AAA', '2024-01-02', 10.0)]})
+    client.get('/api/stock-data-asset?market_code=HOSE')
+    assert flask_app.db.market_nav.find_one({'MarketCode': 'HOSE'})['snapshot_built'] is True
+
+    client.post('/api/import-data', json={'data': [bar('AAA', '2024-01-03', 12.0)]})
+    nav = flask_app.db.market_nav.find_one({'MarketCode': 'HOSE'})
+
+    assert nav['snapshot_built'] is True
+    assert nav['ClosePrice'] == 12.0
@@ -0,0 +1,49 @@
+from services.metrics import MetricsRegistry, clear_metrics_dir
+
+
+def make_registry(directory):
+    registry = MetricsRegistry(directory)
+    requests = registry.counter('http_requests_total', 'Requests', ('endpoint',))
+    latency = registry.histogram('http_request_duration_seconds', 'Latency', ('endpoint',), (0.1, 1.0))
+    return registry, requests, latency
+
+
+def test_render_adds_up_the_snapshots_of_every_process(tmp_path):
+    # Hai registry cùng thư mục đóng vai hai worker
+    first, first_requests, first_latency = make_registry(str(tmp_path))
+    second, second_requests, second_latency = make_registry(str(tmp_path))
+    first_requests.inc(('bars',), 2)
+    first_latency.observe(('bars',), 0.05)
+    second_requests.inc(('bars',))
+    second_requests.inc(('indicators',))
+    second_latency.observe(('bars',), 0.5)
+    second.flush()
+
+    lines = first.render().splitlines()
+
+    assert 'http_requests_total{endpoint="bars"} 3' in lines
+    assert 'http_requests_total{endpoint="indicators"} 1' in lines
+    assert 'http_request_duration_seconds_bucket{endpoint="bars",le="0.1"} 1' in lines
+    assert 'http_request_duration_seconds_bucket{endpoint="bars",le="1.0"} 2' in lines
+    assert 'http_request_duration_seconds_count{endpoint="bars"} 2' in lines
+    assert 'http_request_duration_seconds_sum{endpoint="bars"} 0.55' in lines
+
+
+def test_without_a_directory_only_this_process_is_reported(tmp_path):
+    other, other_requests, _ = make_registry(str(tmp_path))
+    other_requests.inc(('bars',), 5)
+    other.flush()
+    local, local_requests, _ = make_registry(None)
+    local_requests.inc(('bars',))
+
+    assert 'http_requests_total{endpoint="bars"} 1' in local.render().splitlines()
+
+
+def test_clear_metrics_dir_removes_previous_snapshots(tmp_path):
+    registry, requests, _ = make_registry(str(tmp_path))
+    requests.inc(('bars',))
+    registry.flush()
+
+    clear_metrics_dir(str(tmp_path))
+
+    assert list(tmp_path.iterdir()) == []
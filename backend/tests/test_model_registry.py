@@ -0,0 +1,40 @@
+from services import svm_analysis
+from services.model_registry import ModelRegistry, make_model_key
+from test_svm_analysis import make_stocks
+
+
+def test_model_is_reused_until_the_data_version_changes(tmp_path, monkeypatch):
+    trained = []
+    train = svm_analysis.train_svm_model
+
+    def counting_train(*args, **kwargs):
+        trained.append(args[2] if len(args) > 2 else kwargs.get('days_to_predict'))
+        return train(*args, **kwargs)
+
+    monkeypatch.setattr(svm_analysis, 'train_svm_model', counting_train)
+    registry = ModelRegistry(str(tmp_path))
+    stock_data = make_stocks()
+
+    def analyze(data_version):
+        key = make_model_key('HOSE', ['AAA', 'BBB', 'CCC'], 5, data_version)
+        return svm_analysis.analyze_stocks_with_svm(stock_data, None, 5, registry=registry, model_key=key)
+
+    first = analyze('v1')
+    again = analyze('v1')
+    after_import = analyze('v2')
+
+    assert [first['model_cached'], again['model_cached'], after_import['model_cached']] == [False, True, False]
+    assert len(trained) == 2
+    assert again['predictions'] == first['predictions']
+    assert again['model_metrics'] == first['model_metrics']
+
+
+def test_entry_is_not_served_for_other_training_data(tmp_path):
+    registry = ModelRegistry(str(tmp_path))
+    key = make_model_key('HOSE', ['AAA', 'BBB', 'CCC'], 5, 'v1')
+    svm_analysis.analyze_stocks_with_svm(make_stocks(), None, 5, registry=registry, model_key=key)
+
+    # Cùng khóa nhưng dữ liệu khác (dấu vân tay khác) thì phải huấn luyện lại
+    result = svm_analysis.analyze_stocks_with_svm(make_stocks(seed=8), None, 5, registry=registry, model_key=key)
+
+    assert result['model_cached'] is False
@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from services.portfolio_risk import covariance_stats, parse_portfolio, risk_decomposition
+
+
+class ListingStore:
+    """Minimal stand-in exposing the market and ticker listings of PriceStore"""
+
+    def __init__(self, listings):
+        self.listings = listings
+
+    def market_codes(self):
+        return sorted(self.listings)
+
+    def ticker_list(self, market_code):
+        return self.listings.get(market_code, [])
+
+
+def make_aligned(days=120, stocks=4, seed=1):
+    rng = np.random.default_rng(seed)
+    market_returns = rng.normal(0, 0.01, days)
+    returns = 0.8 * market_returns[:, None] + rng.normal(0, 0.01, (days, stocks))
+    returns[rng.random((days, stocks)) < 0.1] = np.nan
+    return {
+        'dates': np.arange(days),
+        'returns': returns,
+        'market_returns': market_returns,
+        'stock_points': np.full(stocks, days),
+        'found': np.ones(stocks, dtype=bool),
+    }
+
+
+def test_covariance_matches_pairwise_dataframe_cov():
+    aligned = make_aligned()
+
+    stats = covariance_stats(aligned)
+
+    expected = pd.DataFrame(aligned['returns']).cov().to_numpy()
+    np.testing.assert_allclose(stats['covariance'], expected, rtol=1e-10)
+
+
+def test_betas_use_the_get_beta_for_stock_estimator():
+    aligned = make_aligned()
+
+    stats = covariance_stats(aligned)
+
+    for column in range(aligned['returns'].shape[1]):
+        valid = ~np.isnan(aligned['returns'][:, column])
+        stock = aligned['returns'][valid, column]
+        market = aligned['market_returns'][valid]
+        expected = np.cov(stock, market, ddof=1)[0, 1] / np.var(market, ddof=0)
+        assert stats['betas'][column] == pytest.approx(expected, rel=1e-10)
+        assert stats['data_points'][column] == valid.sum()
+
+
+def test_risk_contributions_add_up_to_the_volatility():
+    stats = covariance_stats(make_aligned())
+    stats['errors'][3] = 'No data found for stock code'
+    weights = np.array([2.0, 1.0, 1.0, 5.0])
+
+    risk = risk_decomposition(stats, weights)
+
+    shares = np.array([0.5, 0.25, 0.25])
+    covariance = stats['covariance'][:3, :3]
+    assert risk['valid'].tolist() == [True, True, True, False]
+    np.testing.assert_allclose(risk['shares'], shares)
+    assert risk['volatility'] == pytest.approx(np.sqrt(shares @ covariance @ shares))
+    assert risk['contributions'].sum() == pytest.approx(risk['volatility'])
+    assert risk['portfolio_beta'] == pytest.approx(shares @ stats['betas'][:3])
+
+
+def test_no_valid_holding_gives_no_decomposition():
+    stats = covariance_stats(make_aligned(stocks=2))
+    stats['errors'] = ['No data found for stock code'] * 2
+
+    assert risk_decomposition(stats, np.array([1.0, 1.0])) is None
+
+
+def test_bare_ticker_is_resolved_from_the_price_store():
+    store = ListingStore({'HOSE': ['AAA', 'BBB'], 'HNX': ['BBB', 'CCC']})
+
+    holdings, errors = parse_portfolio({'AAA': 1, 'CCC': 2, 'HNX:AAA': 3}, store=store)
+
+    assert holdings == [('HOSE', 'AAA', 1.0), ('HNX', 'CCC', 2.0), ('HNX', 'AAA', 3.0)]
+    assert errors == []
+
+
+def test_ambiguous_or_unknown_bare_ticker_is_reported():
+    store = ListingStore({'HOSE': ['AAA', 'BBB'], 'HNX': ['BBB']})
+
+    holdings, errors = parse_portfolio({'BBB': 1, 'ZZZ': 1, 'AAA': 1}, store=store)
+
+    assert holdings == [('HOSE', 'AAA', 1.0)]
+    assert [error['stock_code'] for error in errors] == ['BBB', 'ZZZ']
+    assert 'HNX, HOSE' in errors[0]['error']
+
+
+def test_market_code_applies_to_bare_tickers():
+    holdings, errors = parse_portfolio({'AAA': '0.5'}, market_code='HOSE')
+
+    assert holdings == [('HOSE', 'AAA', 0.5)]
+    assert errors == []
@@ -0,0 +1,28 @@
+import warnings
+from datetime import datetime
+
+import numpy as np
+
+from services.price_store import PriceStore
+
+
+def test_string_and_bson_dates_load_without_warnings(mongo_db):
+    # Chuỗi của các lần import cũ nằm lẫn với BSON date
+    mongo_db.stock_data.insert_many([
+        {'MarketCode': 'HOSE', 'Ticker': 'AAA', 'TradeDate': datetime(2024, 1, 2), 'ClosePrice': 10.0,
+         'import_id': 'b'},
+        {'MarketCode': 'HOSE', 'Ticker': 'AAA', 'TradeDate': '2024-01-03', 'ClosePrice': '10.5', 'import_id': 'a'},
+        {'MarketCode': 'HOSE', 'Ticker': 'AAA', 'TradeDate': '2024/01/04', 'ClosePrice': 11.0, 'import_id': 'a'},
+        {'MarketCode': 'HOSE', 'Ticker': 'AAA', 'TradeDate': '15/01/2024', 'ClosePrice': 11.5, 'import_id': 'a'},
+        {'MarketCode': 'HOSE', 'Ticker': 'AAA', 'TradeDate': 'unknown', 'ClosePrice': 12.0, 'import_id': 'a'},
+        {'MarketCode': 'HOSE', 'Ticker': 'BBB', 'TradeDate': datetime(2024, 1, 2), 'OpenPrice': 5.0},
+    ])
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        series = PriceStore(mongo_db).get_stocks('HOSE')
+
+    aaa = series['AAA']
+    assert list(aaa.dates.astype(str)) == ['2024-01-02', '2024-01-03', '2024-01-04', '2024-01-15']
+    assert list(aaa['ClosePrice']) == [10.0, 10.5, 11.0, 11.5]
+    assert np.isnan(series['BBB']['ClosePrice']).all()
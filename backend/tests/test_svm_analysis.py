@@ -0,0 +1,146 @@
+import base64
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import SVC
+
+from services.svm_analysis import (calculate_technical_indicators, get_prediction_label, get_prediction_labels,
+                                   get_svm_n_jobs, plot_confidence_distribution, plot_confusion_matrix,
+                                   predict_stock_movement, predict_stock_movements, prepare_features)
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def make_stocks(days=120, seed=7):
+    """OHLCV bars of three tickers, TradeDate as 'YYYY-MM-DD' strings"""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2023-01-02', periods=days).strftime('%Y-%m-%d')
+    frames = []
+    for ticker in ['AAA', 'BBB', 'CCC']:
+        close = 40 * np.cumprod(1 + rng.normal(0, 0.02, days))
+        frames.append(pd.DataFrame({
+            'MarketCode': 'HOSE',
+            'Ticker': ticker,
+            'TradeDate': dates,
+            'OpenPrice': close,
+            'HighestPrice': close * 1.01,
+            'LowestPrice': close * 0.99,
+            'ClosePrice': close,
+            'TotalVolume': np.round(rng.lognormal(10, 1, days)),
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def baseline_prepare_features(stock_data, beta_values, days_to_predict=5):
+    """Reference: the row-by-row (iloc) loop prepare_features replaced"""
+    df = stock_data.copy()
+    df['TradeDate'] = pd.to_datetime(df['TradeDate'])
+    df = df.sort_values(['MarketCode', 'Ticker', 'TradeDate'])
+    threshold_pct = 0.5 if days_to_predict <= 2 else 1.0
+
+    all_features, all_targets, all_stock_codes, all_dates = [], [], [], []
+    for code, group in df.groupby(['MarketCode', 'Ticker']):
+        if len(group) < 10:
+            continue
+        stock_code = ':'.join(code)
+        beta_value = None
+        if beta_values is not None:
+            beta_row = beta_values[beta_values['stock_code'] == stock_code]
+            if not beta_row.empty:
+                beta_value = beta_row.iloc[0]['beta']
+
+        group = calculate_technical_indicators(group).dropna()
+        for i in range(len(group) - days_to_predict):
+            current_data = group.iloc[i]
+            features = [current_data[column] for column in ['ClosePrice', 'rsi_14', 'macd', 'macd_signal',
+                                                            'upper_band', 'lower_band', 'obv', 'atr_14',
+                                                            'volatility_20']]
+            if beta_value is not None:
+                features.append(beta_value)
+            future_price = float(group.iloc[i + days_to_predict]['ClosePrice'])
+            current_price = float(current_data['ClosePrice'])
+            percent_change = (future_price - current_price) / current_price * 100
+            if percent_change > threshold_pct:
+                target = 1
+            elif percent_change < -threshold_pct:
+                target = -1
+            else:
+                target = 0
+            all_features.append(features)
+            all_targets.append(target)
+            all_stock_codes.append(stock_code)
+            all_dates.append(current_data['TradeDate'])
+    return np.array(all_features), np.array(all_targets), all_stock_codes, all_dates
+
+
+@pytest.mark.parametrize('days_to_predict', [1, 5])
+@pytest.mark.parametrize('with_beta', [False, True])
+def test_prepare_features_matches_the_row_loop(days_to_predict, with_beta):
+    stock_data = make_stocks()
+    beta_values = pd.DataFrame({'stock_code': ['HOSE:AAA', 'HOSE:BBB', 'HOSE:CCC'], 'beta': [0.8, 1.1, 1.5]}) \
+        if with_beta else None
+
+    X, y, codes, dates = prepare_features(stock_data, beta_values, days_to_predict)
+    X_ref, y_ref, codes_ref, dates_ref = baseline_prepare_features(stock_data, beta_values, days_to_predict)
+
+    np.testing.assert_allclose(X, X_ref, rtol=1e-12)
+    np.testing.assert_array_equal(y, y_ref)
+    assert codes == codes_ref
+    assert [pd.Timestamp(date) for date in dates] == [pd.Timestamp(date) for date in dates_ref]
+
+
+def test_batched_predictions_match_per_row_predictions():
+    X, y, _, _ = prepare_features(make_stocks(), None, 5)
+    scaler = StandardScaler().fit(X)
+    model = SVC(kernel='rbf', C=1.0, gamma='scale', random_state=42, probability=True,
+                class_weight='balanced').fit(scaler.transform(X), y)
+
+    classes, confidences = predict_stock_movements(model, scaler, X)
+    labels, signals = get_prediction_labels(classes, confidences)
+
+    for i, features in enumerate(X):
+        prediction, confidence = predict_stock_movement(model, scaler, features)
+        assert classes[i] == prediction
+        assert confidences[i] == pytest.approx(confidence[0], rel=1e-12)
+        assert (labels[i], signals[i]) == get_prediction_label(prediction, confidence)
+
+
+def test_charts_are_rendered_in_memory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    predictions = [{'prediction': label, 'confidence': confidence}
+                   for label, confidence in zip([-1, 0, 1, 1], [0.4, 0.6, 0.7, 0.9])]
+
+    images = [plot_confusion_matrix(np.eye(3, dtype=int)), plot_confidence_distribution(predictions)]
+
+    assert all(base64.b64decode(image).startswith(PNG_SIGNATURE) for image in images)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_concurrent_renders_do_not_mix_figures():
+    matrices = [np.full((3, 3), value) for value in range(1, 9)]
+    expected = [plot_confusion_matrix(cm) for cm in matrices]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        images = list(executor.map(plot_confusion_matrix, matrices))
+
+    assert images == expected
+
+
+def test_n_jobs_defaults_to_the_core_count(monkeypatch):
+    monkeypatch.delenv('SVM_N_JOBS', raising=False)
+    assert get_svm_n_jobs() == (os.cpu_count() or 1)
+
+    monkeypatch.setenv('SVM_N_JOBS', '3')
+    assert get_svm_n_jobs() == 3
+    assert get_svm_n_jobs(2) == 2
+
+
+@pytest.mark.parametrize('value', ['0', '-1', 'all'])
+def test_n_jobs_rejects_values_that_are_not_positive(monkeypatch, value):
+    monkeypatch.setenv('SVM_N_JOBS', value)
+    with pytest.raises(ValueError, match='SVM_N_JOBS'):
+        get_svm_n_jobs()
@@ -0,0 +1,103 @@
+import argparse
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+from pathlib import Path
+
+# Thêm thư mục hiện tại vào sys.path để Python tìm thấy các module
+sys.path.append(str(Path(__file__).parent))
+
+from services.jobs import (JOB_LEASE_SECONDS, JOB_TYPES, claim_job, clear_current_job, complete_job,
+                           fail_job, renew_lease, set_current_job)
+
+
+def run_job(app, job):
+    """
+    Execute one job by dispatching its endpoint inside a request context
+
+    The endpoint code path is exactly the one used by synchronous requests;
+    its response body is stored as the job result.
+    """
+    path = JOB_TYPES.get(job['type'])
+    if path is None:
+        fail_job(app.db, job, f"Unknown job type: {job['type']}")
+        return
+
+    set_current_job(app.db, job)
+    try:
+        with app.test_request_context(path, method='POST', json=job.get('params') or {}):
+            response = app.full_dispatch_request()
+            if not complete_job(app.db, job, response.status_code, response.get_data(), response.content_type):
+                print(f"Job {job['_id']}: lease lost, result discarded")
+    except Exception as e:
+        traceback.print_exc()
+        fail_job(app.db, job, str(e))
+    finally:
+        clear_current_job()
+
+
+def _keep_lease(app, job, stop):
+    """Heartbeat thread renewing the lease of a running job"""
+    while not stop.wait(JOB_LEASE_SECONDS / 3):
+        if not renew_lease(app.db, job):
+            print(f"Job {job['_id']}: lease lost")
+            return
+
+
+def worker_loop(worker_index, poll_interval=1.0):
+    """Claim and run jobs forever; each worker process builds its own app and MongoClient"""
+    from app import create_app
+
+    app = create_app()
+    if not app.db_connected:
+        print(f"Worker {worker_index}: database connection not available")
+        return
+
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    print(f"Worker {worker_id} started")
+
+    while True:
+        job = claim_job(app.db, worker_id)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+
+        print(f"Worker {worker_id} running job {job['_id']} ({job['type']})")
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=_keep_lease, args=(app, job, stop), daemon=True)
+        heartbeat.start()
+        try:
+            run_job(app, job)
+        finally:
+            stop.set()
+            heartbeat.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run background analysis job workers")
+    parser.add_argument('--workers', type=int, default=int(os.getenv('JOB_WORKERS', '2')),
+                        help="Number of worker processes (JOB_WORKERS, default 2)")
+    parser.add_argument('--poll-interval', type=float, default=1.0,
+                        help="Seconds to wait between polls when the queue is empty")
+    args = parser.parse_args()
+    workers = max(args.workers, 1)
+
+    # Chia số nhân CPU cho các worker: mỗi worker tự mở SVM_N_JOBS tiến trình tìm tham số
+    os.environ.setdefault('SVM_N_JOBS', str(max(1, (os.cpu_count() or 1) // workers)))
+
+    processes = []
+    for index in range(workers):
+        process = multiprocessing.Process(target=worker_loop, args=(index, args.poll_interval))
+        process.start()
+        processes.append(process)
+
+    for process in processes:
+        process.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+import os
+import sys
+from pathlib import Path
+
+# Thêm thư mục hiện tại vào sys.path để Python tìm thấy các module
+sys.path.append(str(Path(__file__).parent))
+
+from app import create_app
+from services.warmup import warmup
+
+# Entry point WSGI cho máy chủ pre-fork: gunicorn -c gunicorn.conf.py wsgi:application
+application = create_app()
+
+# Nạp trước module và dữ liệu giá trước khi nhận request (WARMUP=0 để tắt).
+# Với preload_app, bước này chạy một lần trong tiến trình master trước khi fork
+if os.getenv("WARMUP", "1") == "1":
+    warmup(application)
+
+app = application
@@ -11,6 +11,9 @@ const collections = [
   "imports",
   "market_index_imports",
   "portfolio_betas",
+  "latest_snapshot",
+  "market_nav",
+  "stream_bars",
   "items"
 ];
 
@@ -1,12 +1,11 @@
 import React, { useState } from 'react';
-import Papa from 'papaparse';
-import * as XLSX from 'xlsx';
 import SVMDataAnalysis from './SVMDataAnalysis';
 import './App.css';
 
 function DataImport({ onClose }) {
   const currentDate = "2025-04-29";
   const [importedData, setImportedData] = useState([]);
+  const [importedCount, setImportedCount] = useState(0);
   const [loading, setLoading] = useState(false);
   const [success, setSuccess] = useState(false);
   const [error, setError] = useState("");
@@ -21,6 +20,33 @@ function DataImport({ onClose }) {
     return <SVMDataAnalysis onClose={onClose} onMenuChange={handleMenuChange} />;
   }
 
+  // Gửi file lên backend, file được đọc và lưu theo từng phần phía server
+  const uploadFile = async (file, endpoint, label) => {
+    try {
+      const formData = new FormData();
+      formData.append('file', file);
+
+      const response = await fetch(`http://localhost:5001/api/${endpoint}`, {
+        method: 'POST',
+        body: formData
+      });
+
+      const result = await response.json();
+      if (response.ok) {
+        setImportedData(result.preview || []);
+        setImportedCount(result.records_count || 0);
+        setSuccess(true);
+        alert(`${label} đã được import thành công: ${result.message}`);
+      } else {
+        setError(result.error || `Lỗi khi lưu ${label.toLowerCase()}`);
+      }
+    } catch (err) {
+      setError(`Lỗi khi gửi ${label.toLowerCase()}: ${err.message}`);
+    } finally {
+      setLoading(false);
+    }
+  };
+
   // Xử lý import file CSV
   const handleCsvImport = (e) => {
     setLoading(true);
@@ -34,23 +60,7 @@ function DataImport({ onClose }) {
     }
     
     setFileName(file.name);
-    
-    Papa.parse(file, {
-      header: true,
-      complete: (results) => {
-        if (results.data && results.data.length > 0) {
-          setImportedData(results.data);
-          sendDataToBackend(results.data);
-        } else {
-          setError("Không thể đọc dữ liệu từ file CSV.");
-        }
-        setLoading(false);
-      },
-      error: (error) => {
-        setError(`Lỗi khi xử lý file CSV: ${error.message}`);
-        setLoading(false);
-      }
-    });
+    uploadFile(file, 'import-data/upload', 'Dữ liệu');
   };
 
   // Xử lý import file chỉ số thị trường (Market Index)
@@ -66,114 +76,13 @@ function DataImport({ onClose }) {
     }
     
     setFileName(file.name);
-    
-    // Xác định loại file (CSV hay Excel) và xử lý phù hợp
-    if (file.name.endsWith('.csv')) {
-      // Xử lý CSV cho market index
-      Papa.parse(file, {
-        header: true,
-        complete: (results) => {
-          if (results.data && results.data.length > 0) {
-            setImportedData(results.data);
-            sendMarketIndexToBackend(results.data);
-          } else {
-            setError("Không thể đọc dữ liệu từ file CSV VNIndex.");
-          }
-          setLoading(false);
-        },
-        error: (error) => {
-          setError(`Lỗi khi xử lý file CSV VNIndex: ${error.message}`);
-          setLoading(false);
-        }
-      });
-    } else if (file.name.endsWith('.xlsx') || file.name.endsWith('.xls')) {
-      // Xử lý Excel cho market index
-      const reader = new FileReader();
-      
-      reader.onload = (e) => {
-        try {
-          const data = e.target.result;
-          const workbook = XLSX.read(data, { type: 'binary' });
-          const sheetName = workbook.SheetNames[0];
-          const worksheet = workbook.Sheets[sheetName];
-          const jsonData = XLSX.utils.sheet_to_json(worksheet);
-          
-          if (jsonData && jsonData.length > 0) {
-            setImportedData(jsonData);
-            sendMarketIndexToBackend(jsonData);
-          } else {
-            setError("Không thể đọc dữ liệu từ file Excel VNIndex.");
-          }
-        } catch (err) {
-          setError(`Lỗi khi xử lý file Excel VNIndex: ${err.message}`);
-        }
-        setLoading(false);
-      };
-      
-      reader.onerror = () => {
-        setError("Lỗi khi đọc file VNIndex");
-        setLoading(false);
-      };
-      
-      reader.readAsBinaryString(file);
-    } else {
-      setError("Định dạng file không được hỗ trợ. Vui lòng chọn file CSV hoặc Excel.");
-      setLoading(false);
-    }
-  };
-
-  // Gửi dữ liệu đến backend
-  const sendDataToBackend = async (data) => {
-    try {
-      setLoading(true);
 
-      const response = await fetch('http://localhost:5001/api/import-data', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({ data })
-      });
-
-      const result = await response.json();
-      if (response.ok) {
-        setSuccess(true);
-        alert(`Dữ liệu đã được import thành công: ${result.message}`);
-      } else {
-        setError(result.error || "Lỗi khi lưu dữ liệu");
-      }
-
-    } catch (err) {
-      setError(`Lỗi khi gửi dữ liệu: ${err.message}`);
-    } finally {
-      setLoading(false);
-    }
-  };
-
-  // Gửi dữ liệu chỉ số thị trường đến backend
-  const sendMarketIndexToBackend = async (data) => {
-    try {
-      setLoading(true);
-
-      const response = await fetch('http://localhost:5001/api/import-market-index', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({ data })
-      });
-
-      const result = await response.json();
-      if (response.ok) {
-        setSuccess(true);
-        alert(`Dữ liệu VNIndex đã được import thành công: ${result.message}`);
-      } else {
-        setError(result.error || "Lỗi khi lưu dữ liệu VNIndex");
-      }
-
-    } catch (err) {
-      setError(`Lỗi khi gửi dữ liệu VNIndex: ${err.message}`);
-    } finally {
+    // Backend hỗ trợ file CSV và Excel (.xlsx, .xls)
+    const name = file.name.toLowerCase();
+    if (name.endsWith('.csv') || name.endsWith('.xlsx') || name.endsWith('.xls')) {
+      uploadFile(file, 'import-market-index/upload', 'Dữ liệu VNIndex');
+    } else {
+      setError("Định dạng file không được hỗ trợ. Vui lòng chọn file CSV hoặc Excel (.xlsx, .xls).");
       setLoading(false);
     }
   };
@@ -184,11 +93,14 @@ function DataImport({ onClose }) {
       setLoading(true);
       setError("");
 
-      const response = await fetch('http://localhost:5001/api/stock-data');
+      // Chỉ lấy một trang với các cột cần hiển thị
+      const fields = 'MarketCode,Ticker,TradeDate,OpenPrice,HighestPrice,LowestPrice,ClosePrice,TotalVolume';
+      const response = await fetch(`http://localhost:5001/api/stock-data?limit=100&fields=${fields}`);
       const data = await response.json();
 
       if (response.ok && data.length > 0) {
         setImportedData(data);
+        setImportedCount(data.length);
         alert(`Đã tải ${data.length} bản ghi từ MongoDB`);
       } else {
         setError("Không có dữ liệu hoặc lỗi khi lấy dữ liệu");
@@ -302,7 +214,7 @@ function DataImport({ onClose }) {
                 
                 {importedData.length > 0 && (
                   <div className="data-preview">
-                    <h4>Dữ liệu  đã nhập ({importedData.length} dòng):</h4>
+                    <h4>Dữ liệu  đã nhập ({importedCount} dòng):</h4>
                     <div className="preview-table-container">
                       <table className="preview-table">
                         <thead>
@@ -322,9 +234,9 @@ function DataImport({ onClose }) {
                           ))}
                         </tbody>
                       </table>
-                      {importedData.length > 5 && (
+                      {importedCount > 5 && (
                         <div className="more-data-note">
-                          <p>Hiển thị 5/{importedData.length} dòng dữ liệu </p>
+                          <p>Hiển thị 5/{importedCount} dòng dữ liệu </p>
                         </div>
                       )}
                     </div>
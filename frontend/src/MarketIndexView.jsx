@@ -19,7 +19,9 @@ function MarketIndexView({ onClose, onMenuChange }) {
       setLoading(true);
       setError("");
       
-      const response = await fetch('http://localhost:5001/api/market-index-data');
+      // Chỉ lấy một trang với các cột hiển thị trong bảng
+      const fields = 'TradeDate,IndexCode,OpenIndex,HighestIndex,LowestIndex,CloseIndex,TotalVolume,TotalValue';
+      const response = await fetch(`http://localhost:5001/api/market-index-data?limit=100&fields=${fields}`);
       const data = await response.json();
       
       if (response.ok && data.length > 0) {